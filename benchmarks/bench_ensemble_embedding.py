@@ -0,0 +1,71 @@
+"""Benchmark of the embeddings of the individual results of a large ensemble.
+
+Builds a synthetic model x state table (50000 models by default, over a few
+thousand states, each model reaching a few dozen of them), then embeds it in 2D
+the way the plotting methods did, with a full PCA refitted on the dense table at
+each call, and with fit_embedding, which fits a PCA of the sparse table once
+(the plotting methods then reuse its coordinates). Then times an incremental
+PCA and a truncated SVD of the sparse table, and the projection of a second
+ensemble in the fitted embedding.
+
+Usage: python benchmarks/bench_ensemble_embedding.py [nb_models] [nb_states] [nb_calls]
+"""
+
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from maboss.ensemble.embedding import fit_embedding, transform_embedding
+
+
+def random_table(nb_models, nb_states, rng, states_per_model=30):
+    # Models of the same family reach states of the same subset, so that the table has a structure to embed
+    families = rng.randint(0, 5, size=nb_models)
+    subsets = [rng.choice(nb_states, size=nb_states // 10, replace=False) for _ in range(5)]
+    cols = np.concatenate([rng.choice(subsets[family], size=states_per_model) for family in families])
+    rows = np.repeat(np.arange(nb_models), states_per_model)
+    matrix = csr_matrix((rng.rand(len(rows)), (rows, cols)), shape=(nb_models, nb_states))
+    return csr_matrix(matrix.multiply(1.0 / matrix.sum(axis=1)))
+
+
+def main(nb_models=50000, nb_states=3000, nb_calls=3):
+    from sklearn.decomposition import PCA
+
+    rng = np.random.RandomState(0)
+    table = random_table(nb_models, nb_states, rng)
+    compare = random_table(nb_models // 10, nb_states, rng)
+    print("%d models, %d states, %d non zero probabilities" % (nb_models, nb_states, table.nnz))
+
+    start = time.time()
+    for _ in range(nb_calls):
+        dense = table.toarray()
+        pca = PCA().fit(dense)
+        pca.transform(dense)
+        del dense
+    print("full PCA, at each call      %6.2f s (%d calls)" % (time.time() - start, nb_calls))
+
+    start = time.time()
+    sparse_pca, _ = fit_embedding(table, "auto")
+    print("fit_embedding, sparse PCA   %6.2f s, then cached" % (time.time() - start))
+
+    start = time.time()
+    ipca, _ = fit_embedding(table, "ipca")
+    print("fit_embedding, incremental  %6.2f s" % (time.time() - start))
+    print("explained variance          %.3f (full PCA), %.3f (sparse), %.3f (incremental)" % (
+        pca.explained_variance_ratio_[:2].sum(), sparse_pca.explained_variance_ratio_.sum(),
+        ipca.explained_variance_ratio_.sum()
+    ))
+
+    start = time.time()
+    fit_embedding(table, "svd")
+    print("truncated SVD               %6.2f s" % (time.time() - start))
+
+    start = time.time()
+    transform_embedding(sparse_pca, compare)
+    print("projection of %6d models %6.2f s" % (compare.shape[0], time.time() - start))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,115 @@
+"""Benchmark of the loading of the individual results of an ensemble.
+
+Writes a synthetic ensemble of individual probtraj files (10000 models by
+default, each with a few hundred time points over a dozen nodes), then builds
+the model x state table of their last states twice : once with one StoredResult
+per model, concatenated with pandas, and once with load_individual_states_distribution.
+Then computes the nodes distributions, per model and with make_nodes_distribution,
+and filters the models with a compiled condition. Finally packs the individual
+results in a single file, and reads them back, all at once and by model.
+
+Usage: python benchmarks/bench_ensemble_results.py [nb_models] [nb_timepoints] [workers]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from maboss.ensemble.result import get_single_individual_states_distribution, load_individual_states_distribution, \
+    get_single_individual_nodes_distribution, make_nodes_distribution, apply_filter
+from maboss.ensemble.individual import IndividualResultsStore, pack_individual_results
+from maboss.results.storedresult import StoredResult
+
+nodes = ["N%d" % i for i in range(12)]
+
+
+def random_state(rng):
+    active = [node for node in nodes if rng.random() < 0.3]
+    return " -- ".join(active) if len(active) > 0 else "<nil>"
+
+
+def write_probtraj(filename, nb_timepoints, rng):
+    nb_states = rng.randint(1, 20)
+    with open(filename, "w") as probtraj:
+        probtraj.write("Time\tTH\tErrorTH\tH\tHD=0" + "\tState\tProba\tErrorProba" * nb_states + "\n")
+        for t in range(nb_timepoints):
+            states = set(random_state(rng) for _ in range(nb_states))
+            probs = [rng.random() for _ in states]
+            total = sum(probs)
+            line = ["%g" % (t * 0.5), "0", "0", "0", "0"]
+            line += ["%s\t%g\t0" % (state, proba / total) for state, proba in zip(states, probs)]
+            probtraj.write("\t".join(line) + "\n")
+
+
+def main(nb_models=10000, nb_timepoints=200, workers=os.cpu_count()):
+    path = tempfile.mkdtemp()
+    try:
+        rng = random.Random(0)
+        for model in range(nb_models):
+            write_probtraj(os.path.join(path, "res_model_%d_probtraj.csv" % model), nb_timepoints, rng)
+        print("%d models, %d timepoints, %d workers" % (nb_models, nb_timepoints, workers))
+
+        start = time.time()
+        tables = [
+            get_single_individual_states_distribution(StoredResult(path, "res_model_%d" % model), model)
+            for model in range(nb_models)
+        ]
+        expected = pd.concat(tables, axis=0, sort=False).fillna(0)
+        print("StoredResult + concat       %6.2f s, table %s" % (time.time() - start, expected.shape))
+
+        start = time.time()
+        table = load_individual_states_distribution(path, "res", nb_models, workers)
+        print("tail reader + state matrix  %6.2f s, table %s" % (time.time() - start, table.shape))
+
+        pd.testing.assert_frame_equal(table, expected)
+
+        sample = table.index[:min(nb_models, 20)]
+        start = time.time()
+        nodes_expected = pd.concat(
+            [get_single_individual_nodes_distribution(table, index, sorted(nodes)) for index in sample], axis=0
+        )
+        elapsed = (time.time() - start) * len(table.index) / len(sample)
+        print("nodes, per model            %6.2f s (estimated from %d models)" % (elapsed, len(sample)))
+
+        start = time.time()
+        nodes_table = make_nodes_distribution(table)
+        print("nodes, incidence product    %6.2f s, table %s" % (time.time() - start, nodes_table.shape))
+        pd.testing.assert_frame_equal(nodes_table.loc[sample], nodes_expected)
+
+        start = time.time()
+        filtered = apply_filter(nodes_table, "N0 > 0.5 and N1 < 0.1")
+        print("compiled filter             %6.2f s, %d models" % (time.time() - start, len(filtered)))
+
+        models = rng.sample(range(nb_models), min(nb_models, 200))
+        start = time.time()
+        for model in models:
+            StoredResult(path, "res_model_%d" % model).get_states_probtraj()
+        print("trajectories, StoredResult  %6.2f s (%d models)" % (time.time() - start, len(models)))
+
+        start = time.time()
+        pack_individual_results(path, "res", nb_models, trajectories=True, workers=workers)
+        size = sum(os.path.getsize(os.path.join(path, "res_individual.%s" % ext)) for ext in ["npz", "json"])
+        print("pack with trajectories      %6.2f s, %.1f MB" % (time.time() - start, size / 1024.0 / 1024.0))
+
+        start = time.time()
+        store = IndividualResultsStore(path, "res")
+        packed_table = store.get_states_distribution()
+        print("table from packed file      %6.2f s" % (time.time() - start))
+        pd.testing.assert_frame_equal(packed_table, expected)
+
+        start = time.time()
+        for model in models:
+            store.get_states_trajectory(model)
+        print("trajectories, packed file   %6.2f s (%d models)" % (time.time() - start, len(models)))
+
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
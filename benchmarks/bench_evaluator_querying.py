@@ -0,0 +1,63 @@
+"""Benchmark of the simulations run by MaBoSSEvaluator.querying.
+
+Evaluates queries on the p53_Mdm2 model of test, each one with its own
+mutation (and some with a compare option), so that querying needs one
+simulation per distinct mutation plus the master one. Runs them one after
+the other (workers=1), as querying did before, then at the same time on a
+pool of threads. Then runs the queries twice with the cache of the evaluator (cache=True) :
+the second call reuses all the simulations of the first one.
+
+Usage: python benchmarks/bench_evaluator_querying.py [workers]
+"""
+
+import contextlib
+import io
+import itertools
+import os
+import sys
+import time
+import warnings
+
+from maboss.temporal_logic.evaluator import MaBoSSEvaluator
+
+nodes = ["p53", "p53_h", "Mdm2C", "Mdm2N", "Dam"]
+
+
+def make_queries():
+    queries = []
+    for node, state in itertools.product(nodes, ["ON", "OFF"]):
+        queries.append("Inc(node:p53) / [ ] [ %s:%s ]" % (node, state))
+        queries.append("Dec(node:Mdm2C) / [ ] [ %s:%s ] [ compare:Dam:%s ]" % (node, state, state))
+    return queries
+
+
+def main(workers=None):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "test")
+    bnd, cfg = os.path.join(path, "p53_Mdm2.bnd"), os.path.join(path, "p53_Mdm2_runcfg.cfg")
+    queries = make_queries()
+    print("%d queries, %d CPUs" % (len(queries), os.cpu_count() or 1))
+
+    nb_results = []
+    for nb_workers in [1, workers]:
+        start = time.time()
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter("ignore")
+            results = MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], workers=nb_workers)
+        print("workers=%-4s %6.2f s, %d queries evaluated" % (nb_workers, time.time() - start, len(results)))
+        nb_results.append(len(results))
+    assert nb_results[0] == nb_results[1]
+
+    for call in ["first call", "second call"]:
+        start = time.time()
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter("ignore")
+            results = MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], workers=workers,
+                                               cache=True)
+        reused = sum(1 for origin in MaBoSSEvaluator.cache_report.values() if origin in ["memory", "disk"])
+        print("cache, %s %6.2f s, %d simulations reused" % (call, time.time() - start, reused))
+        assert len(results) == nb_results[0]
+    MaBoSSEvaluator.invalidate_cache()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
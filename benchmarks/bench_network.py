@@ -0,0 +1,76 @@
+"""Benchmark of the memory footprint and copy time of Network objects.
+
+Builds a synthetic network of 1024 nodes, holds many copies of it (as done for
+model variants in ensembles or parameter sweeps), and reports the memory used
+by the copies and the time needed to create them. It also compares the time
+needed to set and write a joint initial state over thousands of states, as
+done at each step of UPMaBoSS, with set_istate and set_istate_distribution.
+
+Usage: python benchmarks/bench_network.py [nb_nodes] [nb_copies]
+"""
+
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+from maboss.network import Node, Network
+
+
+def make_network(nb_nodes):
+    names = ["N%d" % i for i in range(nb_nodes)]
+    nodes = [
+        Node(name, "%s & !%s" % (names[i-1], names[(i+1) % nb_nodes]), "@logic ? 1.0 : 0.0", "@logic ? 0.0 : 1.0")
+        for i, name in enumerate(names)
+    ]
+    network = Network(nodes)
+    for i, name in enumerate(names):
+        if i % 3 == 0:
+            network.set_istate(name, [0.3, 0.7])
+        elif i % 3 == 1:
+            network.set_istate(name, [1, 0])
+    return network
+
+
+def main(nb_nodes=1024, nb_copies=1000):
+    network = make_network(nb_nodes)
+
+    tracemalloc.start()
+    start = time.time()
+    copies = [network.copy() for _ in range(nb_copies)]
+    elapsed = time.time() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("%d copies of a %d nodes network" % (len(copies), nb_nodes))
+    print("copy time : %.2f ms per network" % (1000*elapsed/nb_copies))
+    print("memory : %.1f kB per network" % (memory/1024/nb_copies))
+
+    start = time.time()
+    for _ in range(100):
+        network.str_istate()
+    print("str_istate : %.2f ms" % (1000*(time.time() - start)/100))
+
+    nb_states = 5000
+    nb_bound = min(nb_nodes, 200)
+    bound_nodes = network.names[:nb_bound]
+    state_matrix = numpy.random.default_rng(0).integers(0, 2, size=(nb_states, nb_bound))
+    probs = numpy.full(nb_states, 1.0/nb_states)
+
+    start = time.time()
+    istate = {}
+    for state, proba in zip(map(tuple, state_matrix.tolist()), probs.tolist()):
+        istate[state] = istate.get(state, 0) + proba
+    network.set_istate(bound_nodes, istate, warnings=False)
+    network.str_istate()
+    print("set_istate + str_istate, %d states : %.2f ms" % (nb_states, 1000*(time.time() - start)))
+
+    start = time.time()
+    network.set_istate_distribution(bound_nodes, state_matrix, probs, warnings=False)
+    network.str_istate()
+    print("set_istate_distribution + str_istate, %d states : %.2f ms" % (nb_states, 1000*(time.time() - start)))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,113 @@
+"""Benchmark of the analytics of PopMaBoSS results.
+
+Runs the PopMaBoSS models of test/pop (with more samples and time points than
+the tests), then computes the distribution of the population sizes, the
+expected activity ratio of each node and the probabilities of the
+(node, number of cells), twice : once with the loops parsing each population
+state at each time point, as they were written before the PopStates table, and
+once with the PopMaBoSSResult methods, which decode each population state once.
+
+Usage: python benchmarks/bench_pop_analytics.py [sample_count] [time_tick]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from maboss import PopSimulation
+from maboss.pop.popresult import parse_pop_state
+
+models = [
+    ("Assymetric.pbnd", "Assymetric.cfg", 10),
+    ("Fork.bnd", "Fork.pcfg", 10),
+    ("Log_Growth.pbnd", "Log_Growth.cfg", 10),
+]
+
+
+def loop_nb_dists(raw_probas, indexes, states):
+    sizes = sorted(set(sum(parse_pop_state(state).values()) for state in states))
+    sizes_indexes = {size: index for index, size in enumerate(sizes)}
+    raw_nb_dists = np.zeros((len(indexes), len(sizes)))
+    for i in range(len(indexes)):
+        for j, state in enumerate(states):
+            nb = sum(parse_pop_state(state).values())
+            raw_nb_dists[i, sizes_indexes[nb]] += raw_probas[i][j]
+    return pd.DataFrame(raw_nb_dists, columns=sizes, index=indexes)
+
+
+def loop_activity_ratio_expected(raw_probas, indexes, states, node):
+    activity_ratio = []
+    for i in range(len(indexes)):
+        activity = 0
+        for j, state in enumerate(states):
+            popstates = parse_pop_state(state)
+            nb = sum(popstates.values())
+            for substate, pop in popstates.items():
+                if substate != "<nil>" and node in substate.split(" -- "):
+                    activity += raw_probas[i][j] * pop / nb
+        activity_ratio.append(activity)
+    return pd.Series(activity_ratio, index=indexes, name=node)
+
+
+def loop_nodes_probtraj(raw_probas, indexes, states):
+    popnodes = set()
+    for state in states:
+        for substate, pop in parse_pop_state(state).items():
+            if substate != "<nil>":
+                popnodes.update("{%s:%s}" % (node, pop) for node in substate.split(" -- "))
+    popnodes = sorted(popnodes, key=lambda popnode: (popnode[1:-1].split(":")[0], int(popnode[1:-1].split(":")[1])))
+    popnodes_index = {popnode: index for index, popnode in enumerate(popnodes)}
+
+    new_probs = np.zeros((len(indexes), len(popnodes)))
+    for i in range(len(indexes)):
+        for j, state in enumerate(states):
+            for substate, pop in parse_pop_state(state).items():
+                if substate != "<nil>":
+                    for node in substate.split(" -- "):
+                        new_probs[i, popnodes_index["{%s:%s}" % (node, pop)]] += raw_probas[i][j]
+    return pd.DataFrame(new_probs, columns=popnodes, index=indexes)
+
+
+def main(sample_count=20000, time_tick=0.1):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "test", "pop")
+    for network, cfg, max_time in models:
+        sim = PopSimulation(os.path.join(path, network), os.path.join(path, cfg))
+        sim.update_parameters(sample_count=sample_count, max_time=max_time, time_tick=time_tick)
+        res = sim.run()
+        raw_probas, indexes, states, _ = res.get_raw_states_probtraj()
+        nodes = res.get_pop_states(states).nodes
+        print("%s : %d time points, %d population states, nodes %s" % (
+            network, len(indexes), len(states), ", ".join(nodes)
+        ))
+
+        start = time.time()
+        expected = loop_nb_dists(raw_probas, indexes, states)
+        print("  sizes, loops              %6.2f s" % (time.time() - start))
+        start = time.time()
+        nb_dists = res.get_nb_dists()
+        print("  sizes, PopStates          %6.2f s" % (time.time() - start))
+        pd.testing.assert_frame_equal(nb_dists, expected)
+
+        start = time.time()
+        expected = [loop_activity_ratio_expected(raw_probas, indexes, states, node) for node in nodes]
+        print("  ratios, loops             %6.2f s" % (time.time() - start))
+        start = time.time()
+        ratios = [res.get_activity_ratio_expected(node) for node in nodes]
+        print("  ratios, PopStates         %6.2f s" % (time.time() - start))
+        for t_ratios, t_expected in zip(ratios, expected):
+            pd.testing.assert_series_equal(t_ratios, t_expected)
+
+        start = time.time()
+        expected = loop_nodes_probtraj(raw_probas, indexes, states)
+        print("  nodes probtraj, loops     %6.2f s" % (time.time() - start))
+        start = time.time()
+        nodes_probtraj = res.get_nodes_probtraj()
+        print("  nodes probtraj, PopStates %6.2f s" % (time.time() - start))
+        pd.testing.assert_frame_equal(nodes_probtraj, expected)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000, float(sys.argv[2]) if len(sys.argv) > 2 else 0.1)
@@ -0,0 +1,42 @@
+"""Benchmark of a batch of PopMaBoSS simulations.
+
+Runs variants of the Assymetric model of test/pop (different seeds and
+sample counts), once in a loop over PopSimulation.run, applying the
+overrides with update_parameters, and once with PopSimulation.run_batch,
+which runs the variants in a pool of forked processes and returns their
+simple probtrajs as arrays.
+
+Usage: python benchmarks/bench_pop_batch.py [nb_variants] [sample_count] [workers]
+"""
+
+import os
+import sys
+import time
+
+from maboss import PopSimulation
+
+
+def main(nb_variants=16, sample_count=5000, workers=os.cpu_count()):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "test", "pop")
+    sim = PopSimulation(os.path.join(path, "Assymetric.pbnd"), os.path.join(path, "Assymetric.cfg"))
+    sim.update_parameters(max_time=8)
+    variants = [{"seed_pseudorandom": seed, "sample_count": sample_count} for seed in range(nb_variants)]
+    print("%d variants, %d workers" % (nb_variants, workers))
+
+    start = time.time()
+    popsizes = []
+    for variant in variants:
+        sim.update_parameters(**variant)
+        popsizes.append(sim.run().get_simple_popsize())
+    print("loop over run       %6.2f s" % (time.time() - start))
+
+    start = time.time()
+    batch = sim.run_batch(variants, workers=workers)
+    print("run_batch           %6.2f s, %d errors" % (time.time() - start, len(batch.errors)))
+
+    table = batch.get_simple_popsizes()
+    assert all(abs(table.loc[i].values - popsizes[i].values).max() < 1e-12 for i in range(nb_variants))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
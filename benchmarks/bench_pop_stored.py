@@ -0,0 +1,70 @@
+"""Benchmark of the random access to the time points of a stored PopMaBoSS result.
+
+Runs the Assymetric model of test/pop with many time points, writes its results
+in a temporary directory, then reads each time point of the stored result :
+once by scanning the probtraj file from the top for each time point, as
+_get_raw_data_by_index did before the lines index, and once with
+get_states_probtraj_by_index, which seeks to the line. Then iterates over all the
+time points with iter_states_probtraj.
+
+Usage: python benchmarks/bench_pop_stored.py [max_time] [time_tick]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from maboss import PopSimulation
+from maboss.pop.storedpopresult import StoredPopResult, parse_probtraj_line, line_is_hexfloat
+
+
+def scan_line(filename, index):
+    with open(filename, 'r') as probtraj:
+        for i, line in enumerate(probtraj):
+            if i == 0:
+                first_index = line.strip("\n").split("\t").index("State")
+            if i == index + 1:
+                return parse_probtraj_line(line, first_index, line_is_hexfloat(line, first_index))
+
+
+def main(max_time=50, time_tick=0.05):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "test", "pop")
+    workdir = tempfile.mkdtemp()
+    try:
+        sim = PopSimulation(os.path.join(path, "Assymetric.pbnd"), os.path.join(path, "Assymetric.cfg"))
+        sim.update_parameters(max_time=max_time, time_tick=time_tick, sample_count=200)
+        sim.run(workdir=workdir)
+
+        res = StoredPopResult(sim, workdir)
+        filename = res.get_probtraj_file()
+        nb_timepoints = sum(1 for _ in open(filename)) - 1
+        print("%d time points, %.1f MB" % (nb_timepoints, os.path.getsize(filename) / 1024.0 / 1024.0))
+
+        start = time.time()
+        for index in range(nb_timepoints):
+            scan_line(filename, index)
+        print("scan from the top      %6.2f s" % (time.time() - start))
+
+        start = time.time()
+        res._get_lines_index()
+        print("lines index, build     %6.2f s" % (time.time() - start))
+
+        start = time.time()
+        res = StoredPopResult(sim, workdir)
+        for index in range(nb_timepoints):
+            res.get_states_probtraj_by_index(index)
+        print("seek, saved index      %6.2f s" % (time.time() - start))
+
+        start = time.time()
+        for _ in res.iter_states_probtraj():
+            pass
+        print("iter_states_probtraj   %6.2f s" % (time.time() - start))
+
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main(*[float(arg) for arg in sys.argv[1:]])
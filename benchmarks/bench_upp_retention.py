@@ -0,0 +1,77 @@
+"""Benchmark of the memory used by the retention policies of UPMaBoSS runs.
+
+Runs the CellFate UPMaBoSS model of the test suite for 200 steps, once per
+retention policy ("all", "last_states" and "disk"), each in a fresh process.
+Reports the peak resident memory of the process, the space left in the
+temporary directory while the results are alive, and the run time.
+
+Usage: python benchmarks/bench_upp_retention.py [nb_steps] [sample_count] [--binary]
+
+By default the steps are simulated with cMaBoSS. With --binary, they are
+simulated with the MaBoSS executable, which writes each step to a temporary
+directory.
+"""
+
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from os.path import dirname, join
+
+test_dir = join(dirname(dirname(os.path.abspath(__file__))), "test")
+
+
+def directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def run_policy(retention, nb_steps, sample_count, cmaboss, queue):
+    import maboss
+
+    sim = maboss.load(join(test_dir, "CellFateModel.bnd"), join(test_dir, "CellFateModel_1h.cfg"))
+    sim.param["sample_count"] = sample_count
+    upp = maboss.UpdatePopulation(sim, join(test_dir, "CellFate_1h.upp"))
+    upp.setStepNumber(nb_steps)
+
+    tmp_before = directory_size(tempfile.gettempdir())
+    start = time.time()
+    result = upp.run(cmaboss=cmaboss, retention=retention)
+    elapsed = time.time() - start
+    tmp_used = directory_size(tempfile.gettempdir()) - tmp_before
+
+    table = result.get_stepwise_probability_distribution()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    queue.put((elapsed, peak, tmp_used / 1024.0 / 1024.0, table.shape))
+
+
+def main(nb_steps=200, sample_count=1000, cmaboss=True):
+    context = multiprocessing.get_context("spawn")
+    print("%d steps, %d samples, %s" % (nb_steps, sample_count, "cMaBoSS" if cmaboss else "MaBoSS"))
+    for retention in ["all", "last_states", "disk"]:
+        queue = context.Queue()
+        process = context.Process(target=run_policy, args=(retention, nb_steps, sample_count, cmaboss, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print("%-12s failed" % retention)
+            continue
+
+        elapsed, peak, tmp_used, shape = queue.get()
+        print(
+            "%-12s peak memory %7.1f MB, temporary files %7.1f MB, run %6.1f s, table %s"
+            % (retention, peak, tmp_used, elapsed, shape)
+        )
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(*[int(arg) for arg in args], cmaboss="--binary" not in sys.argv)
@@ -2,19 +2,49 @@ from .network import *
 from .simulation import *
 from .result import *
 from .results import *
-from .gsparser import load, loadBNet, loadSBML, loadTabularQual
-from .server import MaBoSSClient
-from .upp import UpdatePopulation
-from .ensemble import EnsembleResult, Ensemble
-from .pop import PopSimulation
-import platform 
-import maboss.pipelines
-from . import temporal_logic
-from .temporal_logic import MaBoSSEvaluator
-
-from colomoto_jupyter import IN_IPYTHON
+from .gsparser import load, load_many, loadBNet, loadSBML, loadTabularQual
+import importlib
+import os
+import platform
+import shutil
+import sys
+
+# Plotting, ensemble analytics, widgets and temporal logic pull in heavy
+# dependencies (matplotlib, sklearn, networkx, IPython). They are only
+# imported on first access (PEP 562), so that batch scripts which just
+# load and run models start quickly.
+_lazy_attributes = {
+    "MaBoSSClient": ".server",
+    "UpdatePopulation": ".upp",
+    "EnsembleResult": ".ensemble",
+    "Ensemble": ".ensemble",
+    "PopSimulation": ".pop",
+    "MaBoSSEvaluator": ".temporal_logic",
+}
+
+_lazy_submodules = ["pipelines", "temporal_logic", "upp", "ensemble", "pop", "server", "widgets", "figures"]
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        value = getattr(importlib.import_module(_lazy_attributes[name], __name__), name)
+    elif name in _lazy_submodules:
+        value = importlib.import_module("." + name, __name__)
+    else:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_lazy_attributes.keys()) | set(_lazy_submodules))
+
 import colomoto.setup_helper
 
+# colomoto_jupyter imports pandas and networkx, we only need it inside IPython
+if "IPython" in sys.modules:
+    from colomoto_jupyter import IN_IPYTHON
+else:
+    IN_IPYTHON = False
+
 if IN_IPYTHON:
     from colomoto_jupyter import jupyter_setup
     from .widgets import *
@@ -46,3 +76,10 @@ if shutil.which(bin_name) is None:
             os.environ["PATH"] = "%s;%s" % (bin_path, os.environ["PATH"])
         else:
             os.environ["PATH"] = "%s:%s" % (bin_path, os.environ["PATH"])
+
+# Without __all__, "from maboss import *" would only export the modules already imported :
+# it also exports the lazy attributes and the submodules imported before they became lazy
+__all__ = sorted(
+    set(name for name in globals() if not name.startswith("_") and name not in ["importlib", "sys"])
+    | set(_lazy_attributes.keys()) | set(["pipelines", "temporal_logic", "upp", "ensemble", "pop", "server"])
+)
@@ -1,2 +1,5 @@
 from .result import EnsembleResult
-from .ensemble import Ensemble
\ No newline at end of file
+from .individual import IndividualResultsStore
+from .shards import ShardedEnsembleResult, JobRunner, LocalJobRunner
+from .ensemble import Ensemble
+from .cache import clear_cache
\ No newline at end of file
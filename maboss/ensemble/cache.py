@@ -0,0 +1,354 @@
+from __future__ import print_function
+
+import os
+import stat
+import zlib
+import atexit
+import shutil
+import socket
+import hashlib
+import tempfile
+import multiprocessing
+from zipfile import ZipFile
+
+# Above this size (in bytes), the least recently used files of the cache are removed
+max_cache_size = 2 << 30
+
+# Digest and nodes of the models already read, by (path, modification time, size)
+_models_index = {}
+
+# Digest, members, and CRC and size of each member of the zip files already read, by (path, modification time, size)
+_zips_index = {}
+
+# Folders of the zip files extracted by this process, which are not evicted from the cache
+_zips_in_use = set()
+
+# Prefix of the lease files, kept in the folders of the zip files by the processes using them
+lease_prefix = ".lease-"
+
+
+def get_default_cache_dir():
+    """Return the cache directory of the current user : ~/.cache/maboss, or a folder of the temporary directory named after the user"""
+    home_cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    if os.path.isdir(os.path.dirname(home_cache)) and os.access(os.path.dirname(home_cache), os.W_OK):
+        return os.path.join(home_cache, "maboss")
+
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), "maboss-cache-%s" % user)
+
+def get_cache_root(cache_dir=None):
+    """Return (and create) the root directory of the cache, only readable by the current user"""
+    path = get_default_cache_dir() if cache_dir is None else cache_dir
+    if not os.path.exists(path):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    if cache_dir is None and hasattr(os, "getuid"):
+        # The files of the default cache are trusted : it must not be shared with other users
+        path_stat = os.stat(path)
+        if path_stat.st_uid != os.getuid() or path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise PermissionError("The cache directory %s must be owned by the current user, and only writable by them" % path)
+    return path
+
+def get_cache_dir(cache_dir=None, kind=None):
+    """Return (and create) the cache directory, or its sub-directory for a kind of files"""
+    path = get_cache_root(cache_dir)
+    if kind is not None:
+        path = os.path.join(path, kind)
+        if not os.path.exists(path):
+            os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+def clear_cache(cache_dir=None):
+    """
+    Remove all the files of the cache : mutated models and members extracted from zip files
+
+    :param cache_dir: (optional) root directory of the cache, default to the cache of the current user
+    """
+    path = get_default_cache_dir() if cache_dir is None else cache_dir
+    for kind in ["models", "zips"]:
+        if os.path.exists(os.path.join(path, kind)):
+            shutil.rmtree(os.path.join(path, kind))
+    _zips_in_use.clear()
+
+def evict_cache(cache_dir=None, max_size=None):
+    """
+    Remove the least recently used entries of the cache, until its size is below max_size.
+    The entries are the mutated models (with the digest of their content), and the folders of the zip files,
+    which are only removed if they are not used by this process, and have no lease of another live process.
+    Models hard linked in the folder of a run stay available to this run.
+
+    :param cache_dir: (optional) root directory of the cache
+    :param max_size: (optional) maximum size of the cache in bytes, default to max_cache_size
+    """
+    max_size = max_cache_size if max_size is None else max_size
+    root = get_cache_root(cache_dir)
+
+    entries = []
+    models_path = os.path.join(root, "models")
+    if os.path.exists(models_path):
+        for entry in os.scandir(models_path):
+            if entry.is_file() and entry.name.endswith(".bnet"):
+                entry_stat = entry.stat()
+                size = entry_stat.st_size
+                if os.path.exists(digest_path(entry.path)):
+                    size += os.path.getsize(digest_path(entry.path))
+                entries.append((entry_stat.st_mtime, size, entry.path))
+
+    zips_path = os.path.join(root, "zips")
+    if os.path.exists(zips_path):
+        for entry in os.scandir(zips_path):
+            if entry.is_dir():
+                size = sum(
+                    member.stat().st_size for member in os.scandir(entry.path)
+                    if member.is_file() and not member.name.startswith(lease_prefix)
+                )
+                entries.append((entry.stat().st_mtime, size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if path in _zips_in_use or is_leased(path):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            for entry_path in [digest_path(path), path]:
+                if os.path.exists(entry_path):
+                    os.remove(entry_path)
+        total -= size
+    return total
+
+def content_digest(content):
+    return hashlib.sha1(content.encode() if isinstance(content, str) else content).hexdigest()
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_atomic(path, content, mode='w'):
+    """Write a file of the cache aside then rename it, so that other processes never read a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    with os.fdopen(fd, mode) as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def read_model_index(model_path):
+    """Return the digest of a bnet file, and the set of its nodes"""
+    model_stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), model_stat.st_mtime_ns, model_stat.st_size)
+    if key not in _models_index:
+        with open(model_path, 'r') as model_file:
+            nodes = set(
+                line.split(",", 1)[0].strip().replace("-", "_")
+                for line in model_file if "," in line
+            )
+        _models_index[key] = (file_digest(model_path), nodes)
+    return _models_index[key]
+
+def mutated_model_name(model_path, mutations):
+    """
+    Return the name of a mutated model in the cache : the digest of the source model, and of the mutations
+    of its nodes. Only these mutations change its content, so models without any mutated node are shared
+    by all the mutation sets. The name is known without writing the mutated model
+    """
+    digest, nodes = read_model_index(model_path)
+    mutated_nodes = sorted((node, value) for node, value in mutations.items() if node in nodes)
+    return content_digest(repr((digest, mutated_nodes)))
+
+def digest_path(cached_path):
+    """Return the path of the file keeping the digest of the content of a cache entry"""
+    return os.path.splitext(cached_path)[0] + ".sha1"
+
+def mutate_bnet_content(model_path, mutations):
+    lines = []
+    with open(model_path, 'r') as model_file:
+        for line in model_file:
+            var, formula = line.split(",")
+            var = var.strip().replace("-", "_")
+
+            if var in mutations.keys():
+                if mutations[var] == 'ON':
+                    lines.append("%s, %d\n" % (var, 1))
+
+                elif mutations[var] == 'OFF':
+                    lines.append("%s, %d\n" % (var, 0))
+
+                else:
+                    print("Unknown mutation %s for node %s. Ignored" % (mutations[var], var))
+            else:
+                lines.append("%s, %s\n" % (var, formula.strip().replace("-", "_")))
+    return "".join(lines)
+
+def _write_mutated_model(task):
+    model_path, mutations, cached_path = task
+    content = mutate_bnet_content(model_path, mutations)
+    write_atomic(cached_path, content)
+    # The digest is written last : an entry without it is never used
+    write_atomic(digest_path(cached_path), content_digest(content))
+
+def is_valid_entry(cached_path):
+    """
+    Check that a file of the cache exists and has the content recorded by its digest file,
+    and mark it as recently used
+    """
+    try:
+        with open(digest_path(cached_path), 'r') as f:
+            digest = f.read().strip()
+    except OSError:
+        return False
+
+    if not os.path.exists(cached_path) or file_digest(cached_path) != digest:
+        return False
+    os.utime(cached_path)
+    return True
+
+def write_mutated_models(models_files, mutations, path, cache_dir=None, workers=1):
+    """
+    Write the mutated bnet models in the models folder of path, and return their new paths.
+    The mutated models are kept in the cache, named after the digest of the source model and of
+    its mutated nodes, and hard linked into path. The models missing from the cache (or whose
+    content does not match its recorded digest) are the only ones mutated, by workers processes.
+
+    :param models_files: the bnet models
+    :param mutations: dict of the mutations, such as {"AHR": "ON"}
+    :param path: directory of the simulation
+    :param cache_dir: (optional) root directory of the cache
+    :param workers: (optional) number of processes writing the missing models
+    """
+    store = get_cache_dir(cache_dir, "models")
+
+    cached_paths = []
+    tasks = {}
+    for model in models_files:
+        cached_path = os.path.join(store, mutated_model_name(model, mutations) + ".bnet")
+        cached_paths.append(cached_path)
+        if cached_path not in tasks and not is_valid_entry(cached_path):
+            tasks[cached_path] = (model, mutations, cached_path)
+
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks.values():
+            _write_mutated_model(task)
+    else:
+        with multiprocessing.Pool(processes=workers) as pool:
+            pool.map(_write_mutated_model, list(tasks.values()), chunksize=max(1, len(tasks)//(workers*4)))
+
+    new_models = []
+    for model, cached_path in zip(models_files, cached_paths):
+        new_path = os.path.join(path, "models", os.path.basename(model))
+        link_or_copy(cached_path, new_path)
+        new_models.append(new_path)
+
+    if len(tasks) > 0:
+        evict_cache(cache_dir)
+    return new_models
+
+def _read_zip_infos(zip_path):
+    zip_stat = os.stat(zip_path)
+    key = (os.path.abspath(zip_path), zip_stat.st_mtime_ns, zip_stat.st_size)
+    if key not in _zips_index:
+        with ZipFile(zip_path) as zin:
+            infos = dict(
+                (info.filename, (info.CRC, info.file_size)) for info in zin.infolist()
+                if not info.is_dir() and "/" not in info.filename
+            )
+        _zips_index[key] = (file_digest(zip_path), list(infos.keys()), infos)
+    return _zips_index[key]
+
+def read_zip_index(zip_path):
+    """Return the digest of a zip file, and the names of the files at its root"""
+    digest, names, _ = _read_zip_infos(zip_path)
+    return digest, names
+
+def is_valid_member(member_path, crc, size):
+    """Check that a member extracted from a zip file has the CRC and size recorded in the zip"""
+    if not os.path.exists(member_path) or os.path.getsize(member_path) != size:
+        return False
+    with open(member_path, 'rb') as f:
+        return zlib.crc32(f.read()) & 0xffffffff == crc
+
+def lease_name():
+    """Return the name of the lease file of the current process"""
+    return "%s%s-%d" % (lease_prefix, socket.gethostname(), os.getpid())
+
+def is_process_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process : its lease is kept until it removes it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def is_leased(path):
+    """
+    Check whether a folder of the cache has the lease of a live process. The leases of the processes
+    which ended on this host are removed, the leases of other hosts are always kept.
+    """
+    if not os.path.isdir(path):
+        return False
+    leased = False
+    host = socket.gethostname()
+    for entry in os.scandir(path):
+        if not entry.name.startswith(lease_prefix):
+            continue
+        lease_host, _, pid = entry.name[len(lease_prefix):].rpartition("-")
+        if lease_host != host or not pid.isdigit() or is_process_alive(int(pid)):
+            leased = True
+        else:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    return leased
+
+def take_lease(path):
+    """Write the lease of the current process in a folder of the cache, removed when the process ends"""
+    open(os.path.join(path, lease_name()), 'w').close()
+    _zips_in_use.add(path)
+
+@atexit.register
+def release_leases():
+    for path in _zips_in_use:
+        try:
+            os.remove(os.path.join(path, lease_name()))
+        except OSError:
+            pass
+
+def extract_zip_members(zip_path, members, cache_dir=None):
+    """
+    Extract members of a zip file in its folder of the cache, named after the digest of the zip,
+    and return this folder. Members already extracted, by this process or another one, are checked
+    against the CRC of the zip, but are not extracted again. The folder is leased by this process, so that
+    the eviction run by other processes keeps it while this process is alive.
+
+    :param zip_path: the zip file
+    :param members: the names of the members to extract
+    :param cache_dir: (optional) root directory of the cache
+    """
+    digest, _, infos = _read_zip_infos(zip_path)
+    path = get_cache_dir(cache_dir, os.path.join("zips", digest))
+    take_lease(path)
+    os.utime(path)
+
+    missing = [member for member in members if not is_valid_member(os.path.join(path, member), *infos[member])]
+    if len(missing) > 0:
+        with ZipFile(zip_path) as zin:
+            for member in missing:
+                write_atomic(os.path.join(path, member), zin.read(member), 'wb')
+        evict_cache(cache_dir)
+    return path
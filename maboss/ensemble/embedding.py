@@ -0,0 +1,89 @@
+from __future__ import print_function
+
+import inspect
+import numpy as np
+
+# Above this number of models, the embeddings are fitted on the sparse table, and applied by batches
+large_ensemble = 10000
+
+embedding_methods = ["auto", "pca", "ipca", "svd", "tsne"]
+
+
+def make_embedding_key(features, columns, filter, method, n_components, params):
+    return (features, tuple(columns), filter, method, n_components, tuple(sorted(params.items())))
+
+def fit_embedding(matrix, method="auto", n_components=2, batch_size=None, **params):
+    """
+    Fit a dimensionality reduction of the rows of matrix, and return the fitted model with the coordinates of the rows
+
+    :param matrix: dense array or sparse matrix, one row per model
+    :param method: "pca", "ipca" (incremental PCA, by batches), "svd" (truncated SVD, without centering) or "tsne".
+        "auto" is "pca", fitted on the dense table for small ensembles, and on the sparse table for large ones
+    :param n_components: (optional) number of dimensions of the embedding
+    :param batch_size: (optional) number of models in each batch of the incremental PCA
+    :param params: (optional) parameters of the sklearn estimator
+    """
+    from scipy.sparse import issparse, csr_matrix
+
+    if method == "auto":
+        method = "pca"
+
+    if method == "pca":
+        from sklearn.decomposition import PCA
+        if issparse(matrix) and matrix.shape[0] >= large_ensemble and n_components < min(matrix.shape):
+            # The sparse table is centered implicitly by the arpack solver, without being densified
+            try:
+                model = PCA(n_components=n_components, svd_solver="arpack", **params).fit(csr_matrix(matrix))
+            except TypeError:
+                # Older versions of sklearn only fit PCA on dense tables
+                return fit_embedding(matrix, "ipca", n_components, batch_size, **params)
+            return model, transform_embedding(model, matrix)
+
+        dense = matrix.toarray() if issparse(matrix) else matrix
+        model = PCA(n_components=min(n_components, *dense.shape), **params).fit(dense)
+        return model, model.transform(dense)
+
+    if method == "ipca":
+        from sklearn.decomposition import IncrementalPCA
+        sparse = csr_matrix(matrix)
+        if batch_size is None:
+            batch_size = max(5*sparse.shape[1], 1000)
+        model = IncrementalPCA(n_components=n_components, batch_size=batch_size, **params).fit(sparse)
+        return model, transform_embedding(model, sparse, batch_size)
+
+    if method == "svd":
+        from sklearn.decomposition import TruncatedSVD
+        model = TruncatedSVD(n_components=n_components, **params)
+        return model, model.fit_transform(csr_matrix(matrix))
+
+    if method == "tsne":
+        from sklearn.manifold import TSNE
+        # T-SNE works on distances : large tables are first reduced by a truncated SVD
+        if matrix.shape[1] > 50 and matrix.shape[0] >= large_ensemble:
+            _, matrix = fit_embedding(matrix, "svd", n_components=50)
+        elif issparse(matrix):
+            matrix = matrix.toarray()
+
+        if "n_iter" in params and "n_iter" not in inspect.signature(TSNE.__init__).parameters:
+            params["max_iter"] = params.pop("n_iter")
+        model = TSNE(n_components=n_components, **params)
+        return model, model.fit_transform(matrix)
+
+    raise ValueError("Unknown embedding method %s, must be one of %s" % (method, ", ".join(embedding_methods)))
+
+def transform_embedding(model, matrix, batch_size=None):
+    """Return the coordinates of the rows of matrix in a fitted embedding, computed by batches for large matrices"""
+    from scipy.sparse import issparse, csr_matrix
+
+    if not hasattr(model, "transform"):
+        raise ValueError("%s embeddings cannot be applied to other models" % type(model).__name__)
+
+    if matrix.shape[0] < large_ensemble:
+        return model.transform(matrix.toarray() if issparse(matrix) else matrix)
+
+    sparse = csr_matrix(matrix)
+    if batch_size is None:
+        batch_size = max(5*sparse.shape[1], 1000)
+    return np.vstack([
+        model.transform(sparse[i:i+batch_size].toarray()) for i in range(0, sparse.shape[0], batch_size)
+    ])
@@ -1,6 +1,9 @@
 from __future__ import print_function
 
 from .result import EnsembleResult
+from .shards import ShardedEnsembleResult
+from .rules import RulesTable
+from .cache import write_mutated_models, mutate_bnet_content, read_zip_index, extract_zip_members
 from ..simulation import _default_parameter_list
 from ..gsparser import load, _read_cfg
 import os
@@ -11,10 +14,6 @@ from random import random
 import shutil
 import collections
 import math
-import atexit
-from zipfile import ZipFile
-import tempfile
-import shutil
 
 from colomoto import minibn
 
@@ -27,15 +26,17 @@ class Ensemble(object):
         :param individual_istates: (optional) dictionnary containing the initial states of each model
         :param individual_mutations: (optional) dictionnary containing the mutations of each model
         :param models: (optional) list of the sub-ensemble of models within the path to simulate
+        :param cache_dir: (optional) directory where the mutated models are kept between runs, default to the cache of the current user (~/.cache/maboss)
         
     """
         
-    def __init__(self, path, cfg_filename=None, individual_istates=collections.OrderedDict(), individual_mutations=collections.OrderedDict(), individual_cfgs=None, models=None, *args, **kwargs):
+    def __init__(self, path, cfg_filename=None, individual_istates=collections.OrderedDict(), individual_mutations=collections.OrderedDict(), individual_cfgs=None, models=None, cache_dir=None, *args, **kwargs):
 
         self.individual_cfgs = collections.OrderedDict() if individual_cfgs is None else individual_cfgs
         self.models_files = []
+        self.cache_dir = cache_dir
 
-        self.set_models_path(path)
+        self.set_models_path(path, models)
         
         self.param = _default_parameter_list
         self.param["use_physrandgen"] = 0
@@ -48,6 +49,7 @@ class Ensemble(object):
 
         self.minibns = None
         self.miniensemble = None
+        self.rules_table = None
 
         self.nodes = []
         self.read_nodes(self.models_files[0])
@@ -98,7 +100,7 @@ class Ensemble(object):
         .. py:method:: Returns a new copy of the simulation
         
         """
-        ensemble = Ensemble(self.models_path)
+        ensemble = Ensemble(self.source_path, cache_dir=self.cache_dir, models=[os.path.basename(model) for model in self.models_files])
         ensemble.param = self.param.copy()
         ensemble.variables = self.variables.copy()
         ensemble.istates = self.istates.copy()
@@ -111,6 +113,7 @@ class Ensemble(object):
         ensemble.models_files = self.models_files.copy()
         ensemble.nodes = self.nodes.copy()
         ensemble.mutations = self.mutations.copy()
+        ensemble.rules_table = self.rules_table
         return ensemble
 
     def get_maboss_cmd(self):
@@ -131,39 +134,56 @@ class Ensemble(object):
 
         return maboss_cmd
 
-    def run(self, workdir=None, overwrite=False, prefix="res"):
+    def run(self, workdir=None, overwrite=False, prefix="res", shards=None, runner=None):
         """
         .. py:method:: Run the simulation and return a :doc:`ensemblemaboss-api-ensemble` object.
         
         :param workdir: (optional) directory where the simulation is to be executed
         :param overwrite: (optional) overwrite a previous simulation in the same workdir
         :param prefix: (optional) prefix of the simulation results files 
+        :param shards: (optional) split the models in this number of groups, simulated by independent MaBoSS processes
+        :param runner: (optional) JobRunner running the shards, default to local processes
         
         """
+        if shards is not None and shards > 1:
+            return ShardedEnsembleResult(self, shards, workdir, overwrite, prefix, runner)
+
         return EnsembleResult(self, workdir, overwrite, prefix)
         # return EnsembleResult(self.models_files, self._cfg, "res", self.individual_results, self.random_sampling)
 
-    def set_models_path(self, path):
+    def set_models_path(self, path, models=None):
         """
         .. py:method:: Set a new path for the models
         
         :param path: folder with bnet files, or zip file with bnet files
+        :param models: (optional) list of the sub-ensemble of models, only these ones are extracted from a zip file
         
         """
+        self.source_path = path
         if path.lower().endswith(".zip"):
-            self.models_path = tempfile.mkdtemp(prefix="maboss-ensemble")
-            def cleanup(d):
-                shutil.rmtree(d)
-            atexit.register(cleanup, self.models_path)
-            with ZipFile(path) as zin:
-                zin.extractall(self.models_path)
+            # The zip is indexed once, and its members are extracted on demand in a folder
+            # of the cache named after its digest, shared by all the ensembles using it
+            _, filenames = read_zip_index(path)
+            available = set(filenames)
+            if models is not None:
+                selected = set(models)
+                filenames = [filename for filename in filenames if filename in selected]
+
+            members = [filename for filename in filenames if filename.endswith(".bnet") or filename.endswith(".bnd")]
+            members += [
+                os.path.splitext(filename)[0] + ".cfg" for filename in members 
+                if (os.path.splitext(filename)[0] + ".cfg") in available
+            ]
+            self.models_path = extract_zip_members(path, members, self.cache_dir)
         else:
             self.models_path = path
+            filenames = os.listdir(self.models_path)
+            available = set(filenames)
         
-        for filename in sorted(os.listdir(self.models_path)):
+        for filename in sorted(filenames):
             if filename.endswith(".bnet") or filename.endswith(".bnd"):
                 self.models_files.append(os.path.join(self.models_path, filename))
-                if (os.path.splitext(filename)[0] + ".cfg") in os.listdir(self.models_path):
+                if (os.path.splitext(filename)[0] + ".cfg") in available:
                     self.individual_cfgs.update({
                         os.path.join(self.models_path, filename) : os.path.join(self.models_path, os.path.splitext(filename)[0] + ".cfg")
                     })
@@ -244,48 +264,39 @@ class Ensemble(object):
 
         return self.minibns
 
-    def get_mini_ensemble(self, cluster=None):
+    def get_rules_table(self):
+        """
+        .. py:method:: Returns the table of the rules of the models, interned once and shared by the copies of the ensemble
         
-        minibns = self.get_mini_bns()
+        """
+        if self.rules_table is None or self.rules_table.models_files != self.models_files:
+            for model_file in self.models_files:
+                assert model_file.lower().endswith(".bnet"), \
+                        "Only .bnet files are supported as input"
+            self.rules_table = RulesTable(self.models_files, int(self.param["thread_count"]))
 
-        if cluster is not None:
-            minibns = [minibn for i, minibn in enumerate(minibns) if i in cluster]
+        return self.rules_table
 
-        miniensemble = {node:set() for node in minibns[0].keys()}
-        for minibn in minibns:
-            for node in minibn.keys():
-                miniensemble[node].add(minibn[node])
+    def get_mini_ensemble(self, cluster=None):
+        return dict(self.get_rules_table().get_rules(cluster))
 
-        return miniensemble
+    def _get_nodes_selection_counts(self, cluster=None):
+        nodes_selection = collections.OrderedDict()
+        for node, (nb_rules, nb_nodes) in self.get_rules_table().get_rules_counts(cluster).items():
+            nodes_selection.update({
+                node: ((nb_rules/(pow(2, pow(2, nb_nodes-1)-1))) if nb_nodes > 0 else math.nan, nb_rules, nb_nodes)
+            })
+        return nodes_selection
 
     def print_ensemble_stats(self, cluster=None):
 
-        mini_ensemble = self.get_mini_ensemble(cluster)
-        nodes_selection_rate = {}
-
-        for node, list_rules in mini_ensemble.items():
-            
-            nb_rules = len(list_rules)
-            nb_nodes = len(next(iter(list_rules)).symbols)
-            
-            nodes_selection_rate.update({
-                node: (nb_rules/(pow(2, pow(2, nb_nodes-1)-1))) if nb_nodes > 0 else math.nan
-            })
-            print("%s : %g (%d, %d)" % (node, nodes_selection_rate[node] , nb_rules, nb_nodes))
+        for node, (rate, nb_rules, nb_nodes) in self._get_nodes_selection_counts(cluster).items():
+            print("%s : %g (%d, %d)" % (node, rate, nb_rules, nb_nodes))
 
     def get_nodes_selection_rate(self, cluster=None):
-        mini_ensemble = self.get_mini_ensemble(cluster)
-        nodes_selection_rate = {}
-        
-        for node, list_rules in mini_ensemble.items():
-            nb_rules = len(list_rules)
-            nb_nodes = len(next(iter(list_rules)).symbols)
-
-            nodes_selection_rate.update({
-                node: (nb_rules/(pow(2, pow(2, nb_nodes-1)-1))) if nb_nodes > 0 else math.nan
-            })
-
-        
+        nodes_selection_rate = {
+            node: rate for node, (rate, _, _) in self._get_nodes_selection_counts(cluster).items()
+        }
         return collections.OrderedDict(sorted(nodes_selection_rate.items(), key=lambda kv: kv[1]))
 
     def compare_nodes_selection_rate(self, cluster):
@@ -392,40 +403,16 @@ class Ensemble(object):
                     cfg_file.write(self.str_cfg(individual))
 
     def write_models(self, path):
-        new_models = []
-
-        for model in self.models_files:
-            if os.path.splitext(model)[1] == ".bnet":
-                new_models.append(self.mutate_bnet(model, path))
-        self.models_files = new_models
+        self.models_files = write_mutated_models(
+            [model for model in self.models_files if os.path.splitext(model)[1] == ".bnet"],
+            self.mutations, path, self.cache_dir, int(self.param["thread_count"])
+        )
 
     def mutate_bnet(self, model_path, path):
         new_path = os.path.join(path, "models", os.path.basename(model_path))
 
-        with open(model_path, 'r') as model_file, open(new_path, 'w+') as new_model_file:
-            for line in model_file:
-                var, formula = line.split(",")
-                var = var.strip()
-
-                while "-" in var:
-                    var = var.replace("-", "_")
-
-                if var in self.mutations.keys():
-                    if self.mutations[var] == 'ON':
-                        new_model_file.write("%s, %d\n" % (var, 1))
-
-                    elif self.mutations[var] == 'OFF':
-                        new_model_file.write("%s, %d\n" % (var, 0))
-
-                    else:
-                        print("Unknown mutation %s for node %s. Ignored" % (self.mutations[var], var))
-                else:
-                    formula = formula.strip()
-
-                    while "-" in formula:
-                        formula = formula.replace("-", "_")
-
-                    new_model_file.write("%s, %s\n" % (var, formula))
+        with open(new_path, 'w+') as new_model_file:
+            new_model_file.write(mutate_bnet_content(model_path, self.mutations))
 
         return new_path
 
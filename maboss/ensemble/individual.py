@@ -0,0 +1,219 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import math
+import struct
+import zipfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+
+def get_individual_files(path, prefix):
+    return os.path.join(path, "%s_individual.npz" % prefix), os.path.join(path, "%s_individual.json" % prefix)
+
+def read_individual_results(task):
+    """
+    Return the last states of each probtraj file, and optionally all its time points,
+    as lists of (states, probabilities). None if the file is empty
+    """
+    from .result import read_last_line
+
+    filenames, trajectories = task
+    results = []
+    for filename in filenames:
+        if os.path.getsize(filename) == 0:
+            results.append(None)
+            continue
+
+        with open(filename, 'r') as probtraj:
+            first_col = probtraj.readline().strip("\n").split("\t").index("State")
+            lines = probtraj.readlines() if trajectories else [read_last_line(filename)]
+
+        rows = []
+        for line in lines:
+            data = line.strip("\n").split("\t")
+            if len(data) <= first_col:
+                continue
+            states = data[first_col::3]
+            order = sorted(range(len(states)), key=states.__getitem__)
+            rows.append((float(data[0]), [states[i] for i in order], [float(data[first_col+1+3*i]) for i in order]))
+        results.append(rows)
+    return results
+
+def pack_individual_results(path, prefix, nb_models, trajectories=False, remove=False, workers=1):
+    """
+    Pack the individual results of an ensemble simulation in a single container : an uncompressed .npz file
+    with the arrays of the probabilities, and a .json file with the states names. The probabilities of each
+    model are contiguous in the arrays, so that they can be read by model index without loading the others.
+
+    :param path: directory of the ensemble results
+    :param prefix: prefix of the ensemble results files
+    :param nb_models: number of models in the ensemble
+    :param trajectories: (optional) also pack the probabilities at each time point, not only the last states
+    :param remove: (optional) remove the probtraj files of the models once packed, only if trajectories are packed
+    :param workers: (optional) number of processes reading the files
+    """
+    from .result import fix_order
+
+    filenames = [
+        os.path.join(path, "%s_model_%d_probtraj.csv" % (prefix, model))
+        for model in range(nb_models)
+    ]
+    if workers <= 1 or nb_models <= 1:
+        results = read_individual_results((filenames, trajectories))
+    else:
+        chunk_size = int(math.ceil(nb_models/float(workers*4)))
+        tasks = [(filenames[i:i+chunk_size], trajectories) for i in range(0, nb_models, chunk_size)]
+        with multiprocessing.Pool(processes=workers) as pool:
+            results = [rows for chunk in pool.map(read_individual_results, tasks) for rows in chunk]
+
+    # The states of the last time points are numbered first, in the order of the models,
+    # so that the columns of the distribution table are the same as when reading the files
+    states_index = {}
+    arrays = {"final_indptr": [0], "final_states": [], "final_probas": [], "models": []}
+    for model, rows in enumerate(results):
+        if rows is None or len(rows) == 0:
+            arrays["final_indptr"].append(arrays["final_indptr"][-1])
+            continue
+        arrays["models"].append(model)
+        _, states, probas = rows[-1]
+        arrays["final_states"] += [states_index.setdefault(fix_order(state), len(states_index)) for state in states]
+        arrays["final_probas"] += probas
+        arrays["final_indptr"].append(len(arrays["final_states"]))
+    nb_final_states = len(states_index)
+
+    if trajectories:
+        arrays.update({"traj_indptr": [0], "times": [], "rows_indptr": [0], "traj_states": [], "traj_probas": []})
+        for rows in results:
+            for time, states, probas in (rows or []):
+                arrays["times"].append(time)
+                arrays["traj_states"] += [states_index.setdefault(fix_order(state), len(states_index)) for state in states]
+                arrays["traj_probas"] += probas
+                arrays["rows_indptr"].append(len(arrays["traj_states"]))
+            arrays["traj_indptr"].append(len(arrays["times"]))
+
+    dtypes = {
+        "final_probas": np.float64, "traj_probas": np.float64, "times": np.float64,
+        "final_states": np.int32, "traj_states": np.int32
+    }
+    npz_filename, json_filename = get_individual_files(path, prefix)
+    with open(npz_filename + ".tmp", 'wb') as npz_file:
+        np.savez(npz_file, **{
+            name: np.array(values, dtype=dtypes.get(name, np.int64)) for name, values in arrays.items()
+        })
+    with open(json_filename + ".tmp", 'w') as json_file:
+        json.dump({
+            "nb_models": nb_models, "states": list(states_index.keys()),
+            "nb_final_states": nb_final_states, "trajectories": trajectories
+        }, json_file)
+    # The index is replaced last : until then, a previous index is removed so that it never describes the new arrays
+    if os.path.exists(json_filename):
+        os.remove(json_filename)
+    os.replace(npz_filename + ".tmp", npz_filename)
+    os.replace(json_filename + ".tmp", json_filename)
+
+    if remove and trajectories:
+        # Only the probtraj files are packed : the fixed points and stationary distributions of the models are kept
+        for filename in filenames:
+            os.remove(filename)
+    elif remove:
+        print("The trajectories of the models were not packed, their files are kept", file=sys.stderr)
+
+    return npz_filename
+
+def map_npz_arrays(filename):
+    """Return the arrays of an uncompressed .npz file, mapped in memory instead of read"""
+    arrays = {}
+    with zipfile.ZipFile(filename) as zin, open(filename, 'rb') as npz_file:
+        for info in zin.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("%s is compressed, its arrays cannot be mapped" % filename)
+
+            # The data of a member starts after its local header, and its variable length fields
+            npz_file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", npz_file.read(4))
+            npz_file.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(npz_file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz_file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz_file)
+
+            name = os.path.splitext(info.filename)[0]
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    filename, dtype=dtype, mode='r', offset=npz_file.tell(), shape=shape,
+                    order='F' if fortran_order else 'C'
+                )
+    return arrays
+
+
+class IndividualResultsStore(object):
+    """
+        .. py:class:: Individual results of an ensemble simulation, packed by pack_individual_results
+
+        :param path: directory of the ensemble results
+        :param prefix: (optional) prefix of the ensemble results files
+    """
+
+    def __init__(self, path, prefix="res"):
+        npz_filename, json_filename = get_individual_files(path, prefix)
+        with open(json_filename, 'r') as json_file:
+            index = json.load(json_file)
+
+        self.nb_models = index["nb_models"]
+        self.states = index["states"]
+        self.nb_final_states = index["nb_final_states"]
+        self.trajectories = index["trajectories"]
+        self._arrays = map_npz_arrays(npz_filename)
+
+    @staticmethod
+    def exists(path, prefix="res"):
+        return all(os.path.exists(filename) for filename in get_individual_files(path, prefix))
+
+    def get_states_distribution(self):
+        """Return a Panda Dataframe with the states final probability of each model"""
+        models = np.asarray(self._arrays["models"])
+        indptr = np.asarray(self._arrays["final_indptr"])
+        counts = np.diff(indptr)
+
+        rows = np.repeat(np.arange(len(self._arrays["final_indptr"])-1), counts)
+        row_index = np.full(self.nb_models, -1)
+        row_index[models] = np.arange(len(models))
+
+        matrix = np.zeros((len(models), self.nb_final_states))
+        matrix[row_index[rows], np.asarray(self._arrays["final_states"])] = self._arrays["final_probas"]
+        return pd.DataFrame(matrix, index=models.tolist(), columns=self.states[:self.nb_final_states])
+
+    def get_last_states(self, model):
+        """Return a Panda Series with the states final probability of a model"""
+        start, end = self._arrays["final_indptr"][model], self._arrays["final_indptr"][model+1]
+        return pd.Series(
+            np.array(self._arrays["final_probas"][start:end]),
+            index=[self.states[state] for state in self._arrays["final_states"][start:end]]
+        )
+
+    def get_states_trajectory(self, model):
+        """Return a Panda Dataframe with the states probability of a model at each time point"""
+        if not self.trajectories:
+            print("The trajectories of the models were not packed", file=sys.stderr)
+            return None
+
+        first, last = self._arrays["traj_indptr"][model], self._arrays["traj_indptr"][model+1]
+        indptr = np.asarray(self._arrays["rows_indptr"][first:last+1])
+        states = np.asarray(self._arrays["traj_states"][indptr[0]:indptr[-1]])
+        probas = np.asarray(self._arrays["traj_probas"][indptr[0]:indptr[-1]])
+
+        columns, inverse = np.unique(states, return_inverse=True)
+        matrix = np.zeros((last-first, len(columns)))
+        matrix[np.repeat(np.arange(last-first), np.diff(indptr)), inverse] = probas
+        return pd.DataFrame(
+            matrix, index=np.asarray(self._arrays["times"][first:last]),
+            columns=[self.states[state] for state in columns]
+        )
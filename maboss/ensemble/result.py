@@ -2,31 +2,45 @@ from __future__ import print_function
 
 from ..results.baseresult import BaseResult
 from ..results.storedresult import StoredResult
+from .individual import IndividualResultsStore, pack_individual_results, get_individual_files
+from .embedding import fit_embedding, transform_embedding, make_embedding_key
 import os
 import tempfile
 import subprocess
 import sys
 from random import random
 import shutil
-from sklearn.decomposition import PCA
-from sklearn.manifold import TSNE
-from sklearn.cluster import KMeans
 import numpy as np
 import multiprocessing
 import pandas as pd
-import matplotlib.pyplot as plt 
 from re import match
 import ast
 import math
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.patches as mpatches
 
 class EnsembleResult(BaseResult):
   
     # def __init__(self, models_files, cfg_filename, prefix="res", individual_results=False, random_sampling=False):
     def __init__(self, simulation, workdir=None, overwrite=False, prefix="res"):
 
+        self._init_workdir(simulation, workdir, overwrite, prefix)
+        cmd_line, self.models_files = make_ensemble_command(simulation, self._path, self.prefix)
+
+        res = subprocess.Popen(
+            cmd_line,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        std_out, std_err = res.communicate()
+        self._err = res.returncode
+        if self._err != 0:
+            print("Error, MaBoSS returned non 0 value", file=sys.stderr)
+            print(std_err.decode())
+        
+        if len(std_out.decode()) > 0:
+            print(std_out.decode())
+
+    def _init_workdir(self, simulation, workdir, overwrite, prefix):
+
         # self._cfg = cfg_filename
         self.workdir = workdir
         if workdir is None:
@@ -40,6 +54,10 @@ class EnsembleResult(BaseResult):
             elif not os.path.exists(self._path):
                 os.mkdir(self._path)
 
+            # Individual results packed by a previous simulation in the same workdir are not the ones of this simulation
+            for filename in get_individual_files(self._path, prefix):
+                if os.path.exists(filename):
+                    os.remove(filename)
 
         self._cfg = os.path.join(self._path, "ensemble.cfg")
 
@@ -47,64 +65,15 @@ class EnsembleResult(BaseResult):
         self.prefix = prefix
         self.asymptotic_probtraj_distribution = None
         self.asymptotic_nodes_probtraj_distribution = None
+        self._compiled_filters = {}
+        self._individual_store = None
+        self._embeddings = {}
+        self._kmeans = {}
         self._pcafig = None
         self._3dfig = None
-        maboss_cmd = simulation.get_maboss_cmd()
-
-        options = ["--ensemble"]
-        if simulation.individual_results:
-            options.append("--save-individual")
-
-        if simulation.random_sampling:
-            options.append("--random-sampling")
-
-        cmd_line = [maboss_cmd] + options
-        if len(simulation.individual_cfgs) > 0:
-            os.mkdir(os.path.join(self._path, "models"))
-            self.models_files = simulation.models_files
-            cmd_line.append("--ensemble-istates")
-            for model_file in self.models_files:
-                cmd_line += ["-c", os.path.join(self._path, "models", os.path.basename(simulation.individual_cfgs[model_file]))]
-                shutil.copyfile(model_file, os.path.join(self._path, "models", os.path.basename(model_file)))
-                shutil.copyfile(simulation.individual_cfgs[model_file], os.path.join(self._path, "models", os.path.basename(simulation.individual_cfgs[model_file])))
-        
-        elif len(simulation.individual_istates) > 0:
-            os.mkdir(os.path.join(self._path, "models"))
-            cmd_line.append("--ensemble-istates")
-            simulation.write_cfg(self._path, "ensemble.cfg")
-            simulation.write_models(self._path)
-            self.models_files = simulation.models_files
-
-            for model_file in self.models_files:
-                cmd_line += ["-c", os.path.join(self._path, "models", os.path.basename(simulation.individual_cfgs[os.path.basename(model_file)]))]
-        
-        else:
-            simulation.write_cfg(self._path, "ensemble.cfg")
-            simulation.write_models(self._path)
-            self.models_files = simulation.models_files
-            cmd_line += ["-c", self._cfg]     
-
-        cmd_line += [
-            "-o", self._path+'/'+self.prefix
-        ] + self.models_files
-
-        res = subprocess.Popen(
-            cmd_line,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-
-        std_out, std_err = res.communicate()
-        self._err = res.returncode
-        if self._err != 0:
-            print("Error, MaBoSS returned non 0 value", file=sys.stderr)
-            print(std_err.decode())
-        
-        if len(std_out.decode()) > 0:
-            print(std_out.decode())
 
     def get_thread_count(self):
-        # TODO : Extracting it from the cfg
-        return 6
+        return int(self.thread_count)
 
     def get_fp_file(self):
         return os.path.join(self._path, "%s_fp.csv" % self.prefix)
@@ -118,6 +87,65 @@ class EnsembleResult(BaseResult):
     def load_individual_result(self, model):
         return StoredResult(self._path, self.prefix + "_model_" + str(model))
 
+    def pack_individual_results(self, trajectories=False, remove=False):
+        """
+        .. py:method:: Pack the individual results of the models in a single indexed file, read by the individual results accessors
+        
+        :param trajectories: (optional) also pack the probabilities at each time point, not only the last states
+        :param remove: (optional) remove the probtraj file of each model once packed, only if trajectories are packed
+        
+        """
+        pack_individual_results(
+            self._path, self.prefix, len(self.models_files), 
+            trajectories=trajectories, remove=remove, workers=self.get_thread_count()
+        )
+        self._individual_store = None
+        return self.get_individual_store()
+
+    def get_individual_store(self):
+        """
+        .. py:method:: Get the packed individual results, or None if they were not packed
+        
+        """
+        if self._individual_store is None and IndividualResultsStore.exists(self._path, self.prefix):
+            store = IndividualResultsStore(self._path, self.prefix)
+            if store.nb_models != len(self.models_files):
+                print("The packed individual results are for %d models, not %d. Ignored" % (
+                    store.nb_models, len(self.models_files)), file=sys.stderr)
+                return None
+            self._individual_store = store
+        return self._individual_store
+
+    def get_model_last_states_probtraj(self, model):
+        """
+        .. py:method:: Get a Panda Series with the states final probability of a model
+        
+        :param model: index of the model
+        
+        """
+        store = self.get_individual_store()
+        if store is not None:
+            return store.get_last_states(model)
+
+        return self.load_individual_result(model).get_last_states_probtraj(as_series=True)
+
+    def get_model_states_probtraj(self, model):
+        """
+        .. py:method:: Get a Panda Dataframe with the states probability of a model at each time point
+        
+        :param model: index of the model
+        
+        """
+        store = self.get_individual_store()
+        if store is not None and store.trajectories:
+            return store.get_states_trajectory(model)
+
+        if not os.path.exists(self.load_individual_result(model).get_probtraj_file()):
+            print("The trajectories of the models were not packed, and their files were removed", file=sys.stderr)
+            return None
+
+        return self.load_individual_result(model).get_states_probtraj()
+
     def __del__(self):
         if self.workdir is None and os.path.exists(self._path):
             shutil.rmtree(self._path)
@@ -133,18 +161,16 @@ class EnsembleResult(BaseResult):
         
         
         if self.asymptotic_probtraj_distribution is None:
-            results = []
-            for i, model in enumerate(self.models_files):
-                results.append(self.load_individual_result(i))
-
-            tables = []
-            with multiprocessing.Pool(processes=self.get_thread_count()) as pool:
-                tables = pool.starmap(get_single_individual_states_distribution, [(result, i) for i, result in enumerate(results)])
-            self.asymptotic_probtraj_distribution = pd.concat(tables, axis=0, sort=False)
-            self.asymptotic_probtraj_distribution.fillna(0, inplace=True)
+            store = self.get_individual_store()
+            if store is not None:
+                self.asymptotic_probtraj_distribution = store.get_states_distribution()
+            else:
+                self.asymptotic_probtraj_distribution = load_individual_states_distribution(
+                    self._path, self.prefix, len(self.models_files), self.get_thread_count()
+                )
 
         if filter is not None:
-            return apply_filter(self.asymptotic_probtraj_distribution, filter, state=True)
+            return self.asymptotic_probtraj_distribution[self.get_filter_mask(filter, state=True)]
 
         if cluster is not None:
             return self.asymptotic_probtraj_distribution.iloc[cluster, :]
@@ -162,23 +188,34 @@ class EnsembleResult(BaseResult):
         
         
         if self.asymptotic_nodes_probtraj_distribution is None:
-
-            table = self.get_individual_states_probtraj()
-            nodes = get_nodes(table.columns.values)
-            with multiprocessing.Pool(processes=self.get_thread_count()) as pool:
-                self.asymptotic_nodes_probtraj_distribution = pd.concat(
-                    pool.starmap(get_single_individual_nodes_distribution, [(table, t_index, nodes) for t_index in table.index]), 
-                    sort=False, axis=0
-                )
+            self.asymptotic_nodes_probtraj_distribution = make_nodes_distribution(self.get_individual_states_probtraj())
 
         if filter is not None:
-            return apply_filter(self.asymptotic_nodes_probtraj_distribution, filter)
+            return self.asymptotic_nodes_probtraj_distribution[self.get_filter_mask(filter)]
 
         if cluster is not None:
             return self.asymptotic_nodes_probtraj_distribution.iloc[cluster, :]
         
         return self.asymptotic_nodes_probtraj_distribution
 
+    def get_filter_mask(self, filter, state=False):
+        """
+        .. py:method:: Get a boolean array telling which models verify a condition. The condition is compiled once, and kept for the next calls
+        
+        :param filter: condition on the node distributions, such as "Apoptosis > 0.5 and Proliferation < 0.1"
+        :param state: (optional) the condition is on the state distributions instead of the node distributions
+        
+        """
+        if state:
+            table = self.get_individual_states_probtraj()
+        else:
+            table = self.get_individual_nodes_probtraj()
+
+        if (filter, state) not in self._compiled_filters:
+            self._compiled_filters[(filter, state)] = compile_filter(filter, table.columns, state)
+
+        return self._compiled_filters[(filter, state)](table.values)
+
     def getByCondition(self, node_filter=None, state_filter=None):
         """
         .. py:method:: Filter the ensemble by condition on the node or state distribution
@@ -189,13 +226,17 @@ class EnsembleResult(BaseResult):
         """ 
         
         if node_filter is not None:
-            indexes = self.get_individual_nodes_probtraj(node_filter).index.values
-            labels = [0 if i not in indexes else 1 for i in range(len(self.models_files))]
-            return indexes, labels
+            table = self.get_individual_nodes_probtraj()
+            mask = self.get_filter_mask(node_filter)
         elif state_filter is not None:
-            indexes = self.get_individual_states_probtraj(state_filter).index.values
-            labels = [0 if i not in indexes else 1 for i in range(len(self.models_files))]
-            return indexes, labels
+            table = self.get_individual_states_probtraj()
+            mask = self.get_filter_mask(state_filter, state=True)
+        else:
+            return None
+
+        indexes = table.index.values[mask]
+        labels = np.isin(np.arange(len(self.models_files)), indexes).astype(int).tolist()
+        return indexes, labels
         
 
     def filterEnsembleByCondition(self, output_directory, node_filter=None, state_filter=None):
@@ -240,17 +281,7 @@ class EnsembleResult(BaseResult):
         
         """ 
         if clusters > 0:
-            kmeans = KMeans(n_clusters=clusters).fit(self.get_individual_nodes_probtraj().values)
-            indices = {}
-            for i, label in enumerate(kmeans.labels_):
-                if label in indices.keys():
-                    array = indices[label]
-                    array.append(i)
-                    indices.update({label: array})
-                else:
-                    indices.update({label: [i]})
-
-            return indices, kmeans.labels_
+            return self._get_kmeans("nodes", clusters)
 
     def getStatesKMeans(self, clusters=0):
         """
@@ -262,17 +293,55 @@ class EnsembleResult(BaseResult):
         
         """ 
         if clusters > 0:
-            kmeans = KMeans(n_clusters=clusters).fit(self.get_individual_states_probtraj().values)
+            return self._get_kmeans("states", clusters)
+
+    def _get_kmeans(self, features, clusters):
+        if (features, clusters) not in self._kmeans:
+            from sklearn.cluster import KMeans
+            kmeans = KMeans(n_clusters=clusters).fit(self._get_features_table(features).values)
             indices = {}
             for i, label in enumerate(kmeans.labels_):
-                if label in indices.keys():
-                    array = indices[label]
-                    array.append(i)
-                    indices.update({label: array})
-                else:
-                    indices.update({label: [i]})
+                indices.setdefault(label, []).append(i)
+            self._kmeans[(features, clusters)] = (indices, kmeans.labels_)
+
+        indices, labels = self._kmeans[(features, clusters)]
+        return dict((label, list(models)) for label, models in indices.items()), labels.copy()
+
+    def _get_features_table(self, features):
+        if features == "states":
+            return self.get_individual_states_probtraj()
+        elif features == "nodes":
+            return self.get_individual_nodes_probtraj()
+        raise ValueError("Unknown features %s, must be states or nodes" % features)
+
+    def get_embedding(self, features="states", method="auto", filter=None, columns=None, n_components=2, **params):
+        """
+        .. py:method:: Get the embedding of the individual results in a space of low dimension. The fitted model and the coordinates are kept for the next calls with the same arguments
+        
+        :param features: (optional) embed the states distributions ("states") or the nodes distributions ("nodes")
+        :param method: (optional) "pca", "ipca" (incremental PCA, by batches), "svd" (truncated SVD of the sparse table) or "tsne". 
+            The default, "auto", is "pca", fitted on the sparse table for large ensembles
+        :param filter: (optional) only embed the models verifying a condition on the distributions of features
+        :param columns: (optional) list of the columns of the table to use, missing columns being filled with zeros
+        :param n_components: (optional) dimension of the embedding
+        :param params: (optional) parameters of the sklearn estimator, such as perplexity for T-SNE
+        
+        :return: (fitted model, coordinates of the models, indexes of the models)
+        
+        """ 
+        table = self._get_features_table(features)
+        if columns is None:
+            columns = list(table.columns)
 
-            return indices, kmeans.labels_
+        key = make_embedding_key(features, columns, filter, method, n_components, params)
+        if key not in self._embeddings:
+            if filter is not None:
+                table = table[self.get_filter_mask(filter, state=(features == "states"))]
+            matrix = get_columns_matrix(table, columns)
+            model, coordinates = fit_embedding(matrix, method, n_components, **params)
+            self._embeddings[key] = (model, coordinates, table.index.values)
+
+        return self._embeddings[key]
 
     def filterEnsembleByCluster(self, output_directory, cluster):
         """
@@ -306,6 +375,8 @@ class EnsembleResult(BaseResult):
         :param ax: (optional) axes to plot on
         
         """
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D
         if len(dims) == 3:
             table = self.get_individual_states_probtraj()
             
@@ -343,7 +414,7 @@ class EnsembleResult(BaseResult):
             ax.set_ylabel(dims[1])
             ax.set_zlabel(dims[2])
 
-    def plotSteadyStatesDistribution(self, compare=None, labels=None, alpha=1, single_out=None, single_out_mutant=None, nil_label=None, compare_labels=None, **args):
+    def plotSteadyStatesDistribution(self, compare=None, labels=None, alpha=1, single_out=None, single_out_mutant=None, nil_label=None, compare_labels=None, method="auto", **args):
         """
         .. py:method:: Plots the distribution of the ensemble individual results in PCA space
         
@@ -354,43 +425,27 @@ class EnsembleResult(BaseResult):
         :param single_out_mutant: (optional) index of a model to highlight in the other ensemble simulation result
         :param nil_label: (optional) label for renaming the <nil> state
         :param compare_labels: (optional) labels to use in the legend
+        :param method: (optional) "pca", "ipca" or "svd", see get_embedding
         
         """ 
-        pca = PCA()
         table = self.get_individual_states_probtraj()
         if compare is not None:
             compare_table = compare.get_individual_states_probtraj()
             
             # Here we need to make sure all tables have the same columns
-            all_columns = set(list(table.columns) + list(compare_table.columns))
-            for column in all_columns:
-                if column not in table.columns.values:
-                    table[column] = 0
-                if column not in compare_table.columns.values:
-                    compare_table[column] = 0
-            
-            table = table[all_columns]
-            compare_table = compare_table[all_columns]
-    
-            mat = table.values
-            pca_res = pca.fit(mat)
-            X_pca = pca.transform(mat)
-            arrows_raw = (np.transpose(pca_res.components_[0:2, :]))
-        
-            c_pca = pca.transform(compare_table.values)
+            columns = list(table.columns) + [column for column in compare_table.columns if column not in set(table.columns)]
+            pca, X_pca, _ = self.get_embedding("states", method, columns=columns)
+            c_pca = transform_embedding(pca, get_columns_matrix(compare_table, columns))
             
             self.plotPCA(
                 pca, X_pca, 
-                list(table.columns.values), list(table.index.values), labels, alpha,
+                columns, list(table.index.values), labels, alpha,
                 compare=c_pca,
                 single_out=single_out, single_out_mutant=single_out_mutant, nil_label=nil_label, compare_labels=compare_labels,
                 **args,
             )
         else:
-            mat = table.values
-            pca_res = pca.fit(mat)
-            X_pca = pca.transform(mat)
-            arrows_raw = (np.transpose(pca_res.components_[0:2, :]))
+            pca, X_pca, _ = self.get_embedding("states", method)
         
             self.plotPCA(
                 pca, X_pca, 
@@ -399,32 +454,29 @@ class EnsembleResult(BaseResult):
                 **args
             )
 
-    def plotSteadyStatesNodesDistribution(self, compare=None, labels=None, alpha=1, **args):
+    def plotSteadyStatesNodesDistribution(self, compare=None, labels=None, alpha=1, method="auto", **args):
         """
         .. py:method:: Plots the nodes distribution of the ensemble individual results in PCA space
         
         :param compare: (optional) other ensemble simulation result, for comparison
         :param labels: (optional) list of colors to use for each model
         :param alpha: (optional) transparency of markers
+        :param method: (optional) "pca", "ipca" or "svd", see get_embedding
         
         """ 
-        
-        pca = PCA()
         table = self.get_individual_nodes_probtraj()
-        mat = table.values
-        pca_res = pca.fit(mat)
-        X_pca = pca.transform(mat)
-        arrows_raw = (np.transpose(pca_res.components_[0:2, :]))
-
         if compare is not None:
             compare_table = compare.get_individual_nodes_probtraj()
-            c_pca = pca.transform(compare_table.values)
+            columns = list(table.columns) + [column for column in compare_table.columns if column not in set(table.columns)]
+            pca, X_pca, _ = self.get_embedding("nodes", method, columns=columns)
+            c_pca = transform_embedding(pca, get_columns_matrix(compare_table, columns))
             self.plotPCA(
                 pca, X_pca,
-                list(table.columns.values), list(table.index.values), labels, alpha,
+                columns, list(table.index.values), labels, alpha,
                 compare=c_pca, **args
             )
         else:
+            pca, X_pca, _ = self.get_embedding("nodes", method)
             self.plotPCA(
                 pca, X_pca,
                 list(table.columns.values), list(table.index.values), labels, alpha,
@@ -435,6 +487,8 @@ class EnsembleResult(BaseResult):
         pca, X_pca, samples, features, colors=None, alpha=1, compare=None, single_out=None, single_out_mutant=None, nil_label=None, compare_labels=None,
         figsize=(20, 12), dpi=500, show_samples=False, show_features=True, ax=None, cutoff_arrows=None):
         
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as mpatches
         if ax is None:
             self._pcafig = plt.figure(figsize=figsize, dpi=dpi)
             ax = self._pcafig.add_subplot(1,1,1)
@@ -527,12 +581,11 @@ class EnsembleResult(BaseResult):
         :param n_iter: (optional) default parameter of T-SNE (default=2000)
         
         """ 
+        import matplotlib.pyplot as plt
         
-        pca = PCA()
-        table = self.get_individual_nodes_probtraj()
-        
-        model = TSNE(perplexity=perplexity, n_iter=n_iter, n_iter_without_progress=n_iter*0.5)   
-        res = model.fit_transform(table.values)
+        _, res, _ = self.get_embedding(
+            "nodes", "tsne", perplexity=perplexity, n_iter=n_iter, n_iter_without_progress=int(n_iter*0.5)
+        )
 
         if node_filter is None and state_filter is None:
             if len(clusters) == 0:
@@ -545,11 +598,13 @@ class EnsembleResult(BaseResult):
 
         else:
             fig = plt.figure(**args)
-            filtered, _ = self.getByCondition(node_filter=node_filter, state_filter=state_filter)
-            not_filtered = list(set(range(len(self.models_files))).difference(set(filtered)))
-            
-            plt.scatter(res[filtered, 0], res[filtered, 1], color='r')
-            plt.scatter(res[not_filtered, 0], res[not_filtered, 1], color='b')
+            if node_filter is not None:
+                mask = self.get_filter_mask(node_filter)
+            else:
+                mask = self.get_filter_mask(state_filter, state=True)
+
+            plt.scatter(res[mask, 0], res[mask, 1], color='r')
+            plt.scatter(res[~mask, 0], res[~mask, 1], color='b')
 
     def plotTSNESteadyStatesDistribution(self, node_filter=None, state_filter=None, clusters={}, perplexity=50, n_iter=2000, **args):
         """
@@ -562,15 +617,13 @@ class EnsembleResult(BaseResult):
         :param n_iter: (optional) default parameter of T-SNE (default=2000)
         
         """ 
-        pca = PCA()
-        table = self.get_individual_states_probtraj()
+        import matplotlib.pyplot as plt
         
-        model = TSNE(perplexity=perplexity, n_iter=n_iter, n_iter_without_progress=n_iter*0.5)   
-        res = model.fit_transform(table.values)
-
-
+        _, res, _ = self.get_embedding(
+            "states", "tsne", perplexity=perplexity, n_iter=n_iter, n_iter_without_progress=int(n_iter*0.5)
+        )
 
-        if node_filter is None or state_filter is None:
+        if node_filter is None and state_filter is None:
             if len(clusters) == 0:
                 fig = plt.figure(**args)
                 plt.scatter(res[:, 0], res[:, 1])
@@ -581,12 +634,77 @@ class EnsembleResult(BaseResult):
 
         else:
             fig = plt.figure(**args)
-            filtered, _ = self.getByCondition(node_filter=node_filter, state_filter=state_filter)
-            not_filtered = list(set(range(len(self.models_files))).difference(set(filtered)))
-            
-            plt.scatter(res[filtered, 0], res[filtered, 1], color='r')
-            plt.scatter(res[not_filtered, 0], res[not_filtered, 1], color='b')
+            if node_filter is not None:
+                mask = self.get_filter_mask(node_filter)
+            else:
+                mask = self.get_filter_mask(state_filter, state=True)
+
+            plt.scatter(res[mask, 0], res[mask, 1], color='r')
+            plt.scatter(res[~mask, 0], res[~mask, 1], color='b')
+
+
+def get_columns_matrix(table, columns):
+    """Return the values of a table for a list of columns, as a sparse matrix. Missing columns are zeros"""
+    from scipy.sparse import csr_matrix
+    matrix = csr_matrix(table.values)
+    if list(table.columns) == list(columns):
+        return matrix
+
+    columns_index = dict((column, i) for i, column in enumerate(columns))
+    positions = np.array([columns_index.get(column, -1) for column in table.columns], dtype=np.int64)
+    matrix = matrix.tocoo()
+    kept = positions[matrix.col] >= 0
+    return csr_matrix(
+        (matrix.data[kept], (matrix.row[kept], positions[matrix.col[kept]])),
+        shape=(matrix.shape[0], len(columns))
+    )
+
+def make_ensemble_command(simulation, path, prefix):
+    """
+    Write the models and configurations of an ensemble simulation in path, and return the 
+    MaBoSS command line running it, with the list of the models files
+    """
+    maboss_cmd = simulation.get_maboss_cmd()
+    cfg = os.path.join(path, "ensemble.cfg")
+
+    options = ["--ensemble"]
+    if simulation.individual_results:
+        options.append("--save-individual")
+
+    if simulation.random_sampling:
+        options.append("--random-sampling")
+
+    cmd_line = [maboss_cmd] + options
+    if len(simulation.individual_cfgs) > 0:
+        os.mkdir(os.path.join(path, "models"))
+        models_files = simulation.models_files
+        cmd_line.append("--ensemble-istates")
+        for model_file in models_files:
+            cmd_line += ["-c", os.path.join(path, "models", os.path.basename(simulation.individual_cfgs[model_file]))]
+            shutil.copyfile(model_file, os.path.join(path, "models", os.path.basename(model_file)))
+            shutil.copyfile(simulation.individual_cfgs[model_file], os.path.join(path, "models", os.path.basename(simulation.individual_cfgs[model_file])))
+    
+    elif len(simulation.individual_istates) > 0:
+        os.mkdir(os.path.join(path, "models"))
+        cmd_line.append("--ensemble-istates")
+        simulation.write_cfg(path, "ensemble.cfg")
+        simulation.write_models(path)
+        models_files = simulation.models_files
+
+        for model_file in models_files:
+            cmd_line += ["-c", os.path.join(path, "models", os.path.basename(simulation.individual_cfgs[os.path.basename(model_file)]))]
+    
+    else:
+        simulation.write_cfg(path, "ensemble.cfg")
+        simulation.write_models(path)
+        models_files = simulation.models_files
+        cmd_line += ["-c", cfg]     
+
+    cmd_line += [
+        "-o", path+'/'+prefix
+    ] + models_files
 
+    return cmd_line, models_files
 
 def fix_order(string):
     return " -- ".join(sorted(string.split(" -- ")))
@@ -600,6 +718,84 @@ def get_single_individual_states_distribution(result, i):
         table_states.rename(columns=rename_columns, inplace=True)
         return table_states
 
+def read_last_line(filename, block_size=4096):
+    """Return the last non-empty line of a file, reading it backwards from its end"""
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+            stripped = data.rstrip(b"\r\n")
+            if b"\n" in stripped:
+                return stripped[stripped.rindex(b"\n")+1:].decode()
+        return data.rstrip(b"\r\n").decode()
+
+def read_individual_last_states(filenames):
+    """
+    Return the last states of each probtraj file, as a list of (states, probabilities), 
+    or None if the file is empty
+    """
+    last_states = []
+    for filename in filenames:
+        if os.path.getsize(filename) == 0:
+            last_states.append(None)
+            continue
+
+        with open(filename, 'r') as probtraj:
+            header = probtraj.readline().strip("\n").split("\t")
+        first_col = header.index("State")
+        data = read_last_line(filename).split("\t")
+        states = data[first_col::3]
+        probs = data[first_col+1::3]
+        order = sorted(range(len(states)), key=states.__getitem__)
+        last_states.append(([states[i] for i in order], [float(probs[i]) for i in order]))
+    return last_states
+
+def load_individual_states_distribution(path, prefix, nb_models, workers=1):
+    """
+    Return a Panda Dataframe with the states final probability of each model of an ensemble
+    
+    :param path: directory of the ensemble results
+    :param prefix: prefix of the ensemble results files
+    :param nb_models: number of models in the ensemble
+    :param workers: (optional) number of processes reading the files
+    """
+    filenames = [
+        os.path.join(path, "%s_model_%d_probtraj.csv" % (prefix, model)) 
+        for model in range(nb_models)
+    ]
+
+    if workers <= 1 or nb_models <= 1:
+        last_states = read_individual_last_states(filenames)
+    else:
+        chunk_size = int(math.ceil(nb_models/float(workers*4)))
+        chunks = [filenames[i:i+chunk_size] for i in range(0, nb_models, chunk_size)]
+        with multiprocessing.Pool(processes=workers) as pool:
+            last_states = [t_last_states for chunk in pool.map(read_individual_last_states, chunks) for t_last_states in chunk]
+
+    # Each state gets a column the first time it is seen, in the order of the models
+    states_index = {}
+    rows, cols, values = [], [], []
+    models = []
+    for model, t_last_states in enumerate(last_states):
+        if t_last_states is None:
+            continue
+
+        row = len(models)
+        models.append(model)
+        for state, proba in zip(*t_last_states):
+            rows.append(row)
+            cols.append(states_index.setdefault(fix_order(state), len(states_index)))
+            values.append(proba)
+
+    matrix = np.zeros((len(models), len(states_index)))
+    matrix[rows, cols] = values
+    return pd.DataFrame(matrix, index=models, columns=list(states_index.keys()))
+
 def get_nodes(states):
     nodes = set()
     for s in states:
@@ -609,6 +805,28 @@ def get_nodes(states):
                 nodes.add(nd)
     return list(nodes)
 
+def make_nodes_distribution(table):
+    """
+    Return the nodes probabilities of each model, from the states probabilities of each model.
+    The table of the states probabilities is multiplied by the sparse incidence matrix of the 
+    nodes in the states
+    """
+    from scipy.sparse import csr_matrix
+
+    states = list(table.columns.values)
+    nodes = sorted(get_nodes(states))
+    nodes_index = {node: i for i, node in enumerate(nodes)}
+
+    rows, cols = [], []
+    for i, state in enumerate(states):
+        if state != "<nil>":
+            for node in state.split(" -- "):
+                rows.append(i)
+                cols.append(nodes_index[node])
+
+    incidence = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(states), len(nodes)))
+    return pd.DataFrame(np.asarray(table.values @ incidence), index=table.index, columns=nodes)
+
 def get_single_individual_nodes_distribution(table, index, nodes):
     ntable = pd.DataFrame(np.zeros((1, len(nodes))), index=[index], columns=nodes)
     for i, row in enumerate(table):
@@ -621,62 +839,78 @@ def get_single_individual_nodes_distribution(table, index, nodes):
     return ntable
 
 def apply_filter(data, filter, state=False):
+    return data[compile_filter(filter, data.columns, state)(data.values)]
 
+def compile_filter(filter, columns, state=False):
+    """
+    Compile a condition on the columns of a table, such as "Apoptosis > 0.5 and Proliferation < 0.1".
+    Return a function computing, from the matrix of values of the table, the boolean mask of 
+    the rows verifying the condition
+    
+    :param filter: the condition
+    :param columns: the columns of the table
+    :param state: (optional) the columns are states, written without " -- " in the condition
+    """
     if state: 
         filter = filter.replace(" -- ", "")
-        dict_states = {column.replace(" -- ", ""): column for column in list(data.columns)}
-        formula = ast.parse(filter)
-        return parse_ast(formula.body[0].value, data, dict_states)
+        columns_index = {column.replace(" -- ", ""): i for i, column in enumerate(columns)}
     else:
-        formula = ast.parse(filter)
-        return parse_ast(formula.body[0].value, data)
+        columns_index = {column: i for i, column in enumerate(columns)}
 
-def parse_ast(t_ast, data, ds=None):
-    if isinstance(t_ast, ast.BoolOp):
-        
-        if isinstance(t_ast.op, ast.And):
-            
-            values = [parse_ast(tt_ast, data, ds) for tt_ast in t_ast.values]
-            t_data = pd.merge(values[0], values[1], how="inner", on=list(values[0].columns), left_index=True, right_index=True)
+    formula = ast.parse(filter, mode="eval")
+    return compile_ast(formula.body, columns_index, state)
 
-            for i in range(2, len(values)):
-                t_data = pd.merge(t_data, values[i], how="inner", on=list(values[0].columns), left_index=True, right_index=True)
+compare_operators = {
+    ast.Lt: np.less, ast.Gt: np.greater, ast.LtE: np.less_equal, 
+    ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal
+}
 
-            return t_data
-        elif isinstance(t_ast.op, ast.Or):
-            
-            values = [parse_ast(tt_ast, data, ds) for tt_ast in t_ast.values]
-            t_data = pd.merge(values[0], values[1], how="outer", on=list(values[0].columns), left_index=True, right_index=True)
+binary_operators = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide
+}
 
-            for i in range(2, len(values)):
-                t_data = pd.merge(t_data, values[i], how="outer", on=list(values[0].columns), left_index=True, right_index=True)
+def compile_ast(t_ast, columns_index, state=False):
+    if isinstance(t_ast, ast.BoolOp):
+        values = [compile_ast(tt_ast, columns_index, state) for tt_ast in t_ast.values]
+        operator = np.logical_and if isinstance(t_ast.op, ast.And) else np.logical_or
+        return lambda matrix: operator.reduce([value(matrix) for value in values])
 
-            return t_data
-        
-    elif isinstance(t_ast, ast.Compare):
+    elif isinstance(t_ast, ast.UnaryOp) and isinstance(t_ast.op, ast.Not):
+        value = compile_ast(t_ast.operand, columns_index, state)
+        return lambda matrix: np.logical_not(value(matrix))
 
-        res_dict = {
-            ast.Lt : data[parse_ast(t_ast.left, data, ds) < parse_ast(t_ast.comparators[0], data, ds)],
-            ast.Gt : data[parse_ast(t_ast.left, data, ds) > parse_ast(t_ast.comparators[0], data, ds)],
-            ast.LtE : data[parse_ast(t_ast.left, data, ds) <= parse_ast(t_ast.comparators[0], data, ds)],
-            ast.GtE : data[parse_ast(t_ast.left, data, ds) >= parse_ast(t_ast.comparators[0], data, ds)],
-            ast.Eq : data[parse_ast(t_ast.left, data, ds) == parse_ast(t_ast.comparators[0], data, ds)],
-            ast.NotEq : data[parse_ast(t_ast.left, data, ds) != parse_ast(t_ast.comparators[0], data, ds)],
-        }
-        return res_dict[type(t_ast.ops[0])]
+    elif isinstance(t_ast, ast.UnaryOp) and isinstance(t_ast.op, ast.USub):
+        value = compile_ast(t_ast.operand, columns_index, state)
+        return lambda matrix: -value(matrix)
 
-    elif isinstance(t_ast, ast.Num):
-        return t_ast.n
+    elif isinstance(t_ast, ast.Compare):
+        operands = [compile_ast(tt_ast, columns_index, state) for tt_ast in [t_ast.left] + t_ast.comparators]
+        operators = [compare_operators[type(op)] for op in t_ast.ops]
+        def compare(matrix):
+            values = [operand(matrix) for operand in operands]
+            return np.logical_and.reduce([
+                np.broadcast_to(operator(values[i], values[i+1]), (matrix.shape[0],)) 
+                for i, operator in enumerate(operators)
+            ])
+        return compare
+
+    elif isinstance(t_ast, ast.BinOp) and type(t_ast.op) in binary_operators:
+        left = compile_ast(t_ast.left, columns_index, state)
+        right = compile_ast(t_ast.right, columns_index, state)
+        operator = binary_operators[type(t_ast.op)]
+        return lambda matrix: operator(left(matrix), right(matrix))
+
+    elif isinstance(t_ast, ast.Constant):
+        return lambda matrix: t_ast.value
 
     elif isinstance(t_ast, ast.Name):
-        if ds is not None:
-            if t_ast.id in ds.keys():
-                return data[ds[t_ast.id]]
-            else:
-                return pd.Series(np.zeros(data.iloc[:, 0].shape), index=data.index)      
+        if t_ast.id in columns_index:
+            index = columns_index[t_ast.id]
+            return lambda matrix: matrix[:, index]
+        elif state:
+            # States never reached by any model have a null probability
+            return lambda matrix: np.zeros(matrix.shape[0])
         else:
-            return data[t_ast.id]
-    
-        
-        
-            
\ No newline at end of file
+            raise KeyError(t_ast.id)
+
+    raise ValueError("Unsupported expression in filter : %s" % ast.dump(t_ast))
@@ -0,0 +1,124 @@
+from __future__ import print_function
+
+import math
+import collections
+import multiprocessing
+import numpy as np
+
+from colomoto import minibn
+
+
+class _TextAlgebra(object):
+    """Boolean algebra of a minibn network, whose parse keeps the rule texts"""
+
+    def __init__(self, ba):
+        self._ba = ba
+
+    def __getattr__(self, name):
+        return getattr(self._ba, name)
+
+    def parse(self, text):
+        return text
+
+def read_bnet_rules(model_file):
+    """Return the (node, rule text) of a bnet file, read by minibn without parsing the rules"""
+    network = minibn.BooleanNetwork()
+    network.ba = _TextAlgebra(network.ba)
+    with open(model_file, 'r') as data:
+        network.import_data(data)
+    return list(network.items())
+
+def parse_rules(texts):
+    """Parse rule texts into minibn expressions"""
+    ba = minibn.BooleanNetwork().ba
+    return [ba.parse(text) for text in texts]
+
+
+class RulesTable(object):
+    """
+        .. py:class:: Rules of the models of an ensemble, interned in a table shared by all the models.
+
+        Each distinct rule text is parsed once, and rules equal as expressions share the same id
+        for a node. The models are stored as a matrix of rule ids, one row per model and
+        one column per node (-1 if the model has no rule for the node).
+
+        :param models_files: list of bnet files
+        :param workers: (optional) number of processes parsing the rules
+    """
+
+    def __init__(self, models_files, workers=1):
+        self.models_files = list(models_files)
+
+        models_rules = [read_bnet_rules(model_file) for model_file in self.models_files]
+
+        texts_index = {}
+        for rules in models_rules:
+            for _, text in rules:
+                texts_index.setdefault(text, len(texts_index))
+        texts = list(texts_index.keys())
+
+        if workers <= 1 or len(texts) < 2*workers:
+            expressions = parse_rules(texts)
+        else:
+            size = int(math.ceil(len(texts)/float(workers*4)))
+            with multiprocessing.Pool(processes=workers) as pool:
+                expressions = [
+                    expression for chunk in pool.map(parse_rules, [texts[i:i+size] for i in range(0, len(texts), size)])
+                    for expression in chunk
+                ]
+
+        self.nodes = []
+        nodes_index = {}
+        self.rules = []
+        rules_index = {}
+        rows, cols, ids = [], [], []
+        for model, rules in enumerate(models_rules):
+            for node, text in rules:
+                if node not in nodes_index:
+                    nodes_index[node] = len(self.nodes)
+                    self.nodes.append(node)
+
+                expression = expressions[texts_index[text]]
+                rule_id = rules_index.get((node, expression))
+                if rule_id is None:
+                    rule_id = rules_index[(node, expression)] = len(self.rules)
+                    self.rules.append(expression)
+
+                rows.append(model)
+                cols.append(nodes_index[node])
+                ids.append(rule_id)
+
+        self.matrix = np.full((len(self.models_files), len(self.nodes)), -1, dtype=np.int32)
+        self.matrix[rows, cols] = ids
+        self.symbols = np.array([len(expression.symbols) for expression in self.rules], dtype=np.int32)
+
+    def get_models_matrix(self, cluster=None):
+        """Return the matrix of rule ids, restricted to the models of a cluster"""
+        if cluster is None:
+            return self.matrix
+        return self.matrix[np.isin(np.arange(len(self.models_files)), list(cluster))]
+
+    def get_rules(self, cluster=None):
+        """Return, for each node, the set of its rules in the models of a cluster"""
+        matrix = self.get_models_matrix(cluster)
+        return collections.OrderedDict(
+            (node, set(self.rules[rule_id] for rule_id in np.unique(matrix[:, i]) if rule_id >= 0))
+            for i, node in enumerate(self.nodes)
+        )
+
+    def get_rules_counts(self, cluster=None):
+        """
+        Return, for each node, the number of distinct rules in the models of a cluster,
+        and the number of symbols of the rule of the first of these models
+        """
+        matrix = np.sort(self.get_models_matrix(cluster), axis=0)
+        if matrix.shape[0] == 0:
+            return collections.OrderedDict((node, (0, 0)) for node in self.nodes)
+
+        counts = (np.diff(matrix, axis=0) != 0).sum(axis=0) + 1 - (matrix[0, :] < 0)
+
+        first_rules = self.get_models_matrix(cluster)[0, :]
+        symbols = np.where(first_rules >= 0, self.symbols[np.maximum(first_rules, 0)], 0)
+        return collections.OrderedDict(
+            (node, (int(counts[i]), int(symbols[i]))) for i, node in enumerate(self.nodes)
+        )
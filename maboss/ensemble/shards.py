@@ -0,0 +1,251 @@
+from __future__ import print_function
+
+from .result import EnsembleResult, make_ensemble_command
+import os
+import re
+import sys
+import math
+import itertools
+import collections
+import subprocess
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from multiprocessing.pool import ThreadPool
+
+
+class JobRunner(ABC):
+    """
+        .. py:class:: Runs the MaBoSS command lines of the shards of an ensemble simulation.
+
+        Subclasses implement run(), for example to submit the shards to the hosts of a cluster.
+        The inputs of each shard are written in its own directory, and its results are expected
+        in the same directory, so the hosts need to share this directory (same path) with the
+        machine running the Ensemble.
+    """
+
+    @abstractmethod
+    def run(self, jobs):
+        """
+        .. py:method:: Run the jobs, and wait for them to finish
+
+        :param jobs: list of (command line, shard directory)
+        :return: list of (return code, standard output, standard error), in the order of the jobs
+        """
+
+
+class LocalJobRunner(JobRunner):
+    """
+        .. py:class:: Runs the shards of an ensemble simulation as local MaBoSS processes.
+
+        :param workers: (optional) maximum number of processes running at the same time, default to all the shards
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+
+    def run(self, jobs):
+        workers = len(jobs) if self.workers is None else max(1, min(self.workers, len(jobs)))
+        if workers <= 1:
+            return [run_job(job) for job in jobs]
+
+        with ThreadPool(processes=workers) as pool:
+            return pool.map(run_job, jobs)
+
+
+def run_job(job):
+    cmd_line, path = job
+    res = subprocess.Popen(
+        cmd_line, cwd=path,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    std_out, std_err = res.communicate()
+    return res.returncode, std_out.decode(), std_err.decode()
+
+
+class ShardedEnsembleResult(EnsembleResult):
+    """
+        .. py:class:: Result of an ensemble simulation split in shards, each shard being run as an independent MaBoSS process.
+
+        The probability trajectories and fixed points of the shards are merged, weighted by their number
+        of models. The individual results are renamed with the index of their model in the whole ensemble.
+        The stationary distributions of the shards are not merged (get_statdist_file raises a ValueError).
+
+        :param simulation: the Ensemble object
+        :param shards: number of shards
+        :param workdir: (optional) directory where the simulation is to be executed
+        :param overwrite: (optional) overwrite a previous simulation in the same workdir
+        :param prefix: (optional) prefix of the simulation results files
+        :param runner: (optional) JobRunner running the shards, default to a LocalJobRunner
+    """
+
+    def __init__(self, simulation, shards, workdir=None, overwrite=False, prefix="res", runner=None):
+
+        self._init_workdir(simulation, workdir, overwrite, prefix)
+        self.models_files = []
+        self.shards = []
+
+        jobs = []
+        for i, models in enumerate(split_models(simulation.models_files, shards)):
+            shard_path = os.path.join(self._path, "shard_%d" % i)
+            os.mkdir(shard_path)
+
+            cmd_line, models_files = make_ensemble_command(make_shard(simulation, models), shard_path, self.prefix)
+            self.shards.append((shard_path, len(self.models_files), len(models_files)))
+            self.models_files += models_files
+            jobs.append((cmd_line, shard_path))
+
+        if runner is None:
+            runner = LocalJobRunner()
+
+        self._err = 0
+        for (shard_path, _, _), (returncode, std_out, std_err) in zip(self.shards, runner.run(jobs)):
+            if returncode != 0:
+                self._err = returncode
+                print("Error, MaBoSS returned non 0 value for shard %s" % shard_path, file=sys.stderr)
+                print(std_err)
+
+            if len(std_out) > 0:
+                print(std_out)
+
+        if self._err == 0:
+            self._merge_shards()
+
+    def get_statdist_file(self):
+        raise ValueError(
+            "The stationary distributions of the shards are not merged, they are in the shard_* folders of %s" % self._path
+        )
+
+    def _merge_shards(self):
+        weights = [nb_models for _, _, nb_models in self.shards]
+        merge_probtraj(
+            [os.path.join(path, "%s_probtraj.csv" % self.prefix) for path, _, _ in self.shards],
+            weights, self.get_probtraj_file()
+        )
+        merge_fixpoints(
+            [os.path.join(path, "%s_fp.csv" % self.prefix) for path, _, _ in self.shards],
+            weights, self.get_fp_file()
+        )
+        for path, offset, _ in self.shards:
+            remap_individual_results(path, self._path, self.prefix, offset)
+
+
+def split_models(models_files, shards):
+    """Split the list of models in consecutive groups of (almost) the same size"""
+    shards = max(1, min(shards, len(models_files)))
+    size = int(math.ceil(len(models_files)/float(shards)))
+    return [models_files[i:i+size] for i in range(0, len(models_files), size)]
+
+def make_shard(simulation, models):
+    """Return a copy of the Ensemble, restricted to a group of models"""
+    shard = simulation.copy()
+    shard.models_files = list(models)
+
+    names = set(models) | set(os.path.basename(model) for model in models)
+    shard.individual_istates = collections.OrderedDict(
+        (name, istate) for name, istate in simulation.individual_istates.items() if name in names
+    )
+    shard.individual_cfgs = collections.OrderedDict(
+        (model, cfg) for model, cfg in simulation.individual_cfgs.items() if model in names
+    )
+    return shard
+
+def merge_probtraj(filenames, weights, output):
+    """
+    Merge the probability trajectories of the shards, weighted by their number of models.
+    The errors are combined as the errors of a weighted mean of independent estimates.
+    The entropy H is computed again from the merged probabilities of the states, as the entropy of the
+    mixture is not the mean of the entropies of the shards. The transition entropy TH is a mean over
+    the trajectories, so it is the weighted mean of the shards.
+    """
+    total = float(sum(weights))
+    files = [open(filename, 'r') for filename in filenames]
+    try:
+        headers = [f.readline().strip("\n").split("\t") for f in files]
+        first_col = headers[0].index("State")
+        columns = headers[0][:first_col]
+        errors = np.array([column.startswith("Error") for column in columns[1:]])
+        entropy_col = columns.index("H") - 1 if "H" in columns else None
+
+        lines = []
+        max_states = 0
+        for rows in itertools.zip_longest(*files):
+            if any(row is None for row in rows):
+                raise ValueError("The probability trajectories of the shards do not have the same number of time points")
+
+            values = np.zeros(first_col-1)
+            squared_errors = np.zeros(first_col-1)
+            probas = collections.OrderedDict()
+            times = []
+            for weight, row in zip(weights, rows):
+                data = row.strip("\n").split("\t")
+                times.append(float(data[0]))
+                ratio = weight/total
+                t_values = np.array([float(value) for value in data[1:first_col]])
+                values += ratio*t_values
+                squared_errors += (ratio*t_values)**2
+                for state, proba, error in zip(data[first_col::3], data[first_col+1::3], data[first_col+2::3]):
+                    t_proba, t_error = probas.get(state, (0.0, 0.0))
+                    probas[state] = (t_proba + ratio*float(proba), t_error + (ratio*float(error))**2)
+
+            if not np.allclose(times, times[0]):
+                raise ValueError("The time points of the shards differ at line %d : %s" % (len(lines)+2, ", ".join(str(time) for time in times)))
+
+            values[errors] = np.sqrt(squared_errors[errors])
+            if entropy_col is not None:
+                values[entropy_col] = sum(-proba*math.log2(proba) for proba, _ in probas.values() if proba > 0)
+            line = [data[0]] + ["%.10g" % value for value in values]
+            for state, (proba, error) in probas.items():
+                line += [state, "%.10g" % proba, "%.10g" % math.sqrt(error)]
+            lines.append("\t".join(line))
+            max_states = max(max_states, len(probas))
+
+    finally:
+        for f in files:
+            f.close()
+
+    with open(output, 'w') as probtraj:
+        probtraj.write("\t".join(columns + ["State", "Proba", "ErrorProba"]*max_states) + "\n")
+        for line in lines:
+            probtraj.write(line + "\n")
+
+def merge_fixpoints(filenames, weights, output):
+    """Merge the fixed points of the shards, weighted by their number of models"""
+    total = float(sum(weights))
+    tables = []
+    for filename, weight in zip(filenames, weights):
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            try:
+                table = pd.read_csv(filename, sep="\t", skiprows=[0])
+            except pd.errors.EmptyDataError:
+                continue
+            table["Proba"] *= weight/total
+            tables.append(table)
+
+    with open(output, 'w') as fp_file:
+        if len(tables) == 0:
+            fp_file.write("Fixed Points (0)\n")
+            return
+
+        table = pd.concat(tables, sort=False).fillna(0)
+        nodes = [column for column in table.columns if column not in ["FP", "Proba", "State"]]
+        merged = table.groupby("State", sort=False).agg(
+            dict([("Proba", "sum")] + [(node, "first") for node in nodes])
+        ).reset_index()
+        merged = merged.sort_values("Proba", ascending=False, kind="stable")
+        merged.insert(0, "FP", ["#%d" % (i+1) for i in range(len(merged))])
+        merged = merged[["FP", "Proba", "State"] + nodes]
+
+        fp_file.write("Fixed Points (%d)\n" % len(merged))
+        merged.to_csv(fp_file, sep="\t", index=False)
+
+def remap_individual_results(shard_path, path, prefix, offset):
+    """Move the individual results of a shard to path, renamed with the index of their model in the whole ensemble"""
+    pattern = re.compile(r"^%s_model_(\d+)_(.*)$" % re.escape(prefix))
+    for filename in os.listdir(shard_path):
+        matched = pattern.match(filename)
+        if matched is not None:
+            os.replace(
+                os.path.join(shard_path, filename),
+                os.path.join(path, "%s_model_%d_%s" % (prefix, offset + int(matched.group(1)), matched.group(2)))
+            )
@@ -17,6 +17,11 @@ if version_info[0] < 3:
 else:
     from contextlib import ExitStack
 from os.path import isfile
+from copy import deepcopy
+import glob
+import hashlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import pyparsing as pp
 from .logic import varName
 from .network import Node, Network
@@ -211,8 +216,8 @@ def load(bnd_filename, *cfg_filenames, **extra_args):
             cfg_content += cfg_file.read()
 
         (variables, parameters, is_internal_list, in_graph_list,
-         istate_list, refstate_list, schedule_list) = _read_cfg(cfg_content)
-        nodes, mutations = _read_bnd(bnd_content, is_internal_list, in_graph_list)
+         istate_list, refstate_list, schedule_list) = _cached_read_cfg(cfg_content)
+        nodes, mutations = _cached_read_bnd(bnd_content, is_internal_list, in_graph_list)
         mutationTypes = {}
         for mutation in mutations:
             
@@ -236,6 +241,118 @@ def load(bnd_filename, *cfg_filenames, **extra_args):
         return ret
 
 
+def load_many(models, workers=None, return_errors=False, **extra_args):
+    """Loads a batch of networks, in parallel.
+
+    :param models: a glob pattern (ex: "models/*.bnd"), or a list whose elements are
+        either a model file name or a tuple (model file, configuration file(s))
+    :param int workers: number of worker processes (default: number of cpus)
+    :param bool return_errors: also return a dictionary of error messages, by model file
+    :param extra_args: forwarded to the loaders (cmaboss, command, use_sbml_names)
+    :rtype: list of :py:class:`.Simulation`, in the order of the input
+
+    The loader is chosen from the extension of the model file : MaBoSS (.bnd),
+    BNet (.bnet), SBML (.sbml, .xml) or TabularQual (.xlsx). A model which
+    fails to load is replaced by None, and the error is reported on stderr
+    without interrupting the rest of the batch.
+
+    With cmaboss=True, the models are loaded in threads instead of processes,
+    since cMaBoSS objects cannot be sent between processes.
+    """
+    if isinstance(models, str):
+        models = sorted(
+            filename for filename in glob.glob(models)
+            if not filename.lower().endswith(".cfg")
+        )
+
+    tasks = []
+    for model in models:
+        if isinstance(model, str):
+            tasks.append((model, (), extra_args))
+        else:
+            tasks.append((model[0], tuple(model[1:]), extra_args))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(tasks)))
+
+    # Identical entries are only loaded once
+    unique_tasks = list(OrderedDict.fromkeys((task[0], task[1]) for task in tasks))
+    unique_tasks = [(model, cfgs, extra_args) for model, cfgs in unique_tasks]
+
+    if workers == 1:
+        loaded = [_load_task(task) for task in unique_tasks]
+    else:
+        pool_class = ThreadPool if extra_args.get("cmaboss") else multiprocessing.Pool
+        with pool_class(processes=workers) as pool:
+            loaded = pool.map(_load_task, unique_tasks, chunksize=1)
+
+    loaded = dict(zip([(task[0], task[1]) for task in unique_tasks], loaded))
+
+    simulations = []
+    errors = OrderedDict()
+    first_use = set()
+    for model, cfgs, _ in tasks:
+        simulation, error = loaded[(model, cfgs)]
+        if error is not None:
+            if (model, cfgs) not in first_use:
+                print("Error while loading %s : %s" % (model, error), file=stderr)
+            errors[model] = error
+
+        elif (model, cfgs) in first_use:
+            # Duplicated entries must not share the same object
+            simulation = simulation.copy()
+
+        first_use.add((model, cfgs))
+        simulations.append(simulation)
+
+    if return_errors:
+        return simulations, errors
+    return simulations
+
+
+def _load_task(task):
+    model, cfgs, extra_args = task
+    try:
+        extension = model.lower().split(".")[-1]
+        cmaboss = extra_args.get("cmaboss", False)
+        if extension == "bnd":
+            return load(model, *cfgs, **extra_args), None
+        elif extension == "bnet":
+            return loadBNet(model, *cfgs, cmaboss=cmaboss), None
+        elif extension in ["sbml", "xml"]:
+            return loadSBML(model, *cfgs, use_sbml_names=extra_args.get("use_sbml_names", False), cmaboss=cmaboss), None
+        elif extension == "xlsx":
+            return loadTabularQual(model, cmaboss=cmaboss), None
+        else:
+            return None, "unknown model format .%s" % extension
+    except Exception as e:
+        return None, "%s: %s" % (e.__class__.__name__, e)
+
+
+# Parsed cfg and bnd contents, by hash of the content. Patient specific models
+# often share their bnd or their cfg, which are then parsed only once.
+_parse_cache = OrderedDict()
+_parse_cache_size = 256
+
+def _cached_parse(kind, key, parse):
+    key = (kind, hashlib.sha1(key.encode("utf-8")).hexdigest())
+    if key not in _parse_cache:
+        _parse_cache[key] = parse()
+        if len(_parse_cache) > _parse_cache_size:
+            _parse_cache.popitem(last=False)
+
+    # Nodes and dictionaries are modified when building the simulation
+    return deepcopy(_parse_cache[key])
+
+def _cached_read_cfg(string):
+    return _cached_parse("cfg", string, lambda: _read_cfg(string))
+
+def _cached_read_bnd(string, is_internal_list, in_graph_list):
+    key = "%s\n%r\n%r" % (string, sorted(is_internal_list.items()), sorted(in_graph_list.items()))
+    return _cached_parse("bnd", key, lambda: _read_bnd(string, is_internal_list, in_graph_list))
+
+
 def _read_cfg(string):
         variables = OrderedDict()
         parameters = OrderedDict()
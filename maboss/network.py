@@ -2,6 +2,9 @@
 
 from __future__ import print_function
 import collections
+import collections.abc
+import numpy
+import re
 from . import logic
 from sys import stderr, stdout, version_info
 
@@ -33,6 +36,9 @@ class Node(object):
     *MaBoSS* language.
     """
 
+    __slots__ = ("name", "logExp", "rt_up", "rt_down", "is_internal",
+                 "internal_var", "in_graph", "is_mutant", "schedule", "_symbols")
+
     def __init__(self, name, logExp=None, rt_up=1, rt_down=1,
                  is_internal=False, internal_var={}, in_graph=False, is_mutant=False, schedule=None):
         """
@@ -55,6 +61,7 @@ class Node(object):
         self.in_graph = in_graph
         self.is_mutant=is_mutant
         self.schedule = schedule
+        self._symbols = None
 
     def set_rate(self, rate_up, rate_down):
         """
@@ -98,6 +105,25 @@ class Node(object):
         return Node(self.name, self.logExp, self.rt_up, self.rt_down,
                     self.is_internal, self.internal_var, self.in_graph, self.is_mutant, self.schedule)
 
+    def get_symbols(self):
+        """Get the names used in the logic, the rates and the internal variables of the node.
+
+        :return: the names, except the $variables and @variables
+        :rtype: frozenset
+
+        The expressions are only parsed again when one of them changed.
+        """
+        key = (self.logExp, self.rt_up, self.rt_down, tuple(self.internal_var.items()))
+        if self._symbols is None or self._symbols[0] != key:
+            expressions = [self.logExp, self.rt_up, self.rt_down] + list(self.internal_var.values())
+            symbols = frozenset(
+                symbol for expression in expressions if isinstance(expression, str)
+                for symbol in _symbol_pattern.findall(expression)
+                if symbol.lower() not in _reserved_symbols
+            )
+            self._symbols = (key, symbols)
+        return self._symbols[1]
+
     def set_schedule(self, schedule):
         """Set the update schedule of the node.
         
@@ -134,40 +160,66 @@ class Network(collections.OrderedDict):
             super().__init__([(nd.name, nd) for nd in nodeList])
 
         self.names = [nd.name for nd in nodeList]
-        self.logicExp = {nd.name: nd.logExp for nd in nodeList}
+        self._istate_index = {name: i for i, name in enumerate(self.names)}
+
+        # _istate_probs gives for each node which is not bound to other nodes
+        # its initial state probabilities [P(0), P(1)], in the order of names.
+        # It grows geometrically with add_node, its rows after the last node are unused.
+        # Probabilities given as macros ($variables) are kept in _istate_macros.
+        self._istate_probs = numpy.full((len(self.names), 2), 0.5)
+        self._istate_macros = {}
 
-        # _attribution gives for each node the list of node with which it is
-        # binded.
-        self._attribution = collections.OrderedDict([(nd.name, nd.name) for nd in nodeList])
+        # _bound_istates gives for each tuple of bound nodes the initial state
+        # probabilities, and _binding gives for each bound node its tuple.
+        self._bound_istates = collections.OrderedDict()
+        self._binding = {}
 
-        # _initState gives for each list of binded node the initial state
-        # probabilities.
-        self._initState = collections.OrderedDict([(l, {0: 0.5, 1: 0.5}) for l in self._attribution])
+        # _influence_index caches the regulators of each node, see _get_influence_index
+        self._influence_index = None
+
+    @property
+    def logicExp(self):
+        return {name: nd.logExp for name, nd in self.items()}
 
     def add_node(self, name):
 
         node = Node(name)
         collections.OrderedDict.update(self, {name: node})
+        index = len(self.names)
         self.names.append(name)
-        self.logicExp.update({name: node.logExp})
-        self._attribution.update({name: name})
-        self._initState.update({name: {0: 0.5, 1: 0.5}})
+        self._istate_index[name] = index
+        if index >= len(self._istate_probs):
+            istate_probs = numpy.full((max(2*len(self._istate_probs), 8), 2), 0.5)
+            istate_probs[:index] = self._istate_probs[:index]
+            self._istate_probs = istate_probs
+        self._istate_probs[index] = (0.5, 0.5)
 
     def remove_node(self, name):
 
+        if name in self._binding:
+            self._erase_binding(name)
+
+        index = self._istate_index[name]
         del self[name]
         self.names.remove(name)
-        del self.logicExp[name]
-        del self._attribution[name]
-        del self._initState[name]
+        self._istate_index = {name: i for i, name in enumerate(self.names)}
+        self._istate_probs = numpy.delete(self._istate_probs, index, axis=0)
+        self._istate_macros.pop(name, None)
 
     def copy(self):
         new_ndList = [self[name].copy() for name in self.names]
         new_network = Network(new_ndList)
-        new_network._attribution = self._attribution.copy()
-        new_network._initState = self._initState.copy()
+        new_network._istate_probs = self._istate_probs[:len(self.names)].copy()
+        new_network._istate_macros = self._istate_macros.copy()
+        new_network._bound_istates = self._bound_istates.copy()
+        new_network._binding = self._binding.copy()
         return new_network
 
+    def __reduce__(self):
+        # OrderedDict pickling would call Network() without its node list,
+        # which breaks sending simulations to and from worker processes
+        return (self.__class__, (list(self.values()),), self.__dict__.copy())
+
     def set_istate(self, nodes, probDict, warnings=True):
         """
         Change the inital states probability of one or several nodes.
@@ -199,33 +251,92 @@ class Network(collections.OrderedDict):
                       file=stderr)
                 return
 
-            if isinstance(self._attribution[nodes], tuple):
+            if nodes in self._binding:
                 if warnings:
                     print("Warning, node %s was previously bound to other nodes" % nodes, file=stderr)
                 self._erase_binding(nodes)
-            self._initState[nodes] = {0: probDict[0], 1: probDict[1]}
+            self._set_node_istate(nodes, probDict[0], probDict[1])
 
         elif _testStateDict(probDict, len(nodes)):
-            for node in nodes:
-                if isinstance(self._attribution[node], tuple):
-                    if warnings:
-                        print("Warning, node %s was previously bound to other"
-                          "nodes" % node, file=stderr)
-                    self._erase_binding(node)
+            self._bind_nodes(nodes, probDict, warnings)
 
-            # Now, forall node in nodes, self_attribution[node] is a singleton
-            for node in nodes:
-                self._initState.pop(node)
-                self._attribution[node] = tuple(nodes)
+    def set_istate_distribution(self, nodes, state_matrix, probs, warnings=True):
+        """
+        Set the joint initial state distribution of several nodes from arrays.
+
+        :param list nodes: the nodes to be bound
+        :param state_matrix: a 0/1 matrix with one row per state and one column per node
+        :param probs: the probability of each row of state_matrix
 
-            self._initState[tuple(nodes)] = probDict
+        This is equivalent to :py:meth:`set_istate` with a dictionary
+        {tuple(state_matrix[i]): probs[i]}, but is much faster for thousands
+        of states. Duplicated states are merged, summing their probabilities.
 
+        **Example**
+
+        >>> my_network.set_istate_distribution(['node1', 'node2'], [[0, 0], [1, 0], [0, 1]], [0.4, 0.6, 0])
+        """
+        state_matrix = numpy.asarray(state_matrix)
+        probs = numpy.asarray(probs, dtype=float)
+
+        if (state_matrix.ndim != 2 or state_matrix.shape[1] != len(nodes)
+            or state_matrix.shape[0] != len(probs)):
+            print("Error, state matrix must have one column per node and one row per probability",
+                  file=stderr)
+            return
+
+        if not ((state_matrix == 0) | (state_matrix == 1)).all():
+            print("Error, state matrix must only contain 0 and 1", file=stderr)
+            return
+
+        # Rows are packed as bytes to be merged, which also sorts them as
+        # the states are printed in the cfg
+        packed = numpy.packbits(state_matrix.astype(numpy.uint8), axis=1)
+        packed = numpy.ascontiguousarray(packed).view(numpy.dtype((numpy.void, packed.shape[1]))).reshape(-1)
+        packed_states, inverse = numpy.unique(packed, return_inverse=True)
+        states = numpy.unpackbits(
+            packed_states.view(numpy.uint8).reshape(len(packed_states), -1), axis=1, count=len(nodes)
+        )
+        merged_probs = numpy.bincount(inverse.reshape(-1), weights=probs, minlength=len(states))
+        self._bind_nodes(nodes, _StateDistribution(states, merged_probs), warnings)
+
+    def _check_node(self, node):
+        if node not in self._istate_index:
+            raise ValueError("Node %s is not in the network" % node)
+
+    def _bind_nodes(self, nodes, probas, warnings):
+        for node in nodes:
+            self._check_node(node)
+
+        for node in nodes:
+            if node in self._binding:
+                if warnings:
+                    print("Warning, node %s was previously bound to other"
+                      "nodes" % node, file=stderr)
+                self._erase_binding(node)
+
+        # Now, forall node in nodes, node is not bound
+        for node in nodes:
+            self._istate_macros.pop(node, None)
+            self._binding[node] = tuple(nodes)
+
+        self._bound_istates[tuple(nodes)] = probas
+
+    def _set_node_istate(self, node, proba_0, proba_1):
+        self._check_node(node)
+        index = self._istate_index[node]
+        if isinstance(proba_0, str) or isinstance(proba_1, str):
+            self._istate_macros[node] = {0: proba_0, 1: proba_1}
+        else:
+            self._istate_macros.pop(node, None)
+            self._istate_probs[index] = (proba_0, proba_1)
 
     def _erase_binding(self, node):
-        self._initState.pop(self._attribution[node])
-        for nd in self._attribution[node]:
-            self._attribution[nd] = [nd]
-            self.set_istate(nd, [0.5, 0.5])
+        binding = self._binding[node]
+        del self._bound_istates[binding]
+        for nd in binding:
+            del self._binding[nd]
+            self._set_node_istate(nd, 0.5, 0.5)
 
 
     def __str__(self):
@@ -237,36 +348,153 @@ class Network(collections.OrderedDict):
         return string
 
     def get_istate(self):
-        return self._initState
+        """Get the initial states probabilities.
+
+        :return: for each node, or tuple of bound nodes, its initial state distribution
+        :rtype: OrderedDict
+
+        The returned dictionary is built on demand, modifying it has no effect
+        on the network: use :py:meth:`set_istate` instead.
+        """
+        istates = collections.OrderedDict()
+        for name, (proba_0, proba_1) in zip(self.names, self._istate_probs[:len(self.names)].tolist()):
+            if name not in self._binding:
+                istates[name] = self._istate_macros.get(name, {0: proba_0, 1: proba_1})
+        istates.update(self._bound_istates)
+        return istates
 
     def print_istate(self, out=stdout):
         print(self.str_istate(), file=out)
 
     def str_istate(self):
         stringList = []
-        for binding in self._initState:
-            string = ''
-            if isinstance(binding, tuple):   
-                string += '[' + ", ".join(list(binding)) + '].istate = '
+        for name, (proba_0, proba_1) in zip(self.names, self._istate_probs[:len(self.names)].tolist()):
+            if name in self._binding:
+                continue
+            if name in self._istate_macros:
+                proba_0, proba_1 = self._istate_macros[name][0], self._istate_macros[name][1]
+
+            if proba_0 == 1:
+                stringList.append(name + ".istate = FALSE;")
+            elif proba_1 == 1:
+                stringList.append(name + ".istate = TRUE;")
+            elif proba_0 == 0.5 and proba_1 == 0.5:
+                pass
+            else:
+                stringList.append('[' + name + '].istate = ' + str(proba_0) + '[0] , ' + str(proba_1) + '[1];')
+
+        for binding, probas in self._bound_istates.items():
+            string = '[' + ", ".join(list(binding)) + '].istate = '
+            if isinstance(probas, _StateDistribution):
+                string += probas.str_states()
+            else:
                 string += ' , '.join(
-                    [str(self._initState[binding][t]) + ' ' + str(list(t)) for t in sorted(self._initState[binding])]
+                    [str(probas[t]) + ' ' + str(list(t)) for t in sorted(probas)]
                 )
-                string += ';'
-            else:
-                if self._initState[binding][0] == 1:
-                    string += binding + ".istate = FALSE;"
-                elif self._initState[binding][1] == 1:
-                    string += binding + ".istate = TRUE;"
-                elif self._initState[binding][0] == 0.5 and self._initState[binding][1] == 0.5:
-                    pass
-                else: 
-                    string += '[' + binding + '].istate = '
-                    string += str(self._initState[binding][0]) + '[0] , '
-                    string += str(self._initState[binding][1]) + '[1];'
-            if len(string) > 0:
-                stringList.append(string)
+            string += ';'
+            stringList.append(string)
         return '\n'.join(stringList)
 
+    def _get_influence_index(self):
+        # The index is rebuilt if a node was added, removed, or had its logic
+        # or rates modified, as its symbols are then a new frozenset
+        names = list(self.keys())
+        symbols = [node.get_symbols() for node in self.values()]
+        if (self._influence_index is None or self._influence_index["names"] != names
+            or any(a is not b for a, b in zip(symbols, self._influence_index["symbols"]))):
+
+            index = {name: i for i, name in enumerate(names)}
+            regulators = [sorted(index[symbol] for symbol in node_symbols if symbol in index) for node_symbols in symbols]
+
+            # Regulators of node i are reg_indices[reg_indptr[i]:reg_indptr[i+1]], 
+            # and its targets are tar_indices[tar_indptr[i]:tar_indptr[i+1]] (CSR format)
+            reg_indptr = numpy.cumsum([0] + [len(node_regulators) for node_regulators in regulators])
+            reg_indices = numpy.array([i for node_regulators in regulators for i in node_regulators], dtype=int)
+            targets = numpy.repeat(numpy.arange(len(names)), numpy.diff(reg_indptr))
+            order = numpy.lexsort((targets, reg_indices))
+            tar_indptr = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(reg_indices, minlength=len(names)))])
+            tar_indices = targets[order]
+
+            self._influence_index = {
+                "names": names, "symbols": symbols, "index": index,
+                "regulators": (reg_indptr, reg_indices), "targets": (tar_indptr, tar_indices)
+            }
+        return self._influence_index
+
+    def get_regulators(self, node):
+        """Get the nodes appearing in the logic or rates of a node.
+
+        :param str node: the name of the node
+        :rtype: list of str
+        """
+        influences = self._get_influence_index()
+        indptr, indices = influences["regulators"]
+        i = influences["index"][node]
+        return [influences["names"][j] for j in indices[indptr[i]:indptr[i+1]]]
+
+    def get_targets(self, node):
+        """Get the nodes whose logic or rates depend on a node.
+
+        :param str node: the name of the node
+        :rtype: list of str
+        """
+        influences = self._get_influence_index()
+        indptr, indices = influences["targets"]
+        i = influences["index"][node]
+        return [influences["names"][j] for j in indices[indptr[i]:indptr[i+1]]]
+
+    def get_upstream_nodes(self, nodes):
+        """Get all the nodes which can influence the given nodes, including themselves.
+
+        :param nodes: the name of a node or a list of names
+        :rtype: list of str, in the order of the network
+
+        **Example**
+
+        >>> my_network.set_output(['Apoptosis'])
+        >>> needed = my_network.get_upstream_nodes(my_network.get_output()) # nodes which matter for the outputs
+        """
+        return self._get_closure(nodes, "regulators")
+
+    def get_downstream_nodes(self, nodes):
+        """Get all the nodes which can be influenced by the given nodes, including themselves.
+
+        :param nodes: the name of a node or a list of names
+        :rtype: list of str, in the order of the network
+        """
+        return self._get_closure(nodes, "targets")
+
+    def _get_closure(self, nodes, direction):
+        if isinstance(nodes, str):
+            nodes = [nodes]
+        influences = self._get_influence_index()
+        indptr, indices = influences["targets" if direction == "targets" else "regulators"]
+        reached = numpy.zeros(len(influences["names"]), dtype=bool)
+        to_visit = [influences["index"][node] for node in nodes]
+        reached[to_visit] = True
+        while len(to_visit) > 0:
+            neighbours = numpy.concatenate([indices[indptr[i]:indptr[i+1]] for i in to_visit])
+            neighbours = numpy.unique(neighbours[~reached[neighbours]])
+            reached[neighbours] = True
+            to_visit = neighbours.tolist()
+        return [influences["names"][i] for i in numpy.flatnonzero(reached)]
+
+    def get_influence_graph(self):
+        """Get the influence graph of the network, as a networkx DiGraph.
+
+        There is an edge from A to B if A appears in the logic or rates of B.
+        """
+        import networkx as nx
+        influences = self._get_influence_index()
+        indptr, indices = influences["regulators"]
+        names = influences["names"]
+        graph = nx.DiGraph()
+        graph.add_nodes_from(names)
+        graph.add_edges_from(
+            (names[j], names[i]) for i in range(len(names)) for j in indices[indptr[i]:indptr[i+1]]
+        )
+        return graph
+
     def set_output(self, output_list):
         """Set all the nodes that are not in the output_list as internal.
 
@@ -292,6 +520,58 @@ class Network(collections.OrderedDict):
         for nd in self:
             self[nd].in_graph = nd in nodes_list
         
+# Names in a MaBoSS expression, excluding $variables, @variables and numbers
+_symbol_pattern = re.compile(r"(?<![\w$@.])[A-Za-z_]\w*")
+_reserved_symbols = frozenset(["true", "false", "not", "and", "or", "xor", "node"])
+
+
+class _StateDistribution(collections.abc.Mapping):
+    """Joint initial state distribution of bound nodes, stored as arrays.
+
+    Behaves as the {(b1, ..., bn): P(b1,..,bn),...} dictionary given to
+    :py:meth:`Network.set_istate`, which is only built if needed.
+    """
+
+    def __init__(self, states, probs):
+        self.states = states
+        self.probs = probs
+        self._dict = None
+
+    def _as_dict(self):
+        if self._dict is None:
+            self._dict = dict(zip(map(tuple, self.states.tolist()), self.probs.tolist()))
+        return self._dict
+
+    def __getitem__(self, state):
+        return self._as_dict()[state]
+
+    def __iter__(self):
+        return iter(self._as_dict())
+
+    def __len__(self):
+        return len(self.probs)
+
+    def __repr__(self):
+        return repr(self._as_dict())
+
+    def str_states(self):
+        """Format the states as in the cfg : 'p1 [0, 1] , p2 [1, 1]'."""
+        nb_states, nb_nodes = self.states.shape
+        # Each state is written as "[b1, b2, ..., bn]", directly as bytes
+        chars = numpy.empty((nb_states, 3*nb_nodes + 1), dtype=numpy.uint8)
+        chars[:, 0] = ord('[')
+        chars[:, 1::3] = self.states + ord('0')
+        chars[:, 2::3] = ord(',')
+        chars[:, 3::3] = ord(' ')
+        chars[:, -2] = ord(']')
+        states = chars[:, :-1].tobytes().decode("ascii")
+        width = 3*nb_nodes
+        return ' , '.join(
+            "%r %s" % (proba, states[i*width:(i+1)*width])
+            for i, proba in enumerate(self.probs.tolist())
+        )
+
+
 def _testStateDict(stDict, nbState):
     """Check if stateDict is a good parameter for set_istate."""
     def goodTuple(t):
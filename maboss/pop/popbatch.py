@@ -0,0 +1,194 @@
+"""
+Batch of PopMaBoSS simulations, with parameters overrides, run in a process pool.
+"""
+from __future__ import print_function
+
+import sys
+import itertools
+import traceback
+import multiprocessing
+
+import numpy
+import pandas
+
+from .popresult import PopMaBoSSResult
+
+# The compiled simulation cannot be pickled : the forked workers inherit it, each one in its own memory.
+# Its copy() does not keep all the model (initial states are lost), so instead of being copied for each variant,
+# the simulation of the worker gets the overrides of the variant, which are reverted after the run
+_batch_sim = None
+
+
+def make_batch_variants(parameters, grid=True):
+    """
+    Return the variants of a batch, as a list of dicts of parameters overrides
+    :param parameters: dict of the values of the parameters, such as { "$DivRate" : [0.01, 0.1], "init_pop" : [10, 100] }
+    :param grid: all the combinations of values if True, otherwise the values are taken together (all the lists must have the same length)
+    """
+    names = list(parameters.keys())
+    values = [list(parameters[name]) for name in names]
+
+    if grid:
+        return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+    if len(set(len(name_values) for name_values in values)) > 1:
+        print("All the lists of values must have the same length when grid is False", file=sys.stderr)
+        return None
+
+    return [dict(zip(names, point)) for point in zip(*values)]
+
+
+def _run_batch_variant(task):
+    """Run a variant on the simulation of the worker, and return its raw simple and custom probtrajs, or the error it raised"""
+    index, overrides, custom, states = task
+    sim = _batch_sim
+    defaults = dict((name, sim.param[name]) for name in overrides.keys() if name in sim.param.keys())
+    try:
+        sim.update_parameters(**overrides)
+        result = sim.run()
+        return index, (
+            result.get_simple_probtraj(),
+            result.get_custom_probtraj() if custom else None,
+            result.get_probtraj() if states else None
+        ), None
+    except Exception:
+        return index, None, traceback.format_exc().strip().split("\n")[-1]
+    finally:
+        if len(defaults) > 0:
+            sim.update_parameters(**defaults)
+
+
+def run_batch(simulation, variants, workers=None, states=False, progress=None):
+    """
+    Run a variant of the PopMaBoSS simulation for each dict of parameters overrides, and return a PopBatchResult
+    """
+    global _batch_sim
+
+    custom = simulation.get_custom_pop_output() is not None
+    tasks = [(index, dict(overrides), custom, states) for index, overrides in enumerate(variants)]
+
+    if progress is True:
+        progress = print_batch_progress
+
+    runs = [None]*len(tasks)
+    errors = {}
+    _batch_sim = simulation.cmaboss_sim
+    try:
+        if (workers is not None and workers <= 1) or len(tasks) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            outputs = (_run_batch_variant(task) for task in tasks)
+            pool = None
+        else:
+            pool = multiprocessing.get_context("fork").Pool(processes=workers)
+            outputs = pool.imap_unordered(_run_batch_variant, tasks)
+
+        try:
+            for done, (index, raw_results, error) in enumerate(outputs):
+                runs[index] = raw_results
+                if error is not None:
+                    errors[index] = error
+                if progress is not None:
+                    progress(done+1, len(tasks), index, error)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    finally:
+        _batch_sim = None
+
+    return PopBatchResult(simulation, [task[1] for task in tasks], runs, errors)
+
+
+def print_batch_progress(done, total, index, error):
+    if error is not None:
+        print("Variant %d failed : %s" % (index, error), file=sys.stderr)
+    print("%d/%d variants done" % (done, total))
+
+
+class PopBatchVariantResult(PopMaBoSSResult):
+    """
+        Results of a variant of a batch, holding the arrays of its simple and custom probtrajs
+        (and of its states probtraj if the batch kept them).
+    """
+
+    def __init__(self, sim, overrides, raw_simple_probtraj, raw_custom_probtraj=None, raw_states_probtraj=None):
+        PopMaBoSSResult.__init__(self, sim)
+        self.overrides = overrides
+        self.raw_simple_probtraj = raw_simple_probtraj
+        self.raw_custom_probtraj = raw_custom_probtraj
+        self.raw_states_probtraj = raw_states_probtraj
+
+    def get_raw_simple_probtraj(self):
+        return self.raw_simple_probtraj
+
+    def get_raw_custom_probtraj(self):
+        if self.raw_custom_probtraj is None:
+            raise ValueError("No custom population output was set for the batch")
+        return self.raw_custom_probtraj
+
+    def get_raw_custom_last_probtraj(self):
+        raw_probas, indexes, columns, _ = self.get_raw_custom_probtraj()
+        return [raw_probas[-1]], [indexes[-1]], columns
+
+    def get_raw_states_probtraj(self):
+        if self.raw_states_probtraj is None:
+            raise ValueError("The states probtrajs were not kept, run the batch with states=True")
+        return self.raw_states_probtraj
+
+    def get_raw_last_states_probtraj(self):
+        raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
+        return [raw_probas[-1]], [indexes[-1]], states
+
+
+class PopBatchResult(object):
+    """
+        .. py:class:: Results of a batch of PopMaBoSS simulations, one for each variant of the parameters.
+
+        A failed variant does not stop the others : its error is kept in errors, and its result is None.
+    """
+
+    def __init__(self, sim, variants, runs, errors):
+        self._sim = sim
+        self.variants = variants
+        self.errors = errors
+        self.results = [
+            None if raw_results is None else PopBatchVariantResult(sim, overrides, *raw_results)
+            for overrides, raw_results in zip(variants, runs)
+        ]
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, index):
+        return self.results[index]
+
+    def get_variants(self):
+        """
+            .. py:method:: Returns a pandas dataframe of the parameters overrides, one row per variant
+        """
+        return pandas.DataFrame(self.variants, index=pandas.RangeIndex(len(self.variants), name="variant"))
+
+    def get_simple_popsizes(self):
+        """
+            .. py:method:: Returns a pandas dataframe of the expected population size, one row per variant and one column per time point. The rows of failed variants are NaN
+        """
+        rows = {}
+        for index, result in enumerate(self.results):
+            if result is not None:
+                rows[index] = result.get_simple_popsize()
+        table = pandas.DataFrame(rows).T.reindex(range(len(self.results)))
+        table.index.name = "variant"
+        return table
+
+    def get_last_simple_states_probtrajs(self):
+        """
+            .. py:method:: Returns a pandas dataframe of the simple states probabilities at the last time point, one row per variant. The rows of failed variants are NaN
+        """
+        rows = {}
+        for index, result in enumerate(self.results):
+            if result is not None:
+                raw_probas, _, states, _ = result.get_raw_simple_probtraj()
+                rows[index] = pandas.Series(numpy.asarray(raw_probas)[-1, 1:], index=states[1:])
+        table = pandas.DataFrame(rows).T.reindex(range(len(self.results))).fillna(0)
+        table.loc[list(self.errors.keys())] = numpy.nan
+        table.index.name = "variant"
+        return table.sort_index(axis=1)
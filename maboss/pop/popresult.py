@@ -8,6 +8,7 @@ class PopMaBoSSResult:
             
     def __init__(self, sim):
         self._sim = sim
+        self._pop_states = None
         
     def get_last_states_probtraj(self):
         
@@ -45,6 +46,37 @@ class PopMaBoSSResult:
 
         return df
 
+    def get_states_probtraj_by_time(self, time):
+        
+        raw_res = self.get_raw_states_probtraj_by_time(time)
+        df = pandas.Series(
+            raw_res[0][0], 
+            index=raw_res[2], 
+            name=raw_res[1][0]
+        )
+        df.sort_index(inplace=True)
+
+        return df
+
+    def iter_states_probtraj(self, start=0, stop=None):
+        """
+            Iterates over the time points of the trajectory, in order, yielding the states probabilities 
+            of each time point as a pandas Series named after its time.
+
+            :param int start: (optional) index of the first time point
+            :param int stop: (optional) index after the last time point
+        """
+        for time, states, probas in self.iter_raw_states_probtraj(start, stop):
+            df = pandas.Series(probas, index=states, name=time)
+            df.sort_index(inplace=True)
+            yield df
+
+    def iter_raw_states_probtraj(self, start=0, stop=None):
+        raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
+        for i in range(start, len(indexes) if stop is None else min(stop, len(indexes))):
+            nonzero = numpy.flatnonzero(raw_probas[i])
+            yield indexes[i], [states[j] for j in nonzero], raw_probas[i][nonzero]
+
     ########### Simple Last Probtraj
 
     def get_last_simple_states_probtraj(self):
@@ -164,38 +196,21 @@ class PopMaBoSSResult:
         #     _nodes = self.sim.get_nodes()
             
         raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
-                
-        self._popnodes = set()  #{"{%s:%s}" % (node,0) for node in _nodes}
-        for t_state in states:
-            for subpopstates in t_state[1:-1].split(","):
-                state, pop = subpopstates[1:-1].split(":")
-                if state != "<nil>":
-                    for node in state.split(" -- "):
-                        self._popnodes.add("{%s:%s}" % (node, pop))
-                        
-                        
-        def sort_popnodes(popnode):
-            node, pop = popnode[1:-1].split(":")
-            return (node, int(pop))
-        
-        self._popnodes = sorted(list(self._popnodes), key=lambda key: sort_popnodes(key))
+        pop_states = self.get_pop_states(states)
+        
+        # Each (node, number of cells) of the substates, and the population states in which it appears
+        popnodes_states, popnodes_ids, popnodes_keys = pop_states.get_popnodes()
+        self._popnodes = ["{%s:%s}" % popnode for popnode in popnodes_keys]
         self._popnodes_index = {popnode:index for index, popnode in enumerate(self._popnodes)}                
         
-        self._popnodes_by_nodes = {node:[] for node in self._sim.get_nodes()}
-        for popnode in self._popnodes:
-            node, pop = popnode[1:-1].split(":")
+        self._popnodes_by_nodes = {node:[] for node in pop_states.nodes}
+        for (node, _), popnode in zip(popnodes_keys, self._popnodes):
             self._popnodes_by_nodes[node].append(popnode)
                 
-        new_probs = numpy.zeros((len(indexes), len(self._popnodes)))
-        for i in range(len(indexes)):
-            for j, state in enumerate(states):
-                for subpopstates in state[1:-1].split(","):
-                    state, pop = subpopstates[1:-1].split(":")
-                    if state != "<nil>":
-                        for node in state.split(" -- "):
-                            new_probs[i, self._popnodes_index["{%s:%s}" % (node, pop)]] += raw_probas[i][j]
+        new_probs = numpy.zeros((len(self._popnodes), len(indexes)))
+        numpy.add.at(new_probs, popnodes_ids, numpy.asarray(raw_probas).T[popnodes_states])
         
-        self.nd_probtraj = pandas.DataFrame(new_probs, columns=self._popnodes, index=indexes)
+        self.nd_probtraj = pandas.DataFrame(new_probs.T, columns=self._popnodes, index=indexes)
         
         _list_popnodes = []
         if len(nodes) > 0:
@@ -284,24 +299,13 @@ class PopMaBoSSResult:
     def get_nb_dists(self):
 
         raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
+        pop_states = self.get_pop_states(states)
         
-        sizes = set()
-        for state in states:
-            popstates = parse_pop_state(state)
-            nb = sum(popstates.values())
-            sizes.add(nb)
-            
-        sizes = sorted(list(sizes))
-        sizes_indexes = {size:index for index, size in enumerate(sizes)}
-        
-        raw_nb_dists = numpy.zeros((len(indexes), len(sizes)))
-        for i in range(len(indexes)):
-            for j, state in enumerate(states):
-                popstates = parse_pop_state(state)
-                nb = sum(popstates.values())
-                raw_nb_dists[i, sizes_indexes[nb]] += raw_probas[i][j]
+        sizes, sizes_indexes = numpy.unique(pop_states.totals, return_inverse=True)
+        raw_nb_dists = numpy.zeros((len(sizes), len(indexes)))
+        numpy.add.at(raw_nb_dists, sizes_indexes, numpy.asarray(raw_probas).T)
                 
-        return pandas.DataFrame(raw_nb_dists, columns=sizes, index=indexes)
+        return pandas.DataFrame(raw_nb_dists.T, columns=sizes.tolist(), index=indexes)
     
     def get_last_nb_dist(self):
         dist_state = {}
@@ -349,100 +353,55 @@ class PopMaBoSSResult:
     def get_activity_ratio_expected(self, node):
         
         raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
-        activity_ratio = []
-        for i in range(len(indexes)):
-            activity = 0
-            for j, state in enumerate(states):
-                popstates = parse_pop_state(state)
-                nb = sum(popstates.values())
-                
-                for state, pop in popstates.items():
-                    if state != "<nil>" and node in state.split(" -- "):                 
-                        activity += raw_probas[i][j]*pop/nb
-                        
-            activity_ratio.append(activity)
-        return pandas.Series(activity_ratio, index=indexes, name=node)
+        ratios = self.get_pop_states(states).get_nodes_ratios([node])[:, 0]
+        return pandas.Series(numpy.asarray(raw_probas).dot(ratios), index=indexes, name=node)
         
     def get_activity_ratio_stdev(self, node):
         
         raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
-        activity_ratio = self.get_activity_ratio_expected(node)
+        ratios = self.get_pop_states(states).get_nodes_ratios([node])[:, 0]
+        raw_probas = numpy.asarray(raw_probas)
+        expected = raw_probas.dot(ratios)
         
-        stdevs = []
-        for i in range(len(indexes)):
-            stdev = 0
-            for j, state in enumerate(states):
-                    popstates = parse_pop_state(state)
-                    nb = sum(popstates.values())
-                    t_proba = 0
-                    t_stdev = 0
-                    for state, pop in popstates.items():
-                        if state != "<nil>" and node in state.split(" -- "):                 
-                            t_proba += raw_probas[i][j]
-                            t_stdev += pop/nb
-                    stdev += ((t_stdev-activity_ratio.iloc[i])**2)*t_proba            
-            stdevs.append((stdev)**0.5)
-        return pandas.Series(stdevs, index=indexes, name=node)
+        variances = (raw_probas*(ratios[numpy.newaxis, :] - expected[:, numpy.newaxis])**2).sum(axis=1)
+        return pandas.Series(variances**0.5, index=indexes, name=node)
     
     def get_activity_ratio_nodes(self, node0, node1, time=None, nbins=20):
         raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
-        
-        if time is None:
-            raw_probas = raw_probas[-1]
-            indexes = indexes[-1]
-        else:
-            raw_probas = raw_probas[indexes.index(time)]
-            indexes = time
-            
-        space0 = numpy.linspace(0, 1, nbins+1)
-        space1 = numpy.linspace(0, 1, nbins+1)
-        probas = numpy.zeros((len(space0), len(space1)))
-        for j, state in enumerate(states):
-            popstates = parse_pop_state(state)
-            nb = sum(popstates.values())
-            pop0 = 0
-            pop1 = 0
-            for state, pop in popstates.items():
-                if state != "<nil>":
-                    popnb = pop/nb
-                    if node0 in state.split(" -- "):                 
-                        pop0 += popnb
-                    if node1 in state.split(" -- "):
-                        pop1 += popnb
-            pos0 =  numpy.floor(pop0*nbins).astype(int)
-            pos1 =  numpy.floor(pop1*nbins).astype(int)
-            probas[pos0, pos1] += raw_probas[j]
-
-        return pandas.DataFrame(probas, index=["%.2g" % val for val in space1], columns=["%.2g" % val for val in space0])
+        ratios = self.get_pop_states(states).get_nodes_ratios([node0, node1])
+        return self._get_activity_ratio_hist(raw_probas, indexes, ratios, time, nbins)
     
     def get_activity_ratio_states(self, state0, state1, time=None, nbins=20):
         raw_probas, indexes, states, _ = self.get_raw_states_probtraj()
+        ratios = self.get_pop_states(states).get_substates_ratios([state0, state1])
+        return self._get_activity_ratio_hist(raw_probas, indexes, ratios, time, nbins)
+
+    def _get_activity_ratio_hist(self, raw_probas, indexes, ratios, time, nbins):
         
         if time is None:
             raw_probas = raw_probas[-1]
-            indexes = indexes[-1]
         else:
-            raw_probas = raw_probas[indexes.index(time)]
-            indexes = time
+            raw_probas = raw_probas[list(indexes).index(time)]
             
         space0 = numpy.linspace(0, 1, nbins+1)
         space1 = numpy.linspace(0, 1, nbins+1)
         probas = numpy.zeros((len(space0), len(space1)))
-        for j, state in enumerate(states):
-            popstates = parse_pop_state(state)
-            nb = sum(popstates.values())
-            pop0 = 0
-            pop1 = 0
-            for state, pop in popstates.items():
-                if state == state0:
-                    pop0 += pop/nb
-                if state == state1:
-                    pop1 += pop/nb
-            pos0 =  numpy.floor(pop0*nbins).astype(int)
-            pos1 =  numpy.floor(pop1*nbins).astype(int)
-            probas[pos0, pos1] += raw_probas[j]
+        positions = numpy.floor(ratios*nbins).astype(int)
+        numpy.add.at(probas, (positions[:, 0], positions[:, 1]), raw_probas)
 
         return pandas.DataFrame(probas, index=["%.2g" % val for val in space1], columns=["%.2g" % val for val in space0])
+
+    def get_pop_states(self, states):
+        """
+            Returns the population states decoded as a PopStates table. The table is kept for the next calls
+            with the same list of states.
+
+            :param list states: the population states, such as "[{A -- B:3},{C:1}]"
+        """
+        if self._pop_states is None or self._pop_states.states is not states:
+            self._pop_states = PopStates(states)
+        return self._pop_states
+
     
 def parse_pop_state(cols):    
     pops = {}
@@ -452,4 +411,94 @@ def parse_pop_state(cols):
             pops[name] = int(value)
     return pops
 
+
+class PopStates:
+    """
+        Population states decoded once in a sparse representation : each population state is a list of 
+        (substate id, number of cells), stored as contiguous arrays, along with the total number of cells 
+        of each population state. The analytics of the results are then reductions of the 
+        (time x population state) probability matrix over these arrays.
+
+        :param list states: the population states, such as "[{A -- B:3},{C:1}]"
+    """
+
+    def __init__(self, states):
+        self.states = states
+        
+        self.substates = []
+        substates_index = {}
+        self.indptr = [0]
+        ids = []
+        counts = []
+        for state in states:
+            for substate, count in parse_pop_state(state).items():
+                ids.append(substates_index.setdefault(substate, len(substates_index)))
+                counts.append(count)
+            self.indptr.append(len(ids))
+
+        self.substates = list(substates_index.keys())
+        self.substates_index = substates_index
+        self.indptr = numpy.array(self.indptr, dtype=numpy.int64)
+        self.ids = numpy.array(ids, dtype=numpy.int64)
+        self.counts = numpy.array(counts, dtype=numpy.int64)
+        self.rows = numpy.repeat(numpy.arange(len(states)), numpy.diff(self.indptr))
+        self.totals = numpy.bincount(self.rows, weights=self.counts, minlength=len(states)).astype(numpy.int64)
+
+        self.substates_nodes = [
+            [] if substate == "<nil>" else substate.split(" -- ") for substate in self.substates
+        ]
+        self.nodes = sorted(set(node for nodes in self.substates_nodes for node in nodes))
+
+    def get_count_matrix(self):
+        """Returns the (population state x substate) matrix of the numbers of cells"""
+        matrix = numpy.zeros((len(self.states), len(self.substates)), dtype=numpy.int64)
+        matrix[self.rows, self.ids] = self.counts
+        return matrix
+    
+    def _get_fractions(self):
+        # Fraction of the cells of each population state in each of its substates, zero for empty populations
+        totals = self.totals[self.rows]
+        return numpy.divide(self.counts, totals, out=numpy.zeros(len(self.counts)), where=totals > 0)
+
+    def get_substates_ratios(self, substates):
+        """Returns the (population state x substates) matrix of the fractions of cells in each substate"""
+        columns = numpy.array([self.substates_index.get(substate, -1) for substate in substates])
+        selected = numpy.zeros((len(self.substates), len(substates)))
+        for i, column in enumerate(columns):
+            if column >= 0:
+                selected[column, i] = 1
+        
+        ratios = numpy.zeros((len(self.states), len(substates)))
+        numpy.add.at(ratios, self.rows, self._get_fractions()[:, numpy.newaxis]*selected[self.ids])
+        return ratios
+        
+    def get_nodes_ratios(self, nodes):
+        """Returns the (population state x nodes) matrix of the fractions of cells with each node active"""
+        incidence = numpy.array([
+            [node in substate_nodes for node in nodes] for substate_nodes in self.substates_nodes
+        ], dtype=float).reshape(len(self.substates), len(nodes))
+        
+        ratios = numpy.zeros((len(self.states), len(nodes)))
+        numpy.add.at(ratios, self.rows, self._get_fractions()[:, numpy.newaxis]*incidence[self.ids])
+        return ratios
+
+    def get_popnodes(self):
+        """
+            Returns the occurences of the (node, number of cells) of the substates, as the arrays of
+            their population states and of their ids, and the list of the (node, number of cells) sorted
+            by node and number of cells
+        """
+        keys = {}
+        states = []
+        popnodes = []
+        for row, substate, count in zip(self.rows, self.ids, self.counts):
+            for node in self.substates_nodes[substate]:
+                popnodes.append(keys.setdefault((node, int(count)), len(keys)))
+                states.append(row)
+
+        sorted_keys = sorted(keys.keys())
+        order = numpy.empty(len(keys), dtype=numpy.int64)
+        order[[keys[key] for key in sorted_keys]] = numpy.arange(len(keys))
+        return numpy.array(states, dtype=numpy.int64), order[numpy.array(popnodes, dtype=numpy.int64)], sorted_keys
+
 __all__ = ["PopMaBoSSResult"]
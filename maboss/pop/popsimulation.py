@@ -7,6 +7,7 @@ import os, sys
 from .popresult import PopMaBoSSResult
 from .cmabosspopresult import cMaBoSSPopMaBoSSResult
 from .storedpopresult import StoredPopResult
+from .popbatch import run_batch, make_batch_variants
 
 class PopSimulation(object):
 
@@ -33,6 +34,7 @@ class PopSimulation(object):
 
         self.param = self.cmaboss_sim.param
         self.network = self.cmaboss_sim.network
+        self._custom_pop_output = None
         
     def count_nodes(self, network):
         
@@ -64,9 +66,15 @@ class PopSimulation(object):
 
     def set_custom_pop_output(self, formula):
         self.cmaboss_sim.set_custom_pop_output(formula)
+        self._custom_pop_output = formula
+
+    def get_custom_pop_output(self):
+        return self._custom_pop_output
     
     def copy(self):
-        return PopSimulation(cmaboss=self.cmaboss, cmaboss_sim=self.cmaboss_sim.copy())
+        new_sim = PopSimulation(cmaboss=self.cmaboss, cmaboss_sim=self.cmaboss_sim.copy())
+        new_sim._custom_pop_output = self._custom_pop_output
+        return new_sim
         
     # def get_nodes(self):
     #     return self.cmaboss_sim.get_nodes()
@@ -77,6 +85,32 @@ class PopSimulation(object):
         else:
             return StoredPopResult(self, workdir, prefix, hexfloat)
 
+    def run_batch(self, variants, grid=True, workers=None, states=False, progress=None):
+        """
+        .. py:method:: Runs a variant of the simulation for each set of parameters overrides, in a pool of processes
+
+        The processes are forked from this one, each with its own image of the simulation, on which the overrides
+        of its variants are applied with update_parameters, and reverted after each run. 
+        The simple probtraj (and the custom probtraj, if a custom population output was set) of each variant are returned 
+        as arrays. A variant raising an error does not stop the others. On platforms which cannot fork processes, 
+        the variants are run one after the other.
+
+        :param variants: list of dicts of parameters overrides, such as [{"$DivRate": 0.1, "init_pop": 10}, ...], 
+            or dict of lists of values, such as {"$DivRate": [0.1, 0.2], "init_pop": [10, 100]}
+        :param grid: (optional) for a dict of lists, run all the combinations of values (default), otherwise the n-th values of all the lists make the n-th variant
+        :param workers: (optional) number of processes, default to the number of CPUs
+        :param states: (optional) also return the population states probtraj of each variant
+        :param progress: (optional) function called with (number of variants done, number of variants, index of the variant, error or None) 
+            when a variant is done, or True to print the progress
+        :return: a PopBatchResult, with one result per variant (None for the failed variants, whose errors are in errors)
+        """
+        if isinstance(variants, dict):
+            variants = make_batch_variants(variants, grid)
+            if variants is None:
+                return
+
+        return run_batch(self, variants, workers, states, progress)
+
     def str_bnd(self):
         return self.cmaboss_sim.str_bnd()
         
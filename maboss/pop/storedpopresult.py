@@ -29,6 +29,7 @@ class StoredPopResult(PopMaBoSSResult):
         
         self._raw_data = None
         self._first_state_index = None
+        self._lines_index = None
 
         self._raw_states = None
         self._raw_probas = None
@@ -102,31 +103,38 @@ class StoredPopResult(PopMaBoSSResult):
     def get_raw_states_probtraj_by_index(self, index):
         
         raw_line, first_index, hexfloat = self._get_raw_data_by_index(index)
-        time = None
-        states = []
-        for i, token in enumerate(split_tab_gen(raw_line)):
-            if i == 0:
-                time = token
-            elif i >= self._first_state_index and (i-first_index) % 3 == 0:
-                states.append(token)
-                
-        states_indexes = {state:i for i, state in enumerate(states)}
-                
-        new_data = np.zeros((len(states)))
-        raw_data = split_tab_gen(raw_line)
-        state = None
-        value = None
-        for i, token in enumerate(raw_data):
-            if i >= first_index and (i-first_index) % 3 == 0:
-                state = token
-            elif i >= first_index and (i-first_index) % 3 == 1:
-                value = token
-                if hexfloat:
-                    new_data[states_indexes[state]] = float.fromhex(value)
-                else:
-                    new_data[states_indexes[state]] = float(value)
-                    
-        return [new_data], [time], states
+        time, states, probas = parse_probtraj_line(raw_line, first_index, hexfloat)
+        return [probas], [time], states
+
+    def get_raw_states_probtraj_by_time(self, time):
+        return self.get_raw_states_probtraj_by_index(self.get_time_index(time))
+
+    def get_time_index(self, time):
+        """
+            Returns the index of a time point of the trajectory.
+
+            :param float time: the time of the time point
+        """
+        _, _, times = self._get_lines_index()
+        matches = np.flatnonzero(np.isclose(times, time, rtol=1e-9, atol=1e-12))
+        if len(matches) == 0:
+            raise ValueError("%g is not a time point of the trajectory" % time)
+        return int(matches[0])
+
+    def iter_raw_states_probtraj(self, start=0, stop=None):
+    
+        first_index, offsets, times = self._get_lines_index()
+        stop = len(offsets) if stop is None else min(stop, len(offsets))
+        if start >= stop:
+            return
+
+        with open(self.get_probtraj_file(), 'rb') as probtraj:
+            probtraj.seek(offsets[start])
+            for i in range(start, stop):
+                line = probtraj.readline().decode()
+                _, states, probas = parse_probtraj_line(line, first_index, line_is_hexfloat(line, first_index))
+                yield float(times[i]), states, probas
+
     ########### Simple Last Probtraj
 
     def get_raw_simple_last_probtraj(self):
@@ -174,6 +182,9 @@ class StoredPopResult(PopMaBoSSResult):
     def get_probtraj_file(self):
         return os.path.join(self._workdir, "%s_pop_probtraj.csv" % self._prefix)
 
+    def get_probtraj_index_file(self):
+        return os.path.join(self._workdir, "%s_pop_probtraj_index.npz" % self._prefix)
+
     def get_simple_probtraj_file(self):
         return os.path.join(self._workdir, "%s_simple_pop_probtraj.csv" % self._prefix)
     
@@ -218,19 +229,31 @@ class StoredPopResult(PopMaBoSSResult):
 
     def _get_raw_data_by_index(self, index):
     
-        with self._get_probtraj_fd() as probtraj:
+        first_index, offsets, _ = self._get_lines_index()
+        with open(self.get_probtraj_file(), 'rb') as probtraj:
+            probtraj.seek(offsets[index])
+            line = probtraj.readline().decode()
 
-            for i, line in enumerate(probtraj):
-                if i == 0 and self._first_state_index is None:
-                    self._get_first_state_index(line)
-                if i == index+1:
-                    raw_data = split_tab_gen(line)
-                    
-                    first_value = next(itertools.islice(raw_data, self._first_state_index+1, None))
-                    self._hexfloat = first_value.startswith("0x")
-        
-                    return line, self._first_state_index, self._hexfloat
+        self._hexfloat = line_is_hexfloat(line, first_index)
+        return line, first_index, self._hexfloat
 
+    def _get_lines_index(self):
+        """
+            Returns the index of the column of the first state, the byte offsets of the time points lines
+            and their times. The index is built at the first call, and saved next to the probtraj file 
+            for the next results reading it, until the file is modified.
+        """
+        stat = os.stat(self.get_probtraj_file())
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self._lines_index is None or self._lines_index[0] != key:
+            index = read_lines_index(self.get_probtraj_index_file(), key)
+            if index is None:
+                index = build_lines_index(self.get_probtraj_file())
+                write_lines_index(self.get_probtraj_index_file(), key, *index)
+            self._lines_index = (key,) + index
+            self._first_state_index = index[0]
+
+        return self._lines_index[1:]
 
     def _get_raw_states(self):
         if self._raw_states is None:
@@ -573,6 +596,55 @@ class StoredPopResult(PopMaBoSSResult):
     # def get_simple_nodes_popsize(self, nodes=None):
     #     return self.get_simple_nodes_probtraj(nodes).multiply(self.get_simple_popsize(), axis=0)
        
+def build_lines_index(filename):
+    """Returns the index of the column of the first state, and the byte offsets and times of the lines of a probtraj file"""
+    offsets = []
+    times = []
+    with open(filename, 'rb') as probtraj:
+        header = probtraj.readline()
+        first_index = header.rstrip(b"\n").split(b"\t").index(b"State")
+        position = len(header)
+        for line in probtraj:
+            if len(line.strip()) > 0:
+                offsets.append(position)
+                times.append(float(line[:line.index(b"\t")]))
+            position += len(line)
+    return first_index, np.array(offsets, dtype=np.int64), np.array(times, dtype=np.float64)
+
+def read_lines_index(filename, key):
+    """Returns the lines index saved in filename, or None if it is missing or was built for another version of the probtraj file"""
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as index:
+            if tuple(index["key"].tolist()) != key:
+                return None
+            return int(index["first_index"]), index["offsets"], index["times"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_lines_index(filename, key, first_index, offsets, times):
+    # The index is only a cache : when the directory is read only, it is rebuilt by each result
+    try:
+        with open(filename + ".tmp", 'wb') as index_file:
+            np.savez(index_file, key=np.array(key, dtype=np.int64), first_index=first_index, offsets=offsets, times=times)
+        os.replace(filename + ".tmp", filename)
+    except OSError:
+        pass
+
+def line_is_hexfloat(line, first_index):
+    return line.split("\t", first_index+2)[first_index+1].startswith("0x")
+
+def parse_probtraj_line(line, first_index, hexfloat):
+    """Returns the time, the states and their probabilities of a line of a probtraj file"""
+    data = line.strip("\n").split("\t")
+    states = data[first_index::3]
+    if hexfloat:
+        probas = np.array([float.fromhex(value) for value in data[first_index+1::3]])
+    else:
+        probas = np.array([float(value) for value in data[first_index+1::3]])
+    return data[0], states, probas
+
 def split_tab_gen(string):
     start = 0
     for i, c in enumerate(string):
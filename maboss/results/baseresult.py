@@ -6,10 +6,8 @@ from __future__ import print_function
 from sys import stderr, stdout, version_info
 from .statdistresult import StatDistResult
 from .probtrajresult import ProbTrajResult
-from ..figures import make_plot_trajectory, plot_piechart, plot_fix_point, plot_node_prob, plot_observed_graph
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from multiprocessing import Pool
 if version_info[0] < 3:
     from StringIO import StringIO
@@ -75,6 +73,8 @@ class BaseResult(ProbTrajResult, StatDistResult):
             if error:
                 table_error = table_error[table_error.index <= until]
 
+        import matplotlib.pyplot as plt
+        from ..figures import make_plot_trajectory
         if axes is None:
             _, axes = plt.subplots(1,1)
       
@@ -98,6 +98,8 @@ class BaseResult(ProbTrajResult, StatDistResult):
                   "returned non 0 value", file=stderr)
             return
 
+        import matplotlib.pyplot as plt
+        from ..figures import plot_piechart
         if axes is None:
             _, axes = plt.subplots(1,1)
         table = self.get_last_states_probtraj()
@@ -112,6 +114,8 @@ class BaseResult(ProbTrajResult, StatDistResult):
             print("Error maboss previously returned non 0 value",
                   file=stderr)
             return
+        import matplotlib.pyplot as plt
+        from ..figures import plot_fix_point
         if axes is None:
             _, axes = plt.subplots(1,1)
         plot_fix_point(self.get_fptable(), axes, self.palette)
@@ -136,6 +140,7 @@ class BaseResult(ProbTrajResult, StatDistResult):
             if error:
                 table_error = table_error[table_error.index <= until]
 
+        from ..figures import plot_node_prob
         axes = plot_node_prob(table, axes, self.palette, legend=legend, error_table=table_error)
         if axes is not None:
             self._ndtraj = axes.get_figure()
@@ -149,6 +154,7 @@ class BaseResult(ProbTrajResult, StatDistResult):
             print("Error maboss previously returned non 0 value",
                   file=stderr)
             return
+        import matplotlib.pyplot as plt
         if axes is None:
             _, axes = plt.subplots(1,1)
         table = self.get_entropy_trajectory()
@@ -163,6 +169,8 @@ class BaseResult(ProbTrajResult, StatDistResult):
             print("Error maboss previously returned non 0 value",
                   file=stderr)
             return
+        import matplotlib.pyplot as plt
+        from ..figures import plot_observed_graph
         if axes is None:
             _, axes = plt.subplots(1,1)
         table = self.get_observed_graph(prob_cutoff)
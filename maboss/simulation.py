@@ -19,8 +19,6 @@ import uuid
 import subprocess
 import tempfile
 import shutil
-from colomoto_jupyter import import_colomoto_tool
-from colomoto_jupyter.sessionfiles import new_output_file
 
 _default_parameter_list = collections.OrderedDict([
     ('time_tick', 0.1),
@@ -413,7 +411,8 @@ def copy_and_update_parameters(sim, parameters):
     return new_sim
 
 def to_biolqm(maboss_model):
-    
+    from colomoto_jupyter import import_colomoto_tool
+    from colomoto_jupyter.sessionfiles import new_output_file
     biolqm = import_colomoto_tool("biolqm")
     bnet_filename = new_output_file("bnet")
     with open(bnet_filename, "w") as bnet_file:
@@ -424,6 +423,7 @@ def to_biolqm(maboss_model):
 
 def to_minibn(maboss_model):
     from colomoto import minibn
+    from colomoto_jupyter.sessionfiles import new_output_file
     bnet_filename = new_output_file("bnet")
     with open(bnet_filename, "w") as bnet_file:
         for node, rule in maboss_model.get_logical_rules().items():
@@ -451,6 +451,7 @@ def bnet_to_bnd_and_cfg(bnet_filename, bnd_filename, cfg_filename):
 
 def sbml_to_maboss(sbml_filename, cfg_filename=None, use_sbml_names=False):
     from .gsparser import load
+    from colomoto_jupyter.sessionfiles import new_output_file
     bnd_filename = new_output_file("bnd")
     default_cfg_filename = new_output_file("cfg")
     sbml_to_bnd_and_cfg(sbml_filename, bnd_filename, default_cfg_filename, use_sbml_names)
@@ -462,6 +463,7 @@ def sbml_to_maboss(sbml_filename, cfg_filename=None, use_sbml_names=False):
     
 def bnet_to_maboss(sbml_filename, cfg_filename=None):
     from .gsparser import load
+    from colomoto_jupyter.sessionfiles import new_output_file
     bnd_filename = new_output_file("bnd")
     default_cfg_filename = new_output_file("cfg")
     bnet_to_bnd_and_cfg(sbml_filename, bnd_filename, default_cfg_filename)
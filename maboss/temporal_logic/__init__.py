@@ -1,2 +1,3 @@
 from .evaluator import MaBoSSEvaluator
+from .simulation_cache import SimulationCache
 from .visualiser import Visualiser
@@ -1,5 +1,8 @@
 import warnings
 import gc
+import os
+import shutil
+from multiprocessing.pool import ThreadPool
 
 import maboss
 import numpy as np
@@ -10,9 +13,20 @@ from maboss.temporal_logic.custom_exceptions import DataFrameIsEmpty, NoNameExce
 from maboss.temporal_logic.logical_expression_compute import ComputeLogicalExpression
 from maboss.temporal_logic.temporal_parser import Parser
 from maboss.temporal_logic.formulas import Operators, QueryType, TargetType, FormulaChecker, Formula
+from maboss.temporal_logic.simulation_cache import SimulationCache
 import pandas as pd
 
 
+def run_simulation(task):
+    sim_key, model, workdir = task
+    try:
+        return sim_key, model.run() if workdir is None else Result(model, workdir=workdir), None
+    except Exception as e:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return sim_key, None, e
+
+
 class MaBoSSEvaluator:
     """
     The main class that evaluates the query and assemble and compute the results
@@ -20,6 +34,8 @@ class MaBoSSEvaluator:
     simulation_results = None
     simulation_results_raw = None
     parsed_query = None
+    simulation_cache = SimulationCache()  # results of the simulations, kept between the calls of querying
+    cache_report = {}  # name's mutation -> "memory", "disk" (reused from the cache), "run" or "failed", for the last querying
 
     # Options
     percentage_value_int = 0
@@ -214,7 +230,15 @@ class MaBoSSEvaluator:
         return " ".join(formatted_mutations)
 
     @staticmethod
-    def parsing_options(options: list[str], res_master: Result, list_results: dict, model_sim):
+    def parsing_options(options: list[str], simulations: dict, model_sim):
+        """
+        Reads the options of a query and sets the corresponding class values. The compare option registers the
+        mutation to compare to in simulations (mutation key -> mutation constraints), without running it.
+
+        :param options: the options of the parsed query
+        :param simulations: dictionary associating the mutation key of each simulation needed with its mutation constraints
+        :param model_sim: the master simulation, the nodes of the compare option are checked in its network
+        """
         for opt in options:
             if opt == "": continue
             if "digits:" in opt or "digit:" in opt:
@@ -273,43 +297,36 @@ class MaBoSSEvaluator:
                     if state not in ['ON', 'OFF']:
                         print(f"Invalid state for compare option. State must be ON or OFF. State : {state}")
                         continue
-                    if node_name not in res_master.get_nodes_probtraj().columns.tolist():
-                        print(f"Node {node_name} not found in the results. Check the name and try again.")
+                    if node_name not in model_sim.network:
+                        print(f"Node {node_name} not found in the model. Check the name and try again.")
                         continue
 
                     mutation_constraints.append([node_name, state])
 
+                if not mutation_constraints: continue
                 mutation_key = MaBoSSEvaluator.format_mutation_key(mutation_constraints)
                 # print(f"mutation key (options) : {mutation_key}")
-                if not mutation_key in list_results.keys():
-                    try:
-                        mutated_model = model_sim.copy()
-                        for mut in parsed_opt.split(','):
-                            if mut == "": continue
-                            # print(f"mut : {mut}")
-                            node_name, state = mut.split(':')
-                            mutated_model.mutate(node_name, state)
-                        list_results[mutation_key] = mutated_model.run()
-                    except Exception as e:
-                        print(f"Error while mutating the model : {e}")
-                        continue
+                # the simulation is only registered here, it is run with the others once all the queries are parsed
+                simulations.setdefault(mutation_key, mutation_constraints)
                 MaBoSSEvaluator.compare_to = mutation_key
 
             elif "comb" in opt:
                 MaBoSSEvaluator.combination = True
 
     @staticmethod
-    def querying(queries: list[str], sim_cfg=None, sim_bnd=None, initial_state: list[dict] = None, output_setting: list[str] = None):
+    def querying(queries: list[str], sim_cfg=None, sim_bnd=None, initial_state: list[dict] = None, output_setting: list[str] = None,
+                 workers: int = None, cache=False):
         """
         Interaction method between the user and the program.
-        First it runs all the necessary simulations, a dictionary avoids two identical simulations to be run twice. It always
-        run the master simulation (aka, the simulation without any mutation)
-        Then for all the queries that were passed in the parameter query, the method parses it, checks the grammar, checks
-        for mutation, runs a simulation if needed and sorts the validate query in the right places to link the simulation
-        results to it.
-        For all the queries that were'nt containing any grammar mistakes, gets the query, the simulation results (master
-        and mutation if needed) and passes them all to the evaluation methods depending on the query type (P, T ...)
-        Finally, the results of the evaluation are all appended in a list that is returned at the end of the function.
+        First, for all the queries that were passed in the parameter query, the method parses it, checks the grammar,
+        and collects the simulations it needs (its mutation and the mutation of its compare option). A dictionary avoids
+        two identical simulations to be run twice, and the master simulation (aka, the simulation without any mutation)
+        is always run.
+        Then all these simulations are run at the same time, at most workers of them. As soon as the simulations of a
+        query are done, the query (and the simulation results, master and mutation if needed) is passed to the
+        evaluation methods depending on the query type (P, T ...)
+        Finally, the results of the evaluation are all appended in a list, in the order of the queries, that is returned
+        at the end of the function.
 
         :param output_setting: list of nodes and/or states that must appear in the results
         :param queries: a list of string each being an assertion or query to be evaluated, contains a lot of information regarding
@@ -318,19 +335,22 @@ class MaBoSSEvaluator:
         :param sim_bnd: the binary file of the simulation
         :param initial_state: optional, if you want to set some nodes in certain states at the beginning of the simulation.
         This state will be used for all the simulations relative to the list of queries passed
+        :param workers: optional, the maximum number of simulations running at the same time, default to the number of CPUs
+        :param cache: optional, True to reuse the results kept in the cache of the evaluator, or a SimulationCache.
+        Default to False, all the simulations are run
         :return: a list of dataframes that are the results of the evaluations
         """
         list_of_df = []  # results of computation and evaluation
         checked_query = []  # queries that are checked for errors
 
+        simulations = {'master_simulation': []}  # dictionary associating the name's mutation with its mutation constraints
         sim_results = {}  # dictionary associating the name's mutation with its result
         query_to_sim = {}  # dictionary associating each query with the simulation it is related to
         query_to_compare = {}
         query_options = {}
         query_digits = {}
 
-        # Running the simulations and stocked the results
-        model_sim = maboss.load(bnd_filename=sim_bnd, cfg_filename=sim_cfg)
+        model_sim = maboss.load(sim_bnd, *([sim_cfg] if sim_cfg else []))
         if initial_state:
             for e in initial_state:
                 maboss.set_nodes_istate(model_sim, [e['node']], e['istate'])
@@ -340,13 +360,7 @@ class MaBoSSEvaluator:
         else:
             warnings.warn("Not passing any names in the ouput_setting might make the computing really slow and/or make it crash.")
 
-        res_master = model_sim.run()
-        # print(f"Nodes: {res_master.get_nodes_probtraj().columns.tolist()} ")
-        # print(f"States: {res_master.get_states_probtraj().columns.tolist()}")
-        sim_results['master_simulation'] = res_master
-        # sim_results['master_simulation'].plot_piechart()
-
-        # Reading the queries and launching the simulation for a mutation if it was not done before
+        # Reading all the queries and collecting the simulations they need
         for q in queries:
             # print(f"Query to parse : {q}")
             parsed_query = Parser.parse_query(q)
@@ -361,26 +375,15 @@ class MaBoSSEvaluator:
 
             if parsed_query.mutation_constraint:
                 col_name = MaBoSSEvaluator.format_mutation_key(parsed_query.mutation_constraint)
-                # if the simulation was not done yet for this mutation
-                if col_name not in sim_results:
-                    mutated_model = model_sim.copy()
-                    list_genes = []
-                    for g in parsed_query.mutation_constraint:
-                        list_genes.append(g[0])
-                    # mutated_model.network.set_output(list_genes) #necessary ???
-                    for c in parsed_query.mutation_constraint:
-                        mutated_model.mutate(c[0], str(c[1]))
-                    sim_results[col_name] = mutated_model.run()
+                simulations.setdefault(col_name, parsed_query.mutation_constraint)
                 query_to_sim[q] = col_name
             else:
                 query_to_sim[q] = 'master_simulation'
 
-            # print(f"Simulation results columns : {sim_results}")
             if parsed_query.options:
                 # print(f"Query: {q} for options {parsed_query.options}")
-                MaBoSSEvaluator.parsing_options(parsed_query.options, res_master, sim_results, model_sim)
+                MaBoSSEvaluator.parsing_options(parsed_query.options, simulations, model_sim)
             # if there are no options, default values are kept.
-            # print(f"Simulation results columns : {sim_results}")
 
             if MaBoSSEvaluator.compare_to == 'master':
                 query_to_compare[q] = 'master_simulation'
@@ -393,56 +396,48 @@ class MaBoSSEvaluator:
             query_digits[q] = MaBoSSEvaluator.digits
             MaBoSSEvaluator.reset_default_values()
 
-        for q in checked_query:
-            try:
-                # print(f"query : {q}")
-                sim_key = query_to_sim[q]
-                res = sim_results[sim_key]
-                # print(f"Nodes for this query : {res.get_nodes_probtraj()}")
-                parsed_query = Parser.parse_query(q)
-                tab_options_query = query_options[q]
-
-                if parsed_query.type in [QueryType.P, QueryType.PMAX, QueryType.PMIN, QueryType.T, QueryType.TMAX, QueryType.TMIN]:
-                    # print(f"query is not a dependency, increase or decrease: {q}")
-                    if query_options[q][6]:
-                        if parsed_query.logical_equation: warnings.warn("Logical equation will be ignored for this evaluation.")
-                        list_of_df.append(MaBoSSEvaluator.evaluate_query_combinatory(parsed_query, res))
-                    else:
-                        #print(parsed_query)
-                        list_of_df.append(MaBoSSEvaluator.evaluate_query(parsed_query, res, tab_options_query, query_digits[q]))
+        # Running the simulations, and evaluating each query as soon as its simulations are done
+        evaluations = {}  # index of the query in checked_query -> result of its evaluation
+        waiting = list(range(len(checked_query)))
+        if cache is True:
+            cache = MaBoSSEvaluator.simulation_cache
+        elif cache is False:
+            cache = None
+        MaBoSSEvaluator.cache_report = {}
+        simulation_outputs = MaBoSSEvaluator.run_simulations(model_sim, simulations, workers, cache,
+                                                             SimulationCache.make_sources(sim_bnd, sim_cfg))
+        for sim_key, res, error in simulation_outputs:
+            if error is not None:
+                print(f"Error while running the simulation {sim_key} : {error}")
+            sim_results[sim_key] = res
+
+            still_waiting = []
+            for i in waiting:
+                q = checked_query[i]
+                needed = [query_to_sim[q]]
+                if Parser.parse_query(q).type in [QueryType.INCREASE, QueryType.DECREASE]:
+                    needed.append(query_to_compare[q])
+                if any(key not in sim_results for key in needed):
+                    still_waiting.append(i)
+                elif any(sim_results[key] is None for key in needed):
+                    print(f"The simulation of the query {q} failed, it will not be evaluated.")
                 else:
-                    # print(f"Query is a dependency, increase or decrease: {q}")
-                    match parsed_query.type:
-                        case QueryType.INCREASE | QueryType.DECREASE:
-                            # get the simulation results that must be compared to this one
-
-                            compare_key = query_to_compare.get(q, 'master_simulation')
-                            # print(f"Query: {q}")
-                            # print(f"Main simulation key: {sim_key}")
-                            # print(f"Compare simulation key: {compare_key}")
-
-                            # print(f"Combination : {tab_options_query[6]}")
-                            # print(f"  Digits: {query_digits[q]}")
-                            list_of_df.append(MaBoSSEvaluator.evaluate_increase_decrease(parsed_query,
-                                                                                         res, sim_results[compare_key],
-                                                                                         query_digits[q],
-                                                                                         tab_options_query
-                                                                                         ))
-                        case _:
-                            warnings.warn(f"Query type {parsed_query.type} is not supported yet, query ignored.")
-                            continue
-            except FormulaException as fe:
-                print(f"Formula is not correct : {q} , will not be evaluated. This error occurred : {fe.message}")
-                continue
+                    evaluations[i] = MaBoSSEvaluator.evaluate_checked_query(q, sim_results[query_to_sim[q]],
+                                                                            sim_results[query_to_compare[q]] if len(needed) > 1 else None,
+                                                                            query_options[q], query_digits[q])
+            waiting = still_waiting
 
+        list_of_df = [evaluations[i] for i in sorted(evaluations.keys()) if evaluations[i] is not False]
+        evaluated_query = [checked_query[i] for i in sorted(evaluations.keys()) if evaluations[i] is not False]
         for i, df in enumerate(list_of_df):
             if df is None:
-                print(f"df {i} is empty. Query was : {checked_query[i]}")
+                print(f"df {i} is empty. Query was : {evaluated_query[i]}")
 
         MaBoSSEvaluator.reset_default_values()
         MaBoSSEvaluator.simulation_results = None
         MaBoSSEvaluator.simulation_results_raw = None
 
+        simulations.clear()
         sim_results.clear()
         query_to_sim.clear()
         query_to_compare.clear()
@@ -454,6 +449,124 @@ class MaBoSSEvaluator:
         print("Evaluations done !")
         return list_of_df
 
+    @staticmethod
+    def run_simulations(model_sim, simulations: dict, workers: int = None, cache: SimulationCache = None, sources=(None, None)):
+        """
+        Runs the simulations needed by the queries, at most workers at the same time, and yields each one as soon as
+        it is done. The simulations are MaBoSS processes, so they are run by a pool of threads. The simulations found
+        in the cache are yielded first, the others are added to it. Where each result comes from is set in cache_report.
+
+        :param model_sim: the master simulation, copied and mutated for the other simulations
+        :param simulations: dictionary associating the name's mutation of each simulation with its mutation constraints
+        (an empty list for the master simulation)
+        :param workers: optional, the maximum number of simulations running at the same time, default to the number of CPUs
+        :param cache: optional, the cache of the simulations results
+        :param sources: optional, the paths of the bnd and cfg files of the model, kept in the cache
+        :return: a generator of (name's mutation, result, error), result being None if the simulation raised error
+        """
+        models = {}
+        cached = []
+        tasks = []
+        for sim_key, mutation_constraints in simulations.items():
+            if mutation_constraints:
+                mutated_model = model_sim.copy()
+                for c in mutation_constraints:
+                    mutated_model.mutate(c[0], str(c[1]))
+                models[sim_key] = mutated_model
+            else:
+                models[sim_key] = model_sim
+
+            if cache is None or not SimulationCache.is_reproducible(models[sim_key]):
+                tasks.append((sim_key, models[sim_key], None))
+                continue
+
+            res, origin = cache.get(SimulationCache.make_key(models[sim_key]), models[sim_key])
+            if res is None:
+                tasks.append((sim_key, models[sim_key], cache.get_run_dir()))
+            else:
+                MaBoSSEvaluator.cache_report[sim_key] = origin
+                cached.append((sim_key, res, None))
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(tasks)))
+        if workers <= 1:
+            pool = None
+            outputs = (run_simulation(task) for task in tasks)
+        else:
+            pool = ThreadPool(processes=workers)
+            outputs = pool.imap_unordered(run_simulation, tasks)
+
+        try:
+            for output in cached:
+                yield output
+
+            for sim_key, res, error in outputs:
+                if res is not None and cache is not None and SimulationCache.is_reproducible(models[sim_key]):
+                    res = cache.put(SimulationCache.make_key(models[sim_key]), models[sim_key], res, sources)
+                MaBoSSEvaluator.cache_report[sim_key] = "failed" if error is not None or getattr(res, "_err", 0) else "run"
+                yield sim_key, res, error
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    @staticmethod
+    def set_cache(max_results: int = 16, cache_dir: str = None):
+        """
+        Replaces the cache of the simulations results used by querying.
+
+        :param max_results: the maximum number of results kept in memory
+        :param cache_dir: optional, a directory where the results are also kept, and read by the next sessions
+        """
+        MaBoSSEvaluator.simulation_cache = SimulationCache(max_results, cache_dir)
+
+    @staticmethod
+    def invalidate_cache(sim_bnd: str = None, sim_cfg: str = None):
+        """
+        Removes the results of the simulations from the cache, so that querying runs them again.
+
+        :param sim_bnd: optional, only removes the results of the simulations of this bnd file
+        :param sim_cfg: optional, only removes the results of the simulations of this cfg file
+        :return: the number of results removed
+        """
+        return MaBoSSEvaluator.simulation_cache.invalidate(sim_bnd, sim_cfg)
+
+    @staticmethod
+    def evaluate_checked_query(q: str, res, res_compare, tab_options_query: list, digits: int):
+        """
+        Evaluates a query which passed the grammar checks, with the results of its simulations.
+
+        :param q: the query
+        :param res: the results of the simulation of the query (master or mutation)
+        :param res_compare: the results of the simulation to compare to, for Inc and Dec queries
+        :param tab_options_query: the options of the query, as stored by querying
+        :param digits: the number of digits of the query
+        :return: the result of the evaluation, or False if the query could not be evaluated
+        """
+        try:
+            parsed_query = Parser.parse_query(q)
+
+            if parsed_query.type in [QueryType.P, QueryType.PMAX, QueryType.PMIN, QueryType.T, QueryType.TMAX, QueryType.TMIN]:
+                # print(f"query is not a dependency, increase or decrease: {q}")
+                if tab_options_query[6]:
+                    if parsed_query.logical_equation: warnings.warn("Logical equation will be ignored for this evaluation.")
+                    return MaBoSSEvaluator.evaluate_query_combinatory(parsed_query, res)
+                else:
+                    return MaBoSSEvaluator.evaluate_query(parsed_query, res, tab_options_query, digits)
+            else:
+                # print(f"Query is a dependency, increase or decrease: {q}")
+                match parsed_query.type:
+                    case QueryType.INCREASE | QueryType.DECREASE:
+                        return MaBoSSEvaluator.evaluate_increase_decrease(parsed_query, res, res_compare, digits,
+                                                                          tab_options_query)
+                    case _:
+                        warnings.warn(f"Query type {parsed_query.type} is not supported yet, query ignored.")
+                        return False
+        except FormulaException as fe:
+            print(f"Formula is not correct : {q} , will not be evaluated. This error occurred : {fe.message}")
+            return False
+
     @staticmethod
     def evaluate_increase_decrease(parsed_query_input, results_mutation, results_master, digits: int = 4, options=None):
         """
@@ -0,0 +1,173 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import collections
+
+from maboss import Result
+
+
+class SimulationCache:
+    """
+    Keeps the results of the simulations run by MaBoSSEvaluator.querying, so that the next calls on the same model do
+    not run them again.
+    A simulation is identified by the digest of its bnd and cfg, as they are written for MaBoSS, and of the MaBoSS
+    binary running it : it changes with the content of the files, the initial states, the output nodes, the mutations,
+    the seed of the simulation and the version of MaBoSS. The simulations using the physical random generator are not
+    reproducible, and never kept.
+    The most recently used results are kept in memory, at most max_results of them. If cache_dir is given, the results
+    are also written in it, and read from it by the next sessions.
+    """
+
+    def __init__(self, max_results: int = 16, cache_dir: str = None):
+        """
+        :param max_results: the maximum number of results kept in memory
+        :param cache_dir: optional, the directory keeping the results on disk
+        """
+        self.max_results = max_results
+        self.cache_dir = cache_dir
+        self._results = collections.OrderedDict()  # digest -> (result, sources), the last used at the end
+
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._results)
+
+    @staticmethod
+    def make_key(model) -> str:
+        """
+        Returns the digest identifying a simulation.
+
+        :param model: the simulation, with its initial states, output nodes and mutations
+        :return: the digest of its bnd and cfg, and of the path, size and modification time of the MaBoSS binary
+        """
+        digest = hashlib.sha1()
+        digest.update(str(model.network).encode())
+        digest.update(model.str_cfg().encode())
+
+        binary = shutil.which(model.get_maboss_cmd())
+        if binary is not None:
+            binary_stat = os.stat(binary)
+            digest.update(("%s:%d:%d" % (os.path.realpath(binary), binary_stat.st_size, binary_stat.st_mtime_ns)).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def is_reproducible(model) -> bool:
+        """Returns False if the simulation uses the physical random generator, so that its result cannot be reused"""
+        value = str(model.param.get("use_physrandgen", 0)).strip().lower()
+        try:
+            return float(value) == 0
+        except ValueError:
+            return value == "false"
+
+    @staticmethod
+    def make_sources(sim_bnd: str, sim_cfg: str = None):
+        return (os.path.abspath(sim_bnd) if sim_bnd else None, os.path.abspath(sim_cfg) if sim_cfg else None)
+
+    def get_entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str, model):
+        """
+        Returns the result of a simulation if it is in the cache, and where it was found.
+
+        :param key: the digest of the simulation
+        :param model: the simulation, the result read from the disk is linked to it
+        :return: (result, "memory" or "disk"), or (None, None) if the simulation is not in the cache
+        """
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key][0], "memory"
+
+        if self.cache_dir is not None:
+            path = self.get_entry_dir(key)
+            if os.path.exists(os.path.join(path, "res_probtraj.csv")):
+                result = Result(model, workdir=path)
+                self._keep(key, result, read_entry_sources(path))
+                return result, "disk"
+
+        return None, None
+
+    def get_run_dir(self):
+        """Returns the directory where a simulation of the cache must be run, None for a temporary directory"""
+        if self.cache_dir is None:
+            return None
+        return tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp")
+
+    def put(self, key: str, model, result, sources=(None, None)):
+        """
+        Adds the result of a simulation to the cache, and returns it. If the result was run in a directory given by
+        get_run_dir, the directory is moved in the cache directory and the result returned is read from its new place.
+        The results of the simulations that failed are not kept.
+
+        :param key: the digest of the simulation
+        :param model: the simulation
+        :param result: its result
+        :param sources: the paths of the bnd and cfg files of the simulation, used by invalidate
+        """
+        run_dir = result.workdir
+        if getattr(result, "_err", 0):
+            if run_dir is not None:
+                shutil.rmtree(run_dir, ignore_errors=True)
+            return result
+
+        if run_dir is not None and self.cache_dir is not None:
+            path = self.get_entry_dir(key)
+            write_entry_sources(run_dir, sources)
+            if os.path.exists(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.replace(run_dir, path)
+            result = Result(model, workdir=path)
+
+        self._keep(key, result, sources)
+        return result
+
+    def _keep(self, key, result, sources):
+        self._results[key] = (result, tuple(sources))
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def invalidate(self, sim_bnd: str = None, sim_cfg: str = None) -> int:
+        """
+        Removes results from the cache, in memory and on disk. Without parameters, all the results are removed.
+
+        :param sim_bnd: optional, only removes the results of the simulations of this bnd file
+        :param sim_cfg: optional, only removes the results of the simulations of this cfg file
+        :return: the number of results removed
+        """
+        bnd, cfg = SimulationCache.make_sources(sim_bnd, sim_cfg)
+
+        def matches(sources):
+            return (bnd is None or sources[0] == bnd) and (cfg is None or sources[1] == cfg)
+
+        removed = set(key for key, (_, sources) in self._results.items() if matches(sources))
+        for key in removed:
+            del self._results[key]
+
+        if self.cache_dir is not None and os.path.exists(self.cache_dir):
+            for key in os.listdir(self.cache_dir):
+                path = self.get_entry_dir(key)
+                if key.startswith(".tmp") or not os.path.isdir(path):
+                    continue
+                if matches(read_entry_sources(path)):
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed.add(key)
+
+        return len(removed)
+
+
+def write_entry_sources(path, sources):
+    with open(os.path.join(path, "sources.json"), "w") as f:
+        json.dump({"bnd": sources[0], "cfg": sources[1]}, f)
+
+
+def read_entry_sources(path):
+    try:
+        with open(os.path.join(path, "sources.json"), "r") as f:
+            sources = json.load(f)
+        return sources.get("bnd"), sources.get("cfg")
+    except (OSError, ValueError):
+        return None, None
@@ -1,2 +1,3 @@
 from .upp import UpdatePopulation
-from .results import UpdatePopulationResults
\ No newline at end of file
+from .results import UpdatePopulationResults
+from .replicates import UpdatePopulationReplicates
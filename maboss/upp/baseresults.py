@@ -0,0 +1,226 @@
+from __future__ import print_function
+import os
+import abc
+import glob
+import shutil
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+from ..results.storedresult import StoredResult
+from .laststates import LastStatesStore, make_states_incidence
+
+
+class BaseUpdatePopulationResults(abc.ABC):
+    """Steps of an UppMaBoSS run, shared by the MaBoSS and cMaBoSS results.
+
+    The subclasses run one step with _run_step, and build the model of the next
+    step with _next_model.
+
+    :param uppModel: UppMaBoSS model
+    :param workdir: working directory of the run, default to None
+    :param retention: results kept for each step: "all" the results, only the "last_states"
+    probabilities in memory, or the last states probabilities spilled to "disk", default to "all"
+    """
+
+    def __init__(self, uppModel, workdir=None, retention="all"):
+        self.uppModel = uppModel
+        self.workdir = workdir
+        self.pop_ratio = uppModel.pop_ratio
+        self.pop_ratios = pd.Series(dtype='float64')
+        self.stepwise_probability_distribution = None
+        self.nodes_stepwise_probability_distribution = None
+        self.nodes_list_stepwise_probability_distribution = None
+        self._states_incidence = None
+
+        self.results = []
+        #
+        # Unless all the results are kept, only the last states of each step are stored
+        #
+        self.retention = retention
+        self.last_states = None
+        if retention == "last_states":
+            self.last_states = LastStatesStore()
+        elif retention == "disk":
+            self.last_states = LastStatesStore(
+                on_disk=True, path=os.path.join(workdir, "LastStates.npy") if workdir is not None else None
+            )
+
+    def _run(self, checkpoint=None):
+
+        if checkpoint is None:
+            if self.verbose:
+                print("Run MaBoSS step 0")
+
+            sim_workdir = os.path.join(self.workdir, "Step_0") if self.workdir is not None else None
+            result = self._run_step(self.uppModel.model, sim_workdir)
+
+            self._keep_result(result)
+            self.pop_ratios[self.uppModel.time_shift] = self.pop_ratio
+
+            modelStep = self._next_model(self.uppModel.model.copy(), result, 0)
+            first_step = 1
+
+        else:
+            modelStep = checkpoint["model"]
+            first_step = checkpoint["step"] + 1
+
+        for stepIndex in range(first_step, self.uppModel.step_number+1):
+
+            if modelStep is None:
+                if self.verbose:
+                    print("No cells left")
+
+                break
+
+            if self.verbose:
+                print("Running MaBoSS for step %d" % stepIndex)
+
+            sim_workdir = os.path.join(self.workdir, "Step_%d" % stepIndex) if self.workdir is not None else None
+            result = self._run_step(modelStep, sim_workdir)
+
+            self._keep_result(result)
+            #
+            # Update pop ratio and construct the new version of model
+            #
+            modelStep = self._next_model(modelStep, result, stepIndex)
+
+        if self.workdir is not None:
+            self.save_population_ratios(os.path.join(self.workdir, "PopRatios.csv"))
+
+    @abc.abstractmethod
+    def _run_step(self, simulation, workdir):
+        """Run one step, and return its result"""
+
+    @abc.abstractmethod
+    def _next_model(self, simulation, result, stepIndex):
+        """Build the model of the step after stepIndex, None if it is the last one or no cells are left"""
+
+    def _keep_result(self, result):
+        """Keep the result of a step, according to the retention policy"""
+        if self.last_states is None:
+            self.results.append(result)
+        else:
+            self.last_states.append(result.get_last_states_probtraj())
+
+    def _load_step_result(self, folder):
+        """Return the stored result of a finished step"""
+        return StoredResult(folder)
+
+    def _resume(self, checkpoint):
+        """Restore the finished steps of an interrupted run, then run the remaining ones"""
+        self.pop_ratio = checkpoint["pop_ratio"]
+        self.pop_ratios = checkpoint["pop_ratios"]
+
+        for step in range(checkpoint["step"] + 1):
+            self._keep_result(self._load_step_result(os.path.join(self.workdir, "Step_%d" % step)))
+        #
+        # Remove the partial output of the interrupted step
+        #
+        for folder in glob.glob("%s/Step_*/" % self.workdir):
+            if int(os.path.basename(folder[0:-1]).split("_")[-1]) > checkpoint["step"]:
+                shutil.rmtree(folder)
+
+        self._run(checkpoint)
+
+    def get_stepwise_probability_distribution(self, nb_cores=1, include=None, exclude=None):
+        """
+            .. py:method:: Returns the stepwise probability distribution
+
+            :param nb_cores: (optional) number of cores used to read the results of the steps
+            :param include: (optional) only keep the states with all these nodes active
+            :param exclude: (optional) only keep the states with none of these nodes active
+            :return: Pandas dataframe object, representing the probability distribution of the different states, as a timeserie
+        """
+        if self.stepwise_probability_distribution is None and self.last_states is not None:
+            self.stepwise_probability_distribution = self.last_states.get_table()
+            self.stepwise_probability_distribution.insert(
+                0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values
+            )
+
+        if self.stepwise_probability_distribution is None:
+            if nb_cores > 1:
+                tables = []
+                with Pool(processes=nb_cores) as pool:
+                    tables = pool.map(
+                        make_stepwise_probability_distribution_line, self.results
+                    )
+
+            else:
+                tables = [result.get_last_states_probtraj() for result in self.results]
+
+            self.stepwise_probability_distribution = pd.concat(tables, axis=0, sort=False)
+            self.stepwise_probability_distribution.fillna(0, inplace=True)
+            self.stepwise_probability_distribution.set_index([list(range(0, len(tables)))], inplace=True)
+            self.stepwise_probability_distribution.insert(
+                0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values
+            )
+
+        if include is None and exclude is None:
+            return self.stepwise_probability_distribution
+        #
+        # Select the states with masks over their nodes. The PopRatio column
+        # has no nodes, so it is only kept when no node is required
+        #
+        mask = np.ones(self.stepwise_probability_distribution.shape[1]-1, dtype=bool)
+        if include is not None:
+            mask &= (self._get_states_incidence(include)[1] != 0).all(axis=1)
+        if exclude is not None:
+            mask &= (self._get_states_incidence(exclude)[1] == 0).all(axis=1)
+
+        mask = np.concatenate([[include is None], mask])
+        return self.stepwise_probability_distribution.loc[:, mask]
+
+    def get_nodes_stepwise_probability_distribution(self, nodes=None, nb_cores=1, direct=True):
+        """
+            .. py:method:: Returns the stepwise probability distribution of the nodes
+
+            :param nodes: (optional) the nodes, default to all the nodes active in at least one state
+            :param nb_cores: (optional) number of cores used to read the results of the steps
+            :param direct: kept for compatibility, the distribution is always computed from the stepwise probability distribution of the states
+            :return: Pandas dataframe object, representing the probability of the nodes to be active, as a timeserie
+        """
+        if (self.nodes_stepwise_probability_distribution is None or nodes is None
+                or set(nodes) != set(self.nodes_list_stepwise_probability_distribution)):
+
+            table = self.get_stepwise_probability_distribution(nb_cores=nb_cores)
+            nodes, incidence = self._get_states_incidence(nodes)
+            #
+            # Marginals of the nodes for all steps, from the (step x state) probabilities
+            # and the (state x node) incidence matrix
+            #
+            self.nodes_stepwise_probability_distribution = pd.DataFrame(
+                table.values[:, 1:].dot(incidence), index=table.index, columns=nodes
+            )
+            self.nodes_stepwise_probability_distribution.insert(0, column='PopRatio', value=table["PopRatio"].values)
+            self.nodes_list_stepwise_probability_distribution = nodes
+
+        return self.nodes_stepwise_probability_distribution
+
+    def _get_states_incidence(self, nodes=None):
+        """
+        Return the nodes, and the incidence matrix of the states of the stepwise probability
+        distribution (one row per state, one column per node, 1 if the node is active in the state)
+        :param nodes: the nodes, default to all the nodes active in at least one state
+        """
+        if self._states_incidence is None:
+            states = self.get_stepwise_probability_distribution().columns[1:]
+            self._states_incidence = make_states_incidence(states)
+
+        all_nodes, incidence = self._states_incidence
+        if nodes is None:
+            return all_nodes, incidence
+
+        nodes = list(nodes)
+        node_index = {node: i for i, node in enumerate(all_nodes)}
+        selected = np.zeros((incidence.shape[0], len(nodes)))
+        for i, node in enumerate(nodes):
+            if node in node_index:
+                selected[:, i] = incidence[:, node_index[node]]
+        return nodes, selected
+
+    def save_population_ratios(self, path):
+        (self.pop_ratios*self.uppModel.base_ratio).to_csv(path, header=["PopRatio"], index_label="Step")
+
+
+def make_stepwise_probability_distribution_line(result):
+    return result.get_last_states_probtraj()
@@ -0,0 +1,54 @@
+from __future__ import print_function
+import os
+import pickle
+import random
+
+checkpoint_filename = "Checkpoint.pkl"
+
+
+def save_checkpoint(workdir, step, pop_ratio, pop_ratios, next_model, random_generator=None):
+    """
+    Save the state of an UppMaBoSS run once a step is finished. The file is written
+    aside then renamed, so that a crash never leaves a partial checkpoint
+    :param workdir: working directory of the run
+    :param step: index of the last finished step
+    :param pop_ratio: current population ratio
+    :param pop_ratios: population ratios computed so far
+    :param next_model: MaBoSS model of the next step, with its updated variables and initial states (None if no cells are left)
+    :param random_generator: random.Random drawing the #rand of the update formulas, default to the random module
+    """
+    checkpoint = {
+        "step": step,
+        "pop_ratio": pop_ratio,
+        "pop_ratios": pop_ratios,
+        "model": next_model,
+        "random_state": (random if random_generator is None else random_generator).getstate(),
+    }
+    path = os.path.join(workdir, checkpoint_filename)
+    with open(path + ".tmp", "wb") as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(workdir, random_generator=None):
+    """
+    Return the last checkpoint of the run in workdir, or None if there is none.
+    The state of the random generator is restored from the checkpoint. Raises a ValueError
+    if the checkpoint cannot be read, so that the finished steps of the run are never removed
+    :param workdir: working directory of the run
+    :param random_generator: random.Random drawing the #rand of the update formulas, default to the random module
+    """
+    path = os.path.join(workdir, checkpoint_filename)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "rb") as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+        (random if random_generator is None else random_generator).setstate(checkpoint["random_state"])
+    except Exception as e:
+        raise ValueError("Cannot resume from checkpoint %s : %s" % (path, e))
+
+    return checkpoint
@@ -10,15 +10,17 @@ if sys.version_info[0] < 3:
 else:
     from contextlib import ExitStack
 import glob
-from ..results.storedresult import StoredResult
+from ..results.storedresult import StoredResult, StoredFinalResult
 from ..server import MaBoSSClient
 import shutil
-from multiprocessing import Pool
 from collections import OrderedDict
+from .formulas import varDef_Upp, make_state_matrix
+from .checkpoint import save_checkpoint, load_checkpoint
+from .baseresults import BaseUpdatePopulationResults
 
 
-class CMaBoSSUpdatePopulationResults:
-    def __init__(self, uppModel, verbose=False, workdir=None, overwrite=False, previous_run=None, previous_run_step=-1, nodes_init=None, only_final_state=False):
+class CMaBoSSUpdatePopulationResults(BaseUpdatePopulationResults):
+    def __init__(self, uppModel, verbose=False, workdir=None, overwrite=False, previous_run=None, previous_run_step=-1, nodes_init=None, only_final_state=False, resume=False, retention="all"):
         """UpdatePopulationResults class
         :param uppModel: UppMaBoSS model
         :param verbose: boolean to activate verbose mode, default to False        
@@ -26,23 +28,35 @@ class CMaBoSSUpdatePopulationResults:
         distribution, default to None
         :param previous_run_step: step used to initialize starting probability
         distribution from previous run, default to -1 (last)
+        :param resume: continue an interrupted run from its last finished step, default to False
+        :param retention: results kept for each step: "all" the results, only the "last_states"
+        probabilities in memory, or the last states probabilities spilled to "disk", default to "all"
         """
-        self.uppModel = uppModel
-        self.pop_ratios = pd.Series(dtype='float64')
-        self.stepwise_probability_distribution = None
-        self.nodes_stepwise_probability_distribution = None
-        self.nodes_list_stepwise_probability_distribution = None
+        BaseUpdatePopulationResults.__init__(self, uppModel, workdir, retention)
 
-        self.workdir = workdir
         self.overwrite = overwrite
         self.verbose = verbose
         self.nodes_init = nodes_init
         self.only_final_state = only_final_state
-        self.results = []
-        self.pop_ratio = uppModel.pop_ratio
+        #
+        # Cache of the states already decoded (most states are found again at each step)
+        #
+        self._node_index = uppModel.node_index
+        self._states_cache = {}
  
-        if self.workdir is not None and os.path.exists(self.workdir) and not self.overwrite:
-            # Restoring
+        #
+        # A run is complete once its population ratios are saved. Until then,
+        # it can be resumed from its last checkpoint
+        #
+        resuming = resume and workdir is not None and not os.path.exists(os.path.join(workdir, "PopRatios.csv"))
+        checkpoint = load_checkpoint(workdir, uppModel.random_generator) if resuming else None
+
+        if checkpoint is not None:
+            self._resume(checkpoint)
+
+        elif workdir is not None and os.path.exists(workdir) and not self.overwrite and not resuming:
+            # Restoring, with all the stored results
+            self.last_states = None
             self.results = [None] * (self.uppModel.step_number + 1)
 
             for folder in sorted(glob.glob("%s/Step_*_probtraj.csv/" % self.workdir)):
@@ -74,131 +88,34 @@ class CMaBoSSUpdatePopulationResults:
 
             self._run()
 
-    def _run(self):
-        
-        if self.verbose:
-            print("Run MaBoSS step 0")
-        
-        sim_workdir = os.path.join(self.workdir, "Step_0") if self.workdir is not None else None
-
-        result = self.uppModel.model.run(workdir=sim_workdir, cmaboss=True, only_final_state=self.only_final_state)
-        
-        self.results.append(result)
-        self.pop_ratios[self.uppModel.time_shift] = self.pop_ratio
-    
-        modelStep = self.uppModel.model.copy()
-
-        for stepIndex in range(1, self.uppModel.step_number+1):
-            #
-            # Update pop ratio and construct the new version of model
-            #
-            modelStep = self._buildUpdateCfg(modelStep, result, stepIndex)
-            
-            if modelStep is None:
-                if self.verbose:
-                    print("No cells left")
-
-                break
+    def _run_step(self, simulation, workdir):
+        """Run one step with cMaBoSS"""
+        return simulation.run(workdir=workdir, cmaboss=True, only_final_state=self.only_final_state)
 
-            else:
-                if self.verbose:
-                    print("Running MaBoSS for step %d" % stepIndex)
+    def _next_model(self, simulation, result, stepIndex):
+        """Build the model of the step after stepIndex, and save a checkpoint of the finished step"""
+        if stepIndex >= self.uppModel.step_number:
+            return None
 
-                sim_workdir = os.path.join(self.workdir, "Step_%d" % stepIndex) if self.workdir is not None else None
-
-                result = modelStep.run(workdir=sim_workdir, cmaboss=True, only_final_state=self.only_final_state)
-                
-                self.results.append(result)
+        next_model = self._buildUpdateCfg(simulation, result, stepIndex+1)
 
         if self.workdir is not None:
-            self.save_population_ratios(os.path.join(self.workdir, "PopRatios.csv"))
+            save_checkpoint(
+                self.workdir, stepIndex, self.pop_ratio, self.pop_ratios, next_model, self.uppModel.random_generator
+            )
+        return next_model
+
+    def _load_step_result(self, folder):
+        """Return the stored result of a finished step, only its final states if only those were computed"""
+        if self.only_final_state:
+            return StoredFinalResult(folder)
+        return StoredResult(folder)
 
     def get_population_ratios(self, name=None):
         if name:
             self.pop_ratios.name = name
         return self.pop_ratios*self.uppModel.base_ratio
 
-    def get_stepwise_probability_distribution(self, nb_cores=1, include=None, exclude=None):
-        if self.stepwise_probability_distribution is None:
-            if nb_cores > 1:
-                tables = []
-                with Pool(processes=nb_cores) as pool:
-                    tables = pool.map(
-                        make_stepwise_probability_distribution_line, self.results
-                    )
-
-            else:
-                tables = [result.get_last_states_probtraj() for result in self.results]
-            
-            self.stepwise_probability_distribution = pd.concat(tables, axis=0, sort=False)
-            self.stepwise_probability_distribution.fillna(0, inplace=True)
-            self.stepwise_probability_distribution.set_index([list(range(0, len(tables)))], inplace=True)
-            self.stepwise_probability_distribution.insert(
-                0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values
-            )
-            
-        if include is None and include is None:
-            return self.stepwise_probability_distribution
-        else:
-            states_filtered = self.stepwise_probability_distribution.columns
-            
-            if include is not None:
-                states_filtered = [state for state in states_filtered if set(include).issubset(set(state.split(" -- ")))]
-    
-            if exclude is not None:
-                states_filtered = [state for state in states_filtered if set(exclude).isdisjoint(set(state.split(" -- ")))]
-           
-            return self.stepwise_probability_distribution.loc[:, states_filtered]
-
-    def get_nodes_stepwise_probability_distribution(self, nodes=None, nb_cores=1, direct=True):
-        if self.nodes_stepwise_probability_distribution is None or set(nodes) != self.nodes_list_stepwise_probability_distribution:
-            
-            if direct:
-                self.nodes_list_stepwise_probability_distribution = nodes
- 
-                tables = [result.get_last_nodes_probtraj(nodes) for result in self.results]
-                self.nodes_stepwise_probability_distribution = pd.concat(tables, axis=0, sort=False)
-                self.nodes_stepwise_probability_distribution.fillna(0, inplace=True)
-                self.nodes_stepwise_probability_distribution.set_index([list(range(0, len(tables)))], inplace=True)
-                self.nodes_stepwise_probability_distribution.insert(
-                    0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values
-                )
-                
-            else:
-                
-                t0 = time()
-                table = self.get_stepwise_probability_distribution(nb_cores=nb_cores)
-                t1 = time()
-                # print("Got stepwise probability distribution in %.2gs" % (t1-t0))
-                states = table.columns.values[1:].tolist()
-                if "<nil>" in states:
-                    states.remove("<nil>")
-
-                if nodes is None:
-                    nodes = get_nodes(states)
-                else:
-                    nodes = set(nodes)
-                
-                self.nodes_list_stepwise_probability_distribution = nodes
-
-                node_dict = {}
-                for state in states:
-                    t_nodes = state.split(" -- ")
-                    t_nodes = [node for node in t_nodes if node in nodes]
-                    if len(t_nodes) > 0:
-                        node_dict.update({state: t_nodes})
-                t2 = time()
-                # print("Init in %.2gs" % (t2-t1))
-                if nb_cores > 1:
-                    self.nodes_stepwise_probability_distribution = make_nodes_table_parallel(table, nodes, node_dict, nb_cores)
-                else:
-                    self.nodes_stepwise_probability_distribution = make_nodes_table(table, nodes, node_dict)
-                t3 = time()
-                # print("Core in %.2gs" % (t3-t2))
-                self.nodes_stepwise_probability_distribution.insert(0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values)
-            # print("Final in %.2gs" % (time()-t3))
-        return self.nodes_stepwise_probability_distribution
-
     def save(self, path):
         if not os.path.exists(path):
             os.mkdir(path)
@@ -214,9 +131,6 @@ class CMaBoSSUpdatePopulationResults:
             self.uppModel.model.print_cfg(cfg_file)
             self.uppModel.model.print_bnd(bnd_file)
 
-    def save_population_ratios(self, path):
-        (self.pop_ratios*self.uppModel.base_ratio).to_csv(path, header=["PopRatio"], index_label="Step")
-
     def save_stepwise_probability_distribution(self, path):
         nb_cores = int(self.uppModel.model.param["thread_count"])
         self.get_stepwise_probability_distribution(nb_cores=nb_cores).to_csv(path, index_label="Step")
@@ -236,29 +150,25 @@ class CMaBoSSUpdatePopulationResults:
         # first_line, last_line = read_first_last_lines_from_trajectory (traj_fd)
         # states, probs = get_states_probs_from_trajectory_line (first_line, last_line)
         last_state, timepoint, raw_states  = result.cmaboss_result.get_last_probtraj()[0:3]
-        
-        states = []
-        probs = []
-        for i_state, prob in enumerate(last_state[0]):
-            states.append(raw_states[i_state].split(" -- "))
-            probs.append(prob)
+        probs = np.array(last_state[0], dtype=float)
+        state_matrix = self._decode_states(raw_states)
         #
         # Update pop ratio
         #
-        self.pop_ratio *= self._updatePopRatio (states, probs)
+        self.pop_ratio *= self._updatePopRatio (state_matrix, probs)
         new_time = self.uppModel.time_shift + self.uppModel.time_step*stepIndex
         self.pop_ratios[new_time] = self.pop_ratio
         #
         # Normalize
         #
-        states, probs = self.normalize_with_death_and_division (states, probs)
-        if states is None:
+        state_matrix, probs = self.normalize_with_death_and_division (state_matrix, probs)
+        if state_matrix is None:
             return None        
         #
         # Compute formulas for parameters and nodes 
         # 
-        parameters = self.compute_parameters(simulation, states, probs)
-        nodes_with_formula = self.compute_nodes_formula (states, probs)
+        parameters = self.compute_parameters(simulation, state_matrix, probs)
+        nodes_with_formula = self.compute_nodes_formula (state_matrix, probs)
         #
         # Apply new values for parameters 
         # 
@@ -266,8 +176,8 @@ class CMaBoSSUpdatePopulationResults:
         #
         # Init states
         #
-        nodes_to_init, new_istate = self._initCond_Trajline (states, probs)
-        simulation.network.set_istate (nodes_to_init, new_istate, warnings=False)
+        nodes_to_init, init_matrix = self._initCond_StateMatrix (state_matrix)
+        simulation.network.set_istate_distribution (nodes_to_init, init_matrix, probs, warnings=False)
         #
         # Init nodes having a formula
         #
@@ -276,43 +186,34 @@ class CMaBoSSUpdatePopulationResults:
             simulation.network.set_istate(a_node, [1-new_val,new_val], warnings=False)
         return simulation 
     
-    def normalize_with_death_and_division(self, states, probs): 
+    def normalize_with_death_and_division(self, state_matrix, probs): 
         """
         Take into account impact of death and division and normalize
         NB: if no death, nor division is defined, do nothing
-        :param states: list of states extracted from the trajectory
-        :param probs: list of states probabilities extracted from the trajectory  
+        :param state_matrix: matrix of the states extracted from the trajectory (one row per state, one column per node)
+        :param probs: array of states probabilities extracted from the trajectory  
         """
         #
         # speed up programm when no death, nor division
         # 
         if not self.uppModel.death_node and not self.uppModel.division_node:
-            return states, probs
+            return state_matrix, probs
         #
         # if death or division
         #
-        norm_factor = 0
-        death_prob = 0
-        division_prob = 0
-    
-        states_ret = []
-        probs_ret = []
-        for one_state, one_prob in zip(states, probs):
-            one_state_ret = one_state.copy()
-            one_prob_ret = one_prob
-            
-            if self.uppModel.death_node in one_state_ret:
-                death_prob += one_prob_ret
-                one_prob_ret = 0
-            else:
-                if self.uppModel.division_node in one_state_ret:
-                    division_prob += one_prob_ret
-                    one_prob_ret *= 2.0
-                    one_state_ret.remove(self.uppModel.division_node)
-                norm_factor += one_prob_ret
-                
-            states_ret.append (one_state_ret)
-            probs_ret.append (one_prob_ret)
+        dead = self._node_mask(state_matrix, self.uppModel.death_node)
+        dividing = self._node_mask(state_matrix, self.uppModel.division_node) & ~dead
+
+        death_prob = probs[dead].sum()
+        division_prob = probs[dividing].sum()
+
+        probs_ret = np.where(dead, 0.0, probs)
+        probs_ret[dividing] *= 2.0
+        norm_factor = probs_ret.sum()
+
+        if self.uppModel.division_node in self._node_index:
+            state_matrix = state_matrix.copy()
+            state_matrix[dividing, self._node_index[self.uppModel.division_node]] = 0
     
         if self.verbose:
             print("Norm Factor:%g probability of death: %g probability of division: %g"  \
@@ -325,54 +226,35 @@ class CMaBoSSUpdatePopulationResults:
         #
         # If norm_factor > 0, normalize 
         #
-        probs_ret = np.array(probs_ret, dtype = float)
-        probs_ret = (probs_ret / norm_factor).tolist()
-        return states_ret, probs_ret
+        return state_matrix, probs_ret / norm_factor
 
-    def compute_parameters(self, simulation, states, probs): 
+    def compute_parameters(self, simulation, state_matrix, probs): 
         """
         Computer parameters
         :param simulation: MaBoss model (containing the defining of parameters) 
-        :param states: list of states extracted from the trajectory
-        :param probs: list of states probabilities extracted from the trajectory  
+        :param state_matrix: matrix of the states extracted from the trajectory (one row per state, one column per node)
+        :param probs: array of states probabilities extracted from the trajectory  
         """
         parameters = {}
         for parameter, value in simulation.param.items():
             if parameter.startswith("$") and parameter in self.uppModel.update_var.keys():
-                formula = self.uppModel.update_var[parameter]
-                new_value = varDef_Upp(formula, states, probs)
-                for match in re.findall(r"#rand", new_value):
-                    rand_number = random.uniform(0, 1)
-                    new_value = new_value.replace("#rand", str(rand_number), 1)
-    
-                new_value = new_value.replace("#pop_ratio", str(self.pop_ratio))
+                formula = self.uppModel.get_compiled_formula(self.uppModel.update_var[parameter])
+                new_value = formula.substitute(state_matrix, probs, self.pop_ratio, self.uppModel.random_generator)
                 parameters.update({parameter: new_value})
                 if self.verbose:
                     print("Updated variable: %s = %s" % (parameter, new_value))
         return parameters
 
-    def compute_nodes_formula (self, states, probs): 
+    def compute_nodes_formula (self, state_matrix, probs): 
         """
         Computer nodes formula to be used as init values for next run
-        :param states: list of states extracted from the trajectory
-        :param probs: list of states probabilities extracted from the trajectory  
+        :param state_matrix: matrix of the states extracted from the trajectory (one row per state, one column per node)
+        :param probs: array of states probabilities extracted from the trajectory  
         """
         all_node_upd = {}
         for node_upd in self.uppModel.nodes_formula.keys():
-            node_formula = self.uppModel.nodes_formula[node_upd]
-            new_value = varDef_Upp(node_formula, states, probs)
-            
-            for match in re.findall(r"#rand", new_value):
-                rand_number = random.uniform(0, 1)
-                new_value = new_value.replace("#rand", str(rand_number), 1)
-    
-            new_value = new_value.replace("#pop_ratio", str(self.pop_ratio))
-            #
-            # Remove trailing ';' added by varDef_Upp, compute formula via eval 
-            # and convert to proba
-            #
-            new_value = float (eval(new_value[:-1]))
-            new_value = np.clip(new_value, 0, 1)
+            formula = self.uppModel.get_compiled_formula(self.uppModel.nodes_formula[node_upd])
+            new_value = np.clip(formula.evaluate(state_matrix, probs, self.pop_ratio, self.uppModel.random_generator), 0, 1)
                
             all_node_upd.update({node_upd: new_value})
             if self.verbose:
@@ -388,8 +270,8 @@ class CMaBoSSUpdatePopulationResults:
         :param probs: list of states probabilities extracted from the trajectory  
         :param nodes_init: dict of nodes values of the form { "NODE1" : TrueValue1, "NODE2" : TrueValue2, ... }.
         Nodes to exclude from InitCond as these nodes have a specific init value
+        :return: the nodes to be initialized, the matrix of their states and the probabilities of the states
         """
-        new_istate = OrderedDict()
         #
         # Remove from the list of nodes the ones having a rule or an init value
         #
@@ -405,100 +287,73 @@ class CMaBoSSUpdatePopulationResults:
         #
         name2idx = {name: i for i, name in enumerate(list_nodes_to_set)}
         #
-        # Exclude nodes with formula or with specific init from states
-        #
-        states = exclude_nodes_from_states (states, nodes_to_exclude)
-        #
-        # Construct a list of states (each state is tuple of nodes on/off)
-        # with the probability of each state
+        # Construct a matrix of states (one row per state, one column per node), 
+        # ignoring nodes with formula or with specific init. Duplicated states 
+        # are merged by set_istate_distribution
         #
-        for state, prob in zip(states, probs):
-            #
-            # Inclusion of modified _str2state code
-            #
-            str2state = [ 0 ] * len(name2idx)
-            if '<nil>' not in state:
-                for node in state:
-                    str2state[name2idx[node]] = 1
-            
-            state_tuple = tuple(str2state)
-
-            if state_tuple in new_istate.keys():
-                prob += new_istate[state_tuple]
-            
-            new_istate.update({state_tuple: prob})
-
-        return list_nodes_to_set, new_istate
-
-    def _updatePopRatio (self, states, probs):
+        nodes_to_skip = nodes_to_exclude | {"<nil>"}
+        rows = []
+        cols = []
+        for i, state in enumerate(states):
+            for node in state:
+                if node not in nodes_to_skip:
+                    rows.append(i)
+                    cols.append(name2idx[node])
+
+        state_matrix = np.zeros((len(states), len(list_nodes_to_set)), dtype=np.uint8)
+        state_matrix[rows, cols] = 1
+
+        return list_nodes_to_set, state_matrix, np.array(probs, dtype=float)
+
+    def _initCond_StateMatrix(self, state_matrix):
+        """
+        Same as _initCond_Trajline, for states given as a matrix over the nodes of the model
+        :param state_matrix: matrix of the states extracted from the trajectory (one row per state, one column per node)
+        :return: the nodes to be initialized and the matrix of their states
+        """
+        nodes_to_exclude = set(self.uppModel.nodes_formula.keys()) 
+        if self.nodes_init:
+            nodes_to_exclude= nodes_to_exclude | set(self.nodes_init.keys())
+
+        list_nodes_to_set = sorted(set(self.uppModel.node_list) - nodes_to_exclude)
+        columns = [self._node_index[node] for node in list_nodes_to_set]
+        return list_nodes_to_set, state_matrix[:, columns]
+
+    def _decode_states(self, raw_states):
+        """
+        Return the matrix of states (one row per state, one column per node)
+        from the states names given by cMaBoSS
+        :param raw_states: list of states names, such as "A -- B"
+        """
+        rows = []
+        cols = []
+        for i, raw_state in enumerate(raw_states):
+            indices = self._states_cache.get(raw_state)
+            if indices is None:
+                indices = [self._node_index[node] for node in raw_state.split(" -- ") if node != "<nil>"]
+                self._states_cache[raw_state] = indices
+            rows.extend([i] * len(indices))
+            cols.extend(indices)
+
+        state_matrix = np.zeros((len(raw_states), len(self._node_index)), dtype=np.uint8)
+        state_matrix[rows, cols] = 1
+        return state_matrix
+
+    def _node_mask(self, state_matrix, node):
+        """Return a boolean array telling which states have the node active"""
+        if node not in self._node_index:
+            return np.zeros(state_matrix.shape[0], dtype=bool)
+        return state_matrix[:, self._node_index[node]] == 1
+
+    def _updatePopRatio (self, state_matrix, probs):
         """
         Return update population ratio using nodes having death or division
-        :param states: states extracted from the trajectory
+        :param state_matrix: matrix of the states extracted from the trajectory
         :param probs: probabilities of states extracted from the trajectory  
         """
-        upd_pop_ratio = 0.0
-        for a_state, a_prob in zip(states, probs):
-            if self.uppModel.death_node not in a_state:
-                if self.uppModel.division_node in a_state:
-                    upd_pop_ratio += 2 * a_prob
-                else:
-                    upd_pop_ratio += a_prob
-        return upd_pop_ratio
-
-def varDef_Upp(update_line, states, probs):
-	res_match = re.findall(r"p\[[^\[]*\]", update_line)
-	if len(res_match) == 0:
-		print("Syntax error in the parameter update definition : %s" % update_line, file=sys.stderr)
-		exit()
-	
-	for match in res_match:
-
-		lhs, rhs = match.split("=")
-		lhs = lhs.replace("p[", "").replace("]", "").replace("(", "").replace(")", "")
-		rhs = rhs.replace("[", "").replace("]", "").replace("(", "").replace(")", "")
-
-		node_list = [token.strip() for token in lhs.split(",")]
-		boolVal_list = [token.strip() for token in rhs.split(",")]
-
-		if len(node_list) != len(boolVal_list):
-			print("Wrong probability definitions for \"%s\"" % match)
-			exit()
-
-		upNodeList = []
-		downNodeList = []
-
-		for i, node in enumerate(node_list):
-			if float(boolVal_list[i]) == 0.0:
-				downNodeList.append(node)
-			else:
-				upNodeList.append(node)
-
-		probValue = 0.0
-		for i in range(0, len(states)):
-			upNodeProbTraj = states[i]
-			interlength = 0
-
-			for upNodePt in upNodeProbTraj:
-				for upNode in upNodeList:
-					if upNodePt == upNode:
-						interlength += 1
-
-			if interlength == len(upNodeList):
-				interlength = 0
-				for upNodePt in upNodeProbTraj:
-					for downNode in downNodeList:
-						if upNodePt == downNode:
-							interlength = 1
-							break
-					
-					if interlength == 1:
-						break
-				if interlength == 0:
-					probValue += probs[i]
-
-		update_line = update_line.replace(match, str(probValue), 1)
-	update_line += ";"
-	return update_line
+        alive = ~self._node_mask(state_matrix, self.uppModel.death_node)
+        dividing = self._node_mask(state_matrix, self.uppModel.division_node) & alive
+        return probs[alive].sum() + probs[dividing].sum()
 
 def _get_next_condition_from_trajectory(self, next_model, step=-1):
     """
@@ -518,12 +373,12 @@ def _get_next_condition_from_trajectory(self, next_model, step=-1):
     #
     # Compute formulas for nodes 
     # 
-    nodes_with_formula = self.compute_nodes_formula (states, probs)
+    nodes_with_formula = self.compute_nodes_formula (make_state_matrix(states, self.uppModel.node_index), np.array(probs, dtype=float))
     #
     # Init states
     #
-    nodes_to_set, new_istate = self._initCond_Trajline(states, probs)        
-    next_model.network.set_istate (nodes_to_set, new_istate, warnings=False)    
+    nodes_to_set, state_matrix, state_probs = self._initCond_Trajline(states, probs)
+    next_model.network.set_istate_distribution (nodes_to_set, state_matrix, state_probs, warnings=False)    
     #
     # Init nodes having a formula
     #
@@ -554,57 +409,3 @@ def exclude_nodes_from_states (traj_states, nodes_exluded=None):
         traj_states_ret.append (new_traj_states)
     return traj_states_ret   
 
-def make_stepwise_probability_distribution_line(result):
-    return result.get_last_states_probtraj()
-
-def get_nodes(states):
-    nodes = set()
-    for s in states:
-        if s != '<nil>':
-            nds = s.split(' -- ')
-            for nd in nds:
-                nodes.add(nd)
-    return nodes
-
-def make_node_line(row, states_table, index, node_dict):
-    for state, nd_state in node_dict.items():
-        for nd in nd_state:
-            row[nd] += states_table.iloc[index, states_table.columns.get_loc(state)]
-
-def make_nodes_table(spd, nodes, node_dict):
-    table = pd.DataFrame(
-        np.zeros((len(spd.index), len(nodes))),
-        index=spd.index.values, columns=nodes
-    )
-
-    for index, (_, row) in enumerate(table.iterrows()):
-        make_node_line(row, spd, index, node_dict)
-        
-    return table
-
-def make_node_line_parallel(states_row, nodes, node_dict, row):
-    
-    table = pd.DataFrame(
-        np.zeros((1, len(nodes))),
-        index=[row], columns=nodes
-    )
-    
-    for row_index, row_state in states_row.iteritems():
-        if row_index in node_dict.keys() and row_state > 0.0:
-            for nd in node_dict[row_index]:
-                table.loc[row, nd] += row_state
-    
-    return table
-
-def make_nodes_table_parallel(spd, nodes, node_dict, nb_cores):
-    
-    tables = []
-    with Pool(processes=6) as pool:
-        tables = pool.starmap(
-            make_node_line_parallel, 
-            [(spd.iloc[index, :], nodes, node_dict, row) for index, row in enumerate(spd.index)]
-        )
-
-    table = pd.concat(tables, axis=0, sort=False)
-
-    return table
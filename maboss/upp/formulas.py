@@ -0,0 +1,192 @@
+from __future__ import print_function
+import sys
+import re
+import random
+import numpy as np
+
+_token_pattern = re.compile(r"(p\[[^\[]*\]|#rand|#pop_ratio)")
+
+
+class UppFormula:
+    """Update formula of UpPMaBoSS, compiled for the nodes of a model.
+
+    Each p[...] term of the formula is turned into a mask over a matrix of states
+    (one row per state, one column per node), so that its value is the sum of
+    the probabilities of the matching states. #rand and #pop_ratio are bound
+    when the formula is computed.
+
+    :param formula: the formula, such as "$ProdTNF_NFkB*p[(NFkB,Death) = (1,0)]"
+    :param node_list: the nodes of the model, in the order of the columns of the states matrices
+    """
+
+    def __init__(self, formula, node_list):
+        self.formula = formula
+        self._tokens = _token_pattern.split(formula)
+        self._function = None
+
+        node_index = {name: i for i, name in enumerate(node_list)}
+        self._terms = []
+        for token in self._tokens[1::2]:
+            if token.startswith("p["):
+                self._terms.append(_compile_term(token, node_index))
+
+        if len(self._terms) == 0:
+            print("Syntax error in the parameter update definition : %s" % formula, file=sys.stderr)
+            exit()
+
+        self._nb_rand = self._tokens[1::2].count("#rand")
+
+    def __getstate__(self):
+        # The compiled function can't be pickled, it is compiled again when needed
+        state = self.__dict__.copy()
+        state["_function"] = None
+        return state
+
+    def probabilities(self, state_matrix, probs):
+        """
+        Return the value of each p[...] term of the formula
+        :param state_matrix: matrix of states (one row per state, one column per node)
+        :param probs: array of states probabilities
+        """
+        values = []
+        for up_nodes, down_nodes in self._terms:
+            if up_nodes is None:
+                values.append(0.0)
+                continue
+
+            mask = np.ones(state_matrix.shape[0], dtype=bool)
+            if len(up_nodes) > 0:
+                mask &= (state_matrix[:, up_nodes] != 0).all(axis=1)
+            if len(down_nodes) > 0:
+                mask &= (state_matrix[:, down_nodes] == 0).all(axis=1)
+            values.append(float(probs[mask].sum()))
+        return values
+
+    def substitute(self, state_matrix, probs, pop_ratio, random_generator=None):
+        """
+        Return the formula as a MaBoSS expression, with p[...] terms, #rand and #pop_ratio
+        replaced by their values
+        :param state_matrix: matrix of states (one row per state, one column per node)
+        :param probs: array of states probabilities
+        :param pop_ratio: current population ratio
+        :param random_generator: random.Random drawing #rand, default to the random module
+        """
+        rands = self._draw_rands(random_generator)
+        return self._render(self.probabilities(state_matrix, probs), rands, pop_ratio) + ";"
+
+    def evaluate(self, state_matrix, probs, pop_ratio, random_generator=None):
+        """
+        Return the value of the formula
+        :param state_matrix: matrix of states (one row per state, one column per node)
+        :param probs: array of states probabilities
+        :param pop_ratio: current population ratio
+        :param random_generator: random.Random drawing #rand, default to the random module
+        """
+        if self._function is None:
+            self._function = eval("lambda _p, _rand, _pop_ratio: (%s)" % self._source())
+
+        rands = self._draw_rands(random_generator)
+        return float(self._function(self.probabilities(state_matrix, probs), rands, pop_ratio))
+
+    def _draw_rands(self, random_generator=None):
+        """Return the values of the #rand of the formula"""
+        generator = random if random_generator is None else random_generator
+        return [generator.uniform(0, 1) for _ in range(self._nb_rand)]
+
+    def _render(self, values, rands=None, pop_ratio=None):
+        """Join the tokens of the formula, replacing the ones with a known value"""
+        values = iter(values)
+        rands = iter(rands) if rands is not None else None
+        parts = []
+        for i, token in enumerate(self._tokens):
+            if i % 2 == 0:
+                parts.append(token)
+            elif token.startswith("p["):
+                parts.append(str(next(values)))
+            elif token == "#rand" and rands is not None:
+                parts.append(str(next(rands)))
+            elif token == "#pop_ratio" and pop_ratio is not None:
+                parts.append(str(pop_ratio))
+            else:
+                parts.append(token)
+        return "".join(parts)
+
+    def _source(self):
+        """Return the formula as a python expression of _p, _rand and _pop_ratio"""
+        parts = []
+        nb_terms = 0
+        nb_rands = 0
+        for i, token in enumerate(self._tokens):
+            if i % 2 == 0:
+                parts.append(token)
+            elif token.startswith("p["):
+                parts.append("_p[%d]" % nb_terms)
+                nb_terms += 1
+            elif token == "#rand":
+                parts.append("_rand[%d]" % nb_rands)
+                nb_rands += 1
+            else:
+                parts.append("_pop_ratio")
+        return "".join(parts)
+
+
+def _compile_term(term, node_index):
+    """
+    Return the columns of the nodes which must be active and inactive for a p[...] term.
+    The active nodes are None if one of them is not in the model, as no state can match
+    """
+    lhs, rhs = term.split("=")
+    lhs = lhs.replace("p[", "").replace("]", "").replace("(", "").replace(")", "")
+    rhs = rhs.replace("[", "").replace("]", "").replace("(", "").replace(")", "")
+
+    node_list = [token.strip() for token in lhs.split(",")]
+    boolVal_list = [token.strip() for token in rhs.split(",")]
+
+    if len(node_list) != len(boolVal_list):
+        print("Wrong probability definitions for \"%s\"" % term)
+        exit()
+
+    up_nodes = []
+    down_nodes = []
+    for node, value in zip(node_list, boolVal_list):
+        if float(value) == 0.0:
+            if node in node_index:
+                down_nodes.append(node_index[node])
+        elif node in node_index:
+            up_nodes.append(node_index[node])
+        else:
+            return None, []
+
+    return up_nodes, down_nodes
+
+
+def make_state_matrix(states, node_index):
+    """
+    Return the matrix of states (one row per state, one column per node)
+    :param states: list of states, each state being the list of its active nodes
+    :param node_index: dict giving the column of each node
+    """
+    rows = []
+    cols = []
+    for i, state in enumerate(states):
+        for node in state:
+            if node in node_index:
+                rows.append(i)
+                cols.append(node_index[node])
+
+    state_matrix = np.zeros((len(states), len(node_index)), dtype=np.uint8)
+    state_matrix[rows, cols] = 1
+    return state_matrix
+
+
+def varDef_Upp(update_line, states, probs):
+    """
+    Return the formula with its p[...] terms replaced by their values, followed by ';'
+    :param update_line: the formula
+    :param states: list of states, each state being the list of its active nodes
+    :param probs: list of states probabilities
+    """
+    node_list = sorted(set(node for state in states for node in state) - {"<nil>"})
+    formula = UppFormula(update_line, node_list)
+    state_matrix = make_state_matrix(states, {name: i for i, name in enumerate(node_list)})
+    return formula._render(formula.probabilities(state_matrix, np.array(probs, dtype=float))) + ";"
@@ -0,0 +1,127 @@
+from __future__ import print_function
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+retention_policies = ["all", "last_states", "disk"]
+
+
+class LastStatesStore:
+    """Last states probabilities of the steps of an UppMaBoSS run, stored compactly.
+
+    States names are kept once, in a list shared by all the steps. Each step is
+    kept as the indices of its states in this list, and their probabilities.
+    On disk, the arrays of all the steps are appended to a single file, and only
+    their offsets are kept in memory.
+
+    :param on_disk: store the arrays in a file instead of in memory, default to False
+    :param path: path of the file, default to a temporary file removed with the store
+    """
+
+    def __init__(self, on_disk=False, path=None):
+        self.states = []
+        self._state_index = {}
+        self._steps = []
+
+        self.path = None
+        self._temporary = False
+        if on_disk:
+            if path is None:
+                fd, path = tempfile.mkstemp(suffix=".npy", prefix="upp_")
+                os.close(fd)
+                self._temporary = True
+            self.path = path
+
+    def __del__(self):
+        if self._temporary and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return len(self._steps)
+
+    def append(self, last_states):
+        """
+        Add the last states of a step
+        :param last_states: DataFrame (or Series) of the last states probabilities, as returned by get_last_states_probtraj
+        """
+        if isinstance(last_states, pd.DataFrame):
+            names, probs = last_states.columns, last_states.iloc[-1].values
+        else:
+            names, probs = last_states.index, last_states.values
+
+        indices = np.empty(len(names), dtype=np.int32)
+        for i, state in enumerate(names):
+            index = self._state_index.get(state)
+            if index is None:
+                index = self._state_index[state] = len(self.states)
+                self.states.append(state)
+            indices[i] = index
+
+        probs = np.asarray(probs, dtype=float)
+        if self.path is None:
+            self._steps.append((indices, probs))
+        else:
+            with open(self.path, "ab" if len(self._steps) > 0 else "wb") as store_file:
+                self._steps.append(store_file.tell())
+                np.save(store_file, indices)
+                np.save(store_file, probs)
+
+    def get_step(self, step):
+        """
+        Return the indices of the states of a step, and their probabilities
+        :param step: index of the step
+        """
+        if self.path is None:
+            return self._steps[step]
+
+        with open(self.path, "rb") as store_file:
+            store_file.seek(self._steps[step])
+            indices = np.load(store_file)
+            probs = np.load(store_file)
+        return indices, probs
+
+    def get_matrix(self):
+        """Return the matrix of the probabilities of each state (column) at each step (row)"""
+        matrix = np.zeros((len(self), len(self.states)))
+        if self.path is None:
+            for step, (indices, probs) in enumerate(self._steps):
+                matrix[step, indices] = probs
+
+        elif len(self) > 0:
+            with open(self.path, "rb") as store_file:
+                for step in range(len(self)):
+                    indices = np.load(store_file)
+                    matrix[step, indices] = np.load(store_file)
+        return matrix
+
+    def get_table(self):
+        """Return the probabilities of each state at each step, as a DataFrame"""
+        return pd.DataFrame(self.get_matrix(), index=list(range(len(self))), columns=self.states)
+
+
+def make_states_incidence(states, nodes=None):
+    """
+    Return the nodes, and the incidence matrix of the states (one row per state,
+    one column per node, 1 if the node is active in the state)
+    :param states: the states names, such as "A -- B"
+    :param nodes: the nodes, default to all the nodes active in at least one state
+    """
+    states_nodes = [state.split(" -- ") if state != "<nil>" else [] for state in states]
+    if nodes is None:
+        nodes = sorted(set(node for state_nodes in states_nodes for node in state_nodes))
+    else:
+        nodes = list(nodes)
+
+    node_index = {node: i for i, node in enumerate(nodes)}
+    rows = []
+    cols = []
+    for i, state_nodes in enumerate(states_nodes):
+        for node in state_nodes:
+            if node in node_index:
+                rows.append(i)
+                cols.append(node_index[node])
+
+    incidence = np.zeros((len(states_nodes), len(nodes)))
+    incidence[rows, cols] = 1.0
+    return nodes, incidence
@@ -0,0 +1,134 @@
+from __future__ import print_function
+import os
+import random
+import warnings
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+
+
+class UpdatePopulationReplicates:
+    """Results of several independent runs of the same Update Population MaBoSS model.
+
+    The last states probabilities of all the runs are stored in a single array
+    of shape (replicate, step, state). Steps reached by a replicate which ran out
+    of cells are filled with NaN, and are ignored by the aggregated results.
+
+    :param uppModel: UppMaBoSS model
+    :param seeds: the seeds of the replicates
+    :param runs: for each replicate, its times, population ratios, states names and last states probabilities
+    """
+
+    def __init__(self, uppModel, seeds, runs):
+        self.uppModel = uppModel
+        self.seeds = list(seeds)
+
+        self.times = sorted(set(time for run in runs for time in run[0]))
+        time_index = {time: i for i, time in enumerate(self.times)}
+
+        self.states = []
+        state_index = {}
+        for run in runs:
+            for state in run[2]:
+                if state not in state_index:
+                    state_index[state] = len(self.states)
+                    self.states.append(state)
+
+        self.pop_ratios = np.full((len(runs), len(self.times)), np.nan)
+        self.probabilities = np.full((len(runs), len(self.times), len(self.states)), np.nan)
+
+        for i, (times, pop_ratios, states, probabilities) in enumerate(runs):
+            steps = [time_index[time] for time in times]
+            self.pop_ratios[i, steps] = pop_ratios
+
+            columns = [state_index[state] for state in states]
+            steps = steps[:probabilities.shape[0]]
+            self.probabilities[i, steps, :] = 0.0
+            self.probabilities[np.ix_([i], steps, columns)] = probabilities
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def get_population_ratios(self, replicate=None, quantile=None):
+        """
+        .. py:method:: Returns the population ratios of a replicate, or aggregated over the replicates
+
+        :param replicate: (optional) index of the replicate
+        :param quantile: (optional) quantile to compute over the replicates, instead of the mean
+        :return: a Series of the population ratios, indexed by time
+        """
+        if replicate is not None:
+            values = self.pop_ratios[replicate]
+        else:
+            values = self._aggregate(self.pop_ratios, quantile)
+
+        return pd.Series(values, index=self.times, name="PopRatio")
+
+    def get_all_population_ratios(self):
+        """
+        .. py:method:: Returns the population ratios of all the replicates, with one column per replicate
+        """
+        return pd.DataFrame(self.pop_ratios.T, index=self.times, columns=list(range(len(self))))
+
+    def get_stepwise_probability_distribution(self, replicate=None, quantile=None):
+        """
+        .. py:method:: Returns the last states probabilities of each step, for a replicate or aggregated over the replicates
+
+        :param replicate: (optional) index of the replicate
+        :param quantile: (optional) quantile to compute over the replicates, instead of the mean
+        :return: a DataFrame with one row per step, the population ratio and one column per state
+        """
+        if replicate is not None:
+            values = self.probabilities[replicate]
+        else:
+            values = self._aggregate(self.probabilities, quantile)
+
+        table = pd.DataFrame(values, index=list(range(len(self.times))), columns=self.states)
+        table.insert(0, column="PopRatio", value=self.get_population_ratios(replicate, quantile).values)
+        return table
+
+    def _aggregate(self, values, quantile):
+        """Aggregate an array over its first axis (the replicates), ignoring missing steps"""
+        with warnings.catch_warnings():
+            # Steps which no replicate reached stay NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            if quantile is None:
+                return np.nanmean(values, axis=0)
+            return np.nanquantile(values, quantile, axis=0)
+
+
+def run_replicates(uppModel, seeds, workers=None, workdir=None, cmaboss=False, only_final_state=False):
+    """Run the replicates of an UppMaBoSS model, and return a UpdatePopulationReplicates object"""
+
+    tasks = []
+    for i, seed in enumerate(seeds):
+        replicate_workdir = os.path.join(workdir, "Replicate_%d" % i) if workdir is not None else None
+        tasks.append((uppModel, seed, replicate_workdir, cmaboss, only_final_state))
+
+    if (workers is not None and workers <= 1) or len(tasks) <= 1:
+        runs = [_run_replicate(task) for task in tasks]
+    else:
+        with Pool(processes=workers) as pool:
+            runs = pool.map(_run_replicate, tasks)
+
+    return UpdatePopulationReplicates(uppModel, seeds, runs)
+
+
+def _run_replicate(task):
+    """Run one replicate, and return its population ratios and last states probabilities"""
+    uppModel, seed, workdir, cmaboss, only_final_state = task
+
+    replicate = uppModel.copy()
+    replicate.model.param["seed_pseudorandom"] = seed
+    # Each replicate draws the #rand of its update formulas from its own generator
+    replicate.random_generator = random.Random(seed)
+
+    result = replicate.run(
+        workdir=workdir, overwrite=True, cmaboss=cmaboss, only_final_state=only_final_state, retention="last_states"
+    )
+    pop_ratios = result.get_population_ratios()
+
+    return (
+        pop_ratios.index.values, pop_ratios.values,
+        list(result.last_states.states), result.last_states.get_matrix()
+    )
@@ -13,29 +13,35 @@ import glob
 from ..results.storedresult import StoredResult
 from ..server import MaBoSSClient
 import shutil
-from multiprocessing import Pool
 from collections import OrderedDict
+from .formulas import varDef_Upp, make_state_matrix
+from .checkpoint import save_checkpoint, load_checkpoint
+from .baseresults import BaseUpdatePopulationResults
 
-class UpdatePopulationResults:
-    def __init__(self, uppModel, verbose=False, workdir=None, overwrite=False, previous_run=None, previous_run_step=-1, host=None, port=7777, nodes_init=None):
-        self.uppModel = uppModel
-        self.pop_ratios = pd.Series(dtype='float64')
-        self.stepwise_probability_distribution = None
-        self.nodes_stepwise_probability_distribution = None
-        self.nodes_list_stepwise_probability_distribution = None
+class UpdatePopulationResults(BaseUpdatePopulationResults):
+    def __init__(self, uppModel, verbose=False, workdir=None, overwrite=False, previous_run=None, previous_run_step=-1, host=None, port=7777, nodes_init=None, resume=False, retention="all"):
+        BaseUpdatePopulationResults.__init__(self, uppModel, workdir, retention)
 
         self.nodes_init = nodes_init
-        self.results = []
         self.verbose = verbose
-        self.workdir = workdir
         self.overwrite = overwrite
-        self.pop_ratio = uppModel.pop_ratio
 
         self.host = host
         self.port = port   
 
-        if workdir is not None and os.path.exists(workdir) and not self.overwrite:
-            # Restoring
+        #
+        # A run is complete once its population ratios are saved. Until then,
+        # it can be resumed from its last checkpoint
+        #
+        resuming = resume and workdir is not None and not os.path.exists(os.path.join(workdir, "PopRatios.csv"))
+        checkpoint = load_checkpoint(workdir, uppModel.random_generator) if resuming else None
+
+        if checkpoint is not None:
+            self._resume(checkpoint)
+
+        elif workdir is not None and os.path.exists(workdir) and not self.overwrite and not resuming:
+            # Restoring, with all the stored results
+            self.last_states = None
             self.results = [None] * (self.uppModel.step_number + 1)
 
             for folder in sorted(glob.glob("%s/Step_*/" % self.workdir)):
@@ -63,55 +69,29 @@ class UpdatePopulationResults:
 
             self._run()
 
-    def _run(self):
-        
-        if self.verbose:
-            print("Run MaBoSS step 0")
-
-        sim_workdir = os.path.join(self.workdir, "Step_0") if self.workdir is not None else None
-        
+    def _run_step(self, simulation, workdir):
+        """Run one step, locally or on the MaBoSS server"""
         if self.host is None:
-            result = self.uppModel.model.run(workdir=sim_workdir)
-        else:
-            mbcli = MaBoSSClient(self.host, self.port)
-            result = mbcli.run(self.uppModel.model)
-            mbcli.close()
-
-        self.results.append(result)
-        self.pop_ratios[self.uppModel.time_shift] = self.pop_ratio
-    
-        modelStep = self.uppModel.model.copy()
-
-        for stepIndex in range(1, self.uppModel.step_number+1):
-            #
-            # Update pop ratio and construct the new version of model
-            #
-            with result._get_probtraj_fd() as result_probtraj_fd:
-                modelStep = self._buildUpdateCfg(modelStep, result_probtraj_fd, stepIndex)
-            
-            if modelStep is None:
-                if self.verbose:
-                    print("No cells left")
-
-                break
+            return simulation.run(workdir=workdir)
 
-            else:
-                if self.verbose:
-                    print("Running MaBoSS for step %d" % stepIndex)
+        mbcli = MaBoSSClient(self.host, self.port)
+        result = mbcli.run(simulation)
+        mbcli.close()
+        return result
 
-                sim_workdir = os.path.join(self.workdir, "Step_%d" % stepIndex) if self.workdir is not None else None
-                
-                if self.host is None:
-                    result = modelStep.run(workdir=sim_workdir)
-                else:
-                    mbcli = MaBoSSClient(self.host, self.port)
-                    result = mbcli.run(modelStep)
-                    mbcli.close()
+    def _next_model(self, simulation, result, stepIndex):
+        """Build the model of the step after stepIndex, and save a checkpoint of the finished step"""
+        if stepIndex >= self.uppModel.step_number:
+            return None
 
-                self.results.append(result)
+        with result._get_probtraj_fd() as result_probtraj_fd:
+            next_model = self._buildUpdateCfg(simulation, result_probtraj_fd, stepIndex+1)
 
         if self.workdir is not None:
-            self.save_population_ratios(os.path.join(self.workdir, "PopRatios.csv"))
+            save_checkpoint(
+                self.workdir, stepIndex, self.pop_ratio, self.pop_ratios, next_model, self.uppModel.random_generator
+            )
+        return next_model
 
     def get_population_ratios(self, name=None):
         """
@@ -125,88 +105,6 @@ class UpdatePopulationResults:
             self.pop_ratios.name = name
         return self.pop_ratios*self.uppModel.base_ratio
 
-    def get_stepwise_probability_distribution(self, nb_cores=1, include=None, exclude=None):
-        """
-            .. py:method:: Returns the stepwise probability distribution
-
-            :return: Pandas dataframe object, representing the probability distribution of the different states, as a timeserie
-        """
-        if self.stepwise_probability_distribution is None:
-            if nb_cores > 1:
-                tables = []
-                with Pool(processes=nb_cores) as pool:
-                    tables = pool.map(
-                        make_stepwise_probability_distribution_line, self.results
-                    )
-
-            else:
-                tables = [result.get_last_states_probtraj() for result in self.results]
-            
-            self.stepwise_probability_distribution = pd.concat(tables, axis=0, sort=False)
-            self.stepwise_probability_distribution.fillna(0, inplace=True)
-            self.stepwise_probability_distribution.set_index([list(range(0, len(tables)))], inplace=True)
-            self.stepwise_probability_distribution.insert(
-                0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values
-            )
-            
-        if include is None and include is None:
-            return self.stepwise_probability_distribution
-        else:
-            states_filtered = self.stepwise_probability_distribution.columns
-            
-            if include is not None:
-                states_filtered = [state for state in states_filtered if set(include).issubset(set(state.split(" -- ")))]
-    
-            if exclude is not None:
-                states_filtered = [state for state in states_filtered if set(exclude).isdisjoint(set(state.split(" -- ")))]
-           
-            return self.stepwise_probability_distribution.loc[:, states_filtered]
-
-    def get_nodes_stepwise_probability_distribution(self, nodes=None, nb_cores=1, direct=True):
-        if self.nodes_stepwise_probability_distribution is None or set(nodes) != self.nodes_list_stepwise_probability_distribution:
-            
-            
-            if direct:  
-                tables = [result.get_last_nodes_probtraj(nodes) for result in self.results]
-            
-                self.nodes_stepwise_probability_distribution = pd.concat(tables, axis=0, sort=False)
-                self.nodes_stepwise_probability_distribution.fillna(0, inplace=True)
-                self.nodes_stepwise_probability_distribution.set_index([list(range(0, len(tables)))], inplace=True)
-                self.nodes_stepwise_probability_distribution.insert(
-                    0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values
-                )
-                self.nodes_list_stepwise_probability_distribution = list(set(nodes))
-                
-            else:
-                table = self.get_stepwise_probability_distribution(nb_cores=nb_cores)
-                
-                states = table.columns.values[1:].tolist()
-                if "<nil>" in states:
-                    states.remove("<nil>")
-
-                if nodes is None:
-                    nodes = get_nodes(states)
-                else:
-                    nodes = list(set(nodes))
-                
-                self.nodes_list_stepwise_probability_distribution = nodes
-
-                node_dict = {}
-                for state in states:
-                    t_nodes = state.split(" -- ")
-                    t_nodes = [node for node in t_nodes if node in nodes]
-                    if len(t_nodes) > 0:
-                        node_dict.update({state: t_nodes})
-
-                if nb_cores > 1:
-                    self.nodes_stepwise_probability_distribution = make_nodes_table_parallel(table, nodes, node_dict, nb_cores)
-                else:
-                    self.nodes_stepwise_probability_distribution = make_nodes_table(table, nodes, node_dict)
-
-                self.nodes_stepwise_probability_distribution.insert(0, column='PopRatio', value=(self.pop_ratios*self.uppModel.base_ratio).values)
-
-        return self.nodes_stepwise_probability_distribution
-
     def save(self, path):
         """
             .. py:method:: Saves the maboss model, the population ratios timeserie, and the probility distribution timeseries in the specified path
@@ -227,9 +125,6 @@ class UpdatePopulationResults:
             self.uppModel.model.print_cfg(cfg_file)
             self.uppModel.model.print_bnd(bnd_file)
 
-    def save_population_ratios(self, path):
-        (self.pop_ratios*self.uppModel.base_ratio).to_csv(path, header=["PopRatio"], index_label="Step")
-
     def save_stepwise_probability_distribution(self, path):
         nb_cores = int(self.uppModel.model.param["thread_count"])
         self.get_stepwise_probability_distribution(nb_cores=nb_cores).to_csv(path, index_label="Step")
@@ -263,8 +158,9 @@ class UpdatePopulationResults:
         #
         # Compute formulas for parameters and nodes 
         # 
-        parameters = self._compute_parameters(simulation, states, probs)
-        nodes_with_formula = self._compute_nodes_formula (states, probs)
+        state_matrix = make_state_matrix(states, self.uppModel.node_index)
+        parameters = self._compute_parameters(simulation, state_matrix, np.array(probs))
+        nodes_with_formula = self._compute_nodes_formula (state_matrix, np.array(probs))
         #
         # Apply new values for parameters 
         # 
@@ -272,8 +168,8 @@ class UpdatePopulationResults:
         #
         # Init states
         #
-        nodes_to_init, new_istate = self._initCond_Trajline (states, probs)
-        simulation.network.set_istate (nodes_to_init, new_istate, warnings=False)
+        nodes_to_init, state_matrix, state_probs = self._initCond_Trajline (states, probs)
+        simulation.network.set_istate_distribution (nodes_to_init, state_matrix, state_probs, warnings=False)
         #
         # Init nodes having a formula
         #
@@ -335,50 +231,33 @@ class UpdatePopulationResults:
         probs_ret = (probs_ret / norm_factor).tolist()
         return states_ret, probs_ret
 
-    def _compute_parameters(self, simulation, states, probs): 
+    def _compute_parameters(self, simulation, state_matrix, probs): 
         """
         Computer parameters
         :param simulation: MaBoss model (containing the defining of parameters) 
-        :param states: list of states extracted from the trajectory
-        :param probs: list of states probabilities extracted from the trajectory  
+        :param state_matrix: matrix of the states extracted from the trajectory (one row per state, one column per node)
+        :param probs: array of states probabilities extracted from the trajectory  
         """
         parameters = {}
         for parameter, value in simulation.param.items():
             if parameter.startswith("$") and parameter in self.uppModel.update_var.keys():
-                formula = self.uppModel.update_var[parameter]
-                new_value = varDef_Upp(formula, states, probs)
-                for match in re.findall(r"#rand", new_value):
-                    rand_number = random.uniform(0, 1)
-                    new_value = new_value.replace("#rand", str(rand_number), 1)
-    
-                new_value = new_value.replace("#pop_ratio", str(self.pop_ratio))
+                formula = self.uppModel.get_compiled_formula(self.uppModel.update_var[parameter])
+                new_value = formula.substitute(state_matrix, probs, self.pop_ratio, self.uppModel.random_generator)
                 parameters.update({parameter: new_value})
                 if self.verbose:
                     print("Updated variable: %s = %s" % (parameter, new_value))
         return parameters
 
-    def _compute_nodes_formula (self, states, probs): 
+    def _compute_nodes_formula (self, state_matrix, probs): 
         """
         Computer nodes formula to be used as init values for next run
-        :param states: list of states extracted from the trajectory
-        :param probs: list of states probabilities extracted from the trajectory  
+        :param state_matrix: matrix of the states extracted from the trajectory (one row per state, one column per node)
+        :param probs: array of states probabilities extracted from the trajectory  
         """
         all_node_upd = {}
         for node_upd in self.uppModel.nodes_formula.keys():
-            node_formula = self.uppModel.nodes_formula[node_upd]
-            new_value = varDef_Upp(node_formula, states, probs)
-            
-            for match in re.findall(r"#rand", new_value):
-                rand_number = random.uniform(0, 1)
-                new_value = new_value.replace("#rand", str(rand_number), 1)
-    
-            new_value = new_value.replace("#pop_ratio", str(self.pop_ratio))
-            #
-            # Remove trailing ';' added by varDef_Upp, compute formula via eval 
-            # and convert to proba
-            #
-            new_value = float (eval(new_value[:-1]))
-            new_value = np.clip(new_value, 0, 1)
+            formula = self.uppModel.get_compiled_formula(self.uppModel.nodes_formula[node_upd])
+            new_value = np.clip(formula.evaluate(state_matrix, probs, self.pop_ratio, self.uppModel.random_generator), 0, 1)
                
             all_node_upd.update({node_upd: new_value})
             if self.verbose:
@@ -394,8 +273,8 @@ class UpdatePopulationResults:
         :param probs: list of states probabilities extracted from the trajectory  
         :param nodes_init: dict of nodes values of the form { "NODE1" : TrueValue1, "NODE2" : TrueValue2, ... }.
         Nodes to exclude from InitCond as these nodes have a specific init value
+        :return: the nodes to be initialized, the matrix of their states and the probabilities of the states
         """
-        new_istate = OrderedDict()
         #
         # Remove from the list of nodes the ones having a rule or an init value
         #
@@ -411,30 +290,23 @@ class UpdatePopulationResults:
         #
         name2idx = {name: i for i, name in enumerate(list_nodes_to_set)}
         #
-        # Exclude nodes with formula or with specific init from states
+        # Construct a matrix of states (one row per state, one column per node), 
+        # ignoring nodes with formula or with specific init. Duplicated states 
+        # are merged by set_istate_distribution
         #
-        states = exclude_nodes_from_states (states, nodes_to_exclude)
-        #
-        # Construct a list of states (each state is tuple of nodes on/off)
-        # with the probability of each state
-        #
-        for state, prob in zip(states, probs):
-            #
-            # Inclusion of modified _str2state code
-            #
-            str2state = [ 0 ] * len(name2idx)
-            if '<nil>' not in state:
-                for node in state:
-                    str2state[name2idx[node]] = 1
-            
-            state_tuple = tuple(str2state)
+        nodes_to_skip = nodes_to_exclude | {"<nil>"}
+        rows = []
+        cols = []
+        for i, state in enumerate(states):
+            for node in state:
+                if node not in nodes_to_skip:
+                    rows.append(i)
+                    cols.append(name2idx[node])
 
-            if state_tuple in new_istate.keys():
-                prob += new_istate[state_tuple]
-            
-            new_istate.update({state_tuple: prob})
+        state_matrix = np.zeros((len(states), len(list_nodes_to_set)), dtype=np.uint8)
+        state_matrix[rows, cols] = 1
 
-        return list_nodes_to_set, new_istate
+        return list_nodes_to_set, state_matrix, np.array(probs, dtype=float)
 
     def _updatePopRatio (self, states, probs):
         """
@@ -451,61 +323,6 @@ class UpdatePopulationResults:
                     upd_pop_ratio += a_prob
         return upd_pop_ratio
 
-def varDef_Upp(update_line, states, probs):
-	res_match = re.findall(r"p\[[^\[]*\]", update_line)
-	if len(res_match) == 0:
-		print("Syntax error in the parameter update definition : %s" % update_line, file=sys.stderr)
-		exit()
-	
-	for match in res_match:
-
-		lhs, rhs = match.split("=")
-		lhs = lhs.replace("p[", "").replace("]", "").replace("(", "").replace(")", "")
-		rhs = rhs.replace("[", "").replace("]", "").replace("(", "").replace(")", "")
-
-		node_list = [token.strip() for token in lhs.split(",")]
-		boolVal_list = [token.strip() for token in rhs.split(",")]
-
-		if len(node_list) != len(boolVal_list):
-			print("Wrong probability definitions for \"%s\"" % match)
-			exit()
-
-		upNodeList = []
-		downNodeList = []
-
-		for i, node in enumerate(node_list):
-			if float(boolVal_list[i]) == 0.0:
-				downNodeList.append(node)
-			else:
-				upNodeList.append(node)
-
-		probValue = 0.0
-		for i in range(0, len(states)):
-			upNodeProbTraj = states[i]
-			interlength = 0
-
-			for upNodePt in upNodeProbTraj:
-				for upNode in upNodeList:
-					if upNodePt == upNode:
-						interlength += 1
-
-			if interlength == len(upNodeList):
-				interlength = 0
-				for upNodePt in upNodeProbTraj:
-					for downNode in downNodeList:
-						if upNodePt == downNode:
-							interlength = 1
-							break
-					
-					if interlength == 1:
-						break
-				if interlength == 0:
-					probValue += probs[i]
-
-		update_line = update_line.replace(match, str(probValue), 1)
-	update_line += ";"
-	return update_line
-
 def _get_next_condition_from_trajectory(self, next_model, step=-1):
     """
     Set the values of MaBoss model when resuming from a previous run
@@ -522,12 +339,12 @@ def _get_next_condition_from_trajectory(self, next_model, step=-1):
     #
     # Compute formulas for nodes 
     # 
-    nodes_with_formula = self._compute_nodes_formula (states, probs)
+    nodes_with_formula = self._compute_nodes_formula (make_state_matrix(states, self.uppModel.node_index), np.array(probs, dtype=float))
     #
     # Init states
     #
-    nodes_to_set, new_istate = self._initCond_Trajline(states, probs)        
-    next_model.network.set_istate (nodes_to_set, new_istate, warnings=False)    
+    nodes_to_set, state_matrix, state_probs = self._initCond_Trajline(states, probs)
+    next_model.network.set_istate_distribution (nodes_to_set, state_matrix, state_probs, warnings=False)    
     #
     # Init nodes having a formula
     #
@@ -604,57 +421,3 @@ def exclude_nodes_from_states (traj_states, nodes_exluded=None):
         traj_states_ret.append (new_traj_states)
     return traj_states_ret   
 
-def make_stepwise_probability_distribution_line(result):
-    return result.get_last_states_probtraj()
-
-def get_nodes(states):
-    nodes = set()
-    for s in states:
-        if s != '<nil>':
-            nds = s.split(' -- ')
-            for nd in nds:
-                nodes.add(nd)
-    return list(nodes)
-
-def make_node_line(row, states_table, index, node_dict):
-    for state, nd_state in node_dict.items():
-        for nd in nd_state:
-            row[nd] += states_table.iloc[index, states_table.columns.get_loc(state)]
-
-def make_nodes_table(spd, nodes, node_dict):
-    table = pd.DataFrame(
-        np.zeros((len(spd.index), len(nodes))),
-        index=spd.index.values, columns=nodes
-    )
-
-    for index, (_, row) in enumerate(table.iterrows()):
-        make_node_line(row, spd, index, node_dict)
-        
-    return table
-
-def make_node_line_parallel(states_row, nodes, node_dict, row):
-    
-    table = pd.DataFrame(
-        np.zeros((1, len(nodes))),
-        index=[row], columns=nodes
-    )
-    
-    for row_index, row_state in states_row.iteritems():
-        if row_index in node_dict.keys() and row_state > 0.0:
-            for nd in node_dict[row_index]:
-                table.loc[row, nd] += row_state
-    
-    return table
-
-def make_nodes_table_parallel(spd, nodes, node_dict, nb_cores):
-    
-    tables = []
-    with Pool(processes=6) as pool:
-        tables = pool.starmap(
-            make_node_line_parallel, 
-            [(spd.iloc[index, :], nodes, node_dict, row) for index, row in enumerate(spd.index)]
-        )
-
-    table = pd.concat(tables, axis=0, sort=False)
-
-    return table
@@ -0,0 +1,95 @@
+from __future__ import print_function
+import sys
+import itertools
+import pandas as pd
+from multiprocessing import Pool
+
+sweep_kinds = ["parameter", "formula", "nodes_init"]
+
+
+def make_sweep_points(parameters=None, formulas=None, nodes_init=None, grid=True):
+    """
+    Return the points of a sweep, as a list of dicts of the form { (kind, name) : value }
+    :param parameters: dict of the values of the $ variables, such as { "$DivRate" : [0.01, 0.1] }
+    :param formulas: dict of the update formulas of $ variables or @nodes, such as { "$TNF_induc" : ["p[NFkB=1]", "p[NFkB=0]"] }
+    :param nodes_init: dict of the initial probabilities of nodes, such as { "Division" : [0, 0.5] }
+    :param grid: sweep all the combinations of values if True, otherwise the values are taken together (all the lists must have the same length)
+    """
+    names = []
+    values = []
+    for kind, overrides in zip(sweep_kinds, [parameters, formulas, nodes_init]):
+        for name, name_values in (overrides or {}).items():
+            names.append((kind, name))
+            values.append(list(name_values))
+
+    if len(names) == 0:
+        return [{}]
+
+    if grid:
+        return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+    if len(set(len(name_values) for name_values in values)) > 1:
+        print("All the lists of values must have the same length when grid is False", file=sys.stderr)
+        return None
+
+    return [dict(zip(names, point)) for point in zip(*values)]
+
+
+def apply_sweep_point(uppModel, point):
+    """Return a copy of the UppMaBoSS model, with the overrides of the sweep point"""
+    point_model = uppModel.copy()
+    for (kind, name), value in point.items():
+        if kind == "parameter":
+            point_model.model.param[name] = value
+
+        elif kind == "formula":
+            if name.startswith("@"):
+                point_model.setNodeFormula(name[1:], value, overwrite=True)
+            else:
+                point_model.setExternalVariable(name, value, overwrite=True)
+
+        else:
+            if point_model.nodes_init is None:
+                point_model.nodes_init = {}
+            point_model.nodes_init[name] = value
+            point_model.model.network.set_istate(name, [1-value, value], warnings=False)
+
+    return point_model
+
+
+def run_sweep(uppModel, points, workers=None, cmaboss=False, only_final_state=False, nodes=None):
+    """
+    Run the UppMaBoSS model for each point of the sweep, and return a table with one row per point.
+    The columns are grouped by kind : the overrides of the point ("parameter", "formula", "nodes_init"),
+    the population ratios over time ("pop_ratio"), and the probabilities of the nodes at the last step ("final_nodes")
+    """
+    tasks = []
+    for point in points:
+        point_model = apply_sweep_point(uppModel, point)
+        tasks.append((point_model, cmaboss, only_final_state, nodes))
+
+    if (workers is not None and workers <= 1) or len(tasks) <= 1:
+        runs = [_run_sweep_point(task) for task in tasks]
+    else:
+        with Pool(processes=workers) as pool:
+            runs = pool.map(_run_sweep_point, tasks)
+
+    rows = []
+    for point, (pop_ratios, final_nodes) in zip(points, runs):
+        row = {key: value for key, value in point.items()}
+        row.update({("pop_ratio", time): value for time, value in pop_ratios.items()})
+        row.update({("final_nodes", node): value for node, value in final_nodes.items()})
+        rows.append(row)
+
+    table = pd.DataFrame(rows, index=pd.RangeIndex(len(rows), name="point"))
+    table.columns = pd.MultiIndex.from_tuples(table.columns, names=["kind", "name"])
+    return table
+
+
+def _run_sweep_point(task):
+    """Run the UppMaBoSS model of a sweep point, and return its population ratios and last step nodes probabilities"""
+    point_model, cmaboss, only_final_state, nodes = task
+
+    result = point_model.run(cmaboss=cmaboss, only_final_state=only_final_state, retention="last_states")
+    final_nodes = result.get_nodes_stepwise_probability_distribution(nodes).iloc[-1].drop("PopRatio")
+    return result.get_population_ratios(), final_nodes
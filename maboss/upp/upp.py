@@ -1,7 +1,12 @@
 from __future__ import print_function
 import sys
+import copy
 from .results import UpdatePopulationResults
 from .cmaboss_results import CMaBoSSUpdatePopulationResults
+from .formulas import UppFormula
+from .replicates import run_replicates
+from .laststates import retention_policies
+from .sweep import make_sweep_points, run_sweep
 
 class UpdatePopulation:
     """
@@ -28,11 +33,15 @@ class UpdatePopulation:
         self.base_ratio = 1.0
 
         self.node_list = list(model.network.keys())
+        self.node_index = {name: i for i, name in enumerate(self.node_list)}
         self.division_node = ""
         self.death_node = ""
 
         self.update_var = {}
         self.nodes_formula = {}
+        self._compiled_formulas = {}
+        # random.Random drawing the #rand of the update formulas, the random module if None
+        self.random_generator = None
         self.pop_ratio = 1.0
         self.step_number = -1
 
@@ -52,7 +61,7 @@ class UpdatePopulation:
 
             self._readUppFile()
 
-    def run(self, workdir=None, overwrite=None, verbose=False, host=None, port=7777, cmaboss=False, only_final_state=False):
+    def run(self, workdir=None, overwrite=None, verbose=False, host=None, port=7777, cmaboss=False, only_final_state=False, resume=False, retention="all"):
         """
         .. py:method:: Runs the simulation
 
@@ -61,13 +70,71 @@ class UpdatePopulation:
         :param verbose: (optional) Boolean to indicate if you want debugging information
         :param host: (optional) Host to use when simulating on a MaBoSS server
         :param port: (optional) Port to use when simulating on a MaBoSS server
+        :param resume: (optional) Boolean to indicate if you want to continue an interrupted run from the last step saved in the working directory. Raises a ValueError if its checkpoint cannot be read
+        :param retention: (optional) What to keep from each step : "all" the results (default), only the "last_states" probabilities in memory, or the last states probabilities spilled to "disk" (in the working directory if any)
         :return: The Update Population results object.
         """
+        if retention not in retention_policies:
+            print("Unknown retention policy %s, should be one of %s" % (retention, ", ".join(retention_policies)), file=sys.stderr)
+            return
         
         if cmaboss:
-            return CMaBoSSUpdatePopulationResults(self, verbose, workdir, overwrite, self.previous_run, nodes_init=self.nodes_init, only_final_state=only_final_state)
+            return CMaBoSSUpdatePopulationResults(self, verbose, workdir, overwrite, self.previous_run, nodes_init=self.nodes_init, only_final_state=only_final_state, resume=resume, retention=retention)
         else:
-            return UpdatePopulationResults(self, verbose, workdir, overwrite, self.previous_run, host=host, port=port, nodes_init=self.nodes_init)
+            return UpdatePopulationResults(self, verbose, workdir, overwrite, self.previous_run, host=host, port=port, nodes_init=self.nodes_init, resume=resume, retention=retention)
+
+    def run_replicates(self, n, workers=None, seeds=None, workdir=None, cmaboss=False, only_final_state=False):
+        """
+        .. py:method:: Runs independent replicates of the simulation, each with its own seed
+
+        :param n: Number of replicates
+        :param workers: (optional) Number of replicates to run in parallel, default to the number of CPUs
+        :param seeds: (optional) Seeds of the replicates, default to consecutive seeds starting from the seed of the model
+        :param workdir: (optional) Working directory in which to save the result files of each replicate
+        :param cmaboss: (optional) Boolean to indicate if you want to simulate with cMaBoSS
+        :param only_final_state: (optional) Boolean to only compute the final states, with cMaBoSS
+        :return: The Update Population replicates object.
+        """
+        if seeds is None:
+            first_seed = int(self.model.param.get("seed_pseudorandom", 0))
+            seeds = [first_seed + i for i in range(n)]
+        elif len(seeds) != n:
+            print("Number of seeds (%d) differs from number of replicates (%d)" % (len(seeds), n), file=sys.stderr)
+            return
+
+        return run_replicates(self, seeds, workers, workdir, cmaboss, only_final_state)
+
+    def run_sweep(self, parameters=None, formulas=None, nodes_init=None, grid=True, workers=None, cmaboss=False, only_final_state=False, nodes=None):
+        """
+        .. py:method:: Runs the simulation for each point of a sweep over variables, update formulas and initial values of nodes
+
+        :param parameters: (optional) Values of $ variables, in the form { "$var" : [value1, value2, ...] }
+        :param formulas: (optional) Update formulas of $ variables or @nodes, in the form { "$var" : [formula1, formula2, ...] }
+        :param nodes_init: (optional) Initial probabilities of nodes, in the form { "node" : [TrueProb1, TrueProb2, ...] }
+        :param grid: (optional) Boolean to sweep all the combinations of values (default), otherwise the n-th values of all the lists make the n-th point
+        :param workers: (optional) Number of points to run in parallel, default to the number of CPUs
+        :param cmaboss: (optional) Boolean to indicate if you want to simulate with cMaBoSS
+        :param only_final_state: (optional) Boolean to only compute the final states, with cMaBoSS
+        :param nodes: (optional) Nodes of the final distribution, default to all the nodes active in a final state
+        :return: A pandas dataframe with one row per point, and columns grouped by kind : "parameter", "formula", "nodes_init", "pop_ratio" (by time) and "final_nodes"
+        """
+        points = make_sweep_points(parameters, formulas, nodes_init, grid)
+        if points is None:
+            return
+
+        return run_sweep(self, points, workers, cmaboss, only_final_state, nodes)
+
+    def copy(self):
+        """
+            .. py:method:: Returns a copy of the Update Population model, with a copy of its MaBoSS model
+        """
+        new_upp = copy.copy(self)
+        new_upp.model = self.model.copy()
+        new_upp.update_var = self.update_var.copy()
+        new_upp.nodes_formula = self.nodes_formula.copy()
+        if self.nodes_init is not None:
+            new_upp.nodes_init = dict(self.nodes_init)
+        return new_upp
 
     def _readUppFile(self):
 
@@ -142,6 +209,19 @@ class UpdatePopulation:
             print("Cannot find .upp file", file=sys.stderr)
             exit()
 
+        for formula in list(self.update_var.values()) + list(self.nodes_formula.values()):
+            self.get_compiled_formula(formula)
+
+    def get_compiled_formula(self, formula):
+        """
+            .. py:method:: Returns the compiled version of an update formula, compiling it on first use
+
+            :param formula: The update formula
+        """
+        if formula not in self._compiled_formulas:
+            self._compiled_formulas[formula] = UppFormula(formula, self.node_list)
+        return self._compiled_formulas[formula]
+
     def setStepNumber(self, step_number):
         """
             .. py:method:: Modifies the number of step of the simulation
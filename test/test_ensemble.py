@@ -6,9 +6,28 @@ matplotlib.use('Agg')
 
 from unittest import TestCase
 from maboss import load, Ensemble
+from maboss.results.storedresult import StoredResult
+from maboss.ensemble.result import get_single_individual_states_distribution, load_individual_states_distribution, \
+	get_single_individual_nodes_distribution, make_nodes_distribution, apply_filter, get_columns_matrix
 from os import listdir
 from os.path import dirname, join, splitext
 from json import loads
+from maboss.ensemble.individual import IndividualResultsStore, pack_individual_results
+from maboss.ensemble.rules import read_bnet_rules
+from maboss.ensemble.embedding import fit_embedding, transform_embedding
+from maboss.ensemble.shards import JobRunner, LocalJobRunner, split_models, merge_probtraj, merge_fixpoints, remap_individual_results
+from maboss.ensemble.cache import mutated_model_name, mutate_bnet_content, evict_cache, clear_cache, get_cache_dir, get_default_cache_dir, \
+	lease_name, lease_prefix
+import numpy as np
+import pandas as pd
+import tempfile
+import shutil
+from zipfile import ZipFile
+from unittest import mock
+import subprocess
+import socket
+import sys
+import os
 
 class TestEnsembleMaBoSS(TestCase):
 
@@ -26,6 +45,18 @@ class TestEnsembleMaBoSS(TestCase):
 		results.get_fptable()
 		results.get_states_probtraj()
 
+	def test_ensemble_shards(self):
+
+		ensemble_model = Ensemble(
+			join(dirname(__file__), "ensemble"), 
+			join(dirname(__file__), "simple_config.cfg"),
+			individual_results=True
+		)
+		results = ensemble_model.run(shards=2)
+		self.assertEqual(len(results.models_files), 5)
+		self.assertEqual(list(results.get_individual_states_probtraj().index), [0, 1, 2, 3, 4])
+		self.assertAlmostEqual(results.get_last_states_probtraj().values.sum(), 1.0, delta=1e-6)
+
 	def test_ensemble_individual(self):
 
 		ensemble_model = Ensemble(
@@ -40,6 +71,26 @@ class TestEnsembleMaBoSS(TestCase):
 		results.plotSteadyStatesDistribution()
 		results.plotSteadyStatesNodesDistribution()
 
+	def test_ensemble_individual_packed_workdir(self):
+
+		ensemble_model = Ensemble(
+			join(dirname(__file__), "ensemble"),
+			join(dirname(__file__), "simple_config.cfg"),
+			outputs=['AHR', 'BCL6', 'CEBPB'],
+			individual_results=True
+		)
+		workdir = tempfile.mkdtemp()
+		try:
+			results = ensemble_model.run(workdir)
+			self.assertEqual(results.pack_individual_results().nb_models, 5)
+
+			# A new simulation in the same workdir does not read the results packed by the previous one
+			results = ensemble_model.run(workdir)
+			self.assertIsNone(results.get_individual_store())
+			self.assertEqual(len(results.get_model_last_states_probtraj(0)), len(StoredResult(workdir, "res_model_0").get_last_states_probtraj(as_series=True)))
+		finally:
+			shutil.rmtree(workdir)
+
 	def test_ensemble_individual_mutant(self):
 
 		ensemble_model = Ensemble(
@@ -144,4 +195,354 @@ class TestEnsembleMaBoSS(TestCase):
 		self.assertEqual(list(ensemble_res.get_fptable()['State'].sort_values().values), 
 			['ATP -- cIAP', 'BCL2 -- ROS -- ATP -- XIAP -- NFkB -- DISC_FAS -- DISC_TNF -- cFLIP -- IKK -- FADD -- TNFR -- TNF -- RIP1 -- cIAP -- RIP1ub -- RIP1K -- Survival']
 		)
-		self.assertEqual(list(ensemble_res.get_fptable()['Proba'].sort_values().values), [0.5, 0.5])
\ No newline at end of file
+		self.assertEqual(list(ensemble_res.get_fptable()['Proba'].sort_values().values), [0.5, 0.5])
+
+
+class TestEnsembleIndividualResults(TestCase):
+
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.last_states = [
+			{"B -- A": 0.25, "<nil>": 0.75},
+			{"C": 1.0},
+			None,
+			{"A -- B": 0.5, "C": 0.125, "<nil>": 0.375},
+		]
+		for model, last_states in enumerate(self.last_states):
+			with open(join(self.path, "res_model_%d_probtraj.csv" % model), 'w') as probtraj:
+				if last_states is None:
+					continue
+				probtraj.write("Time\tTH\tErrorTH\tH\tHD=0" + "\tState\tProba\tErrorProba"*3 + "\n")
+				probtraj.write("0\t0\t0\t0\t0\t<nil>\t1\t0\n")
+				probtraj.write("\t".join(["10", "0", "0", "0", "0"] + ["%s\t%g\t0" % item for item in last_states.items()]) + "\n")
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def test_load_individual_states(self):
+
+		expected = pd.concat(
+			[get_single_individual_states_distribution(StoredResult(self.path, "res_model_%d" % i), i) for i in range(len(self.last_states))],
+			axis=0, sort=False
+		).fillna(0)
+
+		for workers in [1, 2]:
+			table = load_individual_states_distribution(self.path, "res", len(self.last_states), workers)
+			pd.testing.assert_frame_equal(table, expected)
+		
+		self.assertEqual(table.loc[3, "A -- B"], 0.5)
+		self.assertEqual(list(table.index), [0, 1, 3])
+
+	def test_nodes_distribution(self):
+
+		states = load_individual_states_distribution(self.path, "res", len(self.last_states))
+		nodes = make_nodes_distribution(states)
+
+		self.assertEqual(list(nodes.columns), ["A", "B", "C"])
+		expected = pd.concat(
+			[get_single_individual_nodes_distribution(states, index, list(nodes.columns)) for index in states.index], 
+			axis=0
+		)
+		pd.testing.assert_frame_equal(nodes, expected)
+
+	def test_filters(self):
+
+		states = load_individual_states_distribution(self.path, "res", len(self.last_states))
+		nodes = make_nodes_distribution(states)
+
+		self.assertEqual(list(apply_filter(nodes, "A > 0.2 and C < 0.5").index), [0, 3])
+		self.assertEqual(list(apply_filter(nodes, "A > 0.3 or C > 0.5").index), [1, 3])
+		self.assertEqual(list(apply_filter(nodes, "0.1 < C < 0.5").index), [3])
+		self.assertEqual(list(apply_filter(nodes, "not A + C > 0.5").index), [0])
+		self.assertEqual(list(apply_filter(states, "A -- B > 0.3 or C > 0.5", state=True).index), [1, 3])
+		self.assertEqual(list(apply_filter(states, "D > 0.1 or C >= 1", state=True).index), [1])
+
+	def test_embedding(self):
+
+		states = load_individual_states_distribution(self.path, "res", len(self.last_states))
+		columns = ["D"] + list(states.columns)[::-1]
+		matrix = get_columns_matrix(states, columns)
+		np.testing.assert_array_equal(matrix.toarray(), states.reindex(columns=columns, fill_value=0).values)
+		np.testing.assert_array_equal(get_columns_matrix(states, ["A -- B", "C"]).toarray(), states[["A -- B", "C"]].values)
+
+		from sklearn.decomposition import PCA
+		random = np.random.RandomState(0)
+		table = random.dirichlet(np.ones(3), size=500).dot(random.dirichlet(np.ones(12)*0.2, size=3)) + random.rand(500, 12)*0.01
+		expected = PCA(n_components=2).fit(table)
+
+		pca, coordinates = fit_embedding(table, "pca")
+		np.testing.assert_allclose(np.abs(coordinates), np.abs(expected.transform(table)), atol=1e-10)
+
+		large = np.vstack([table]*20)
+		sparse_pca, coordinates = fit_embedding(get_columns_matrix(pd.DataFrame(large), range(12)))
+		np.testing.assert_allclose(sparse_pca.explained_variance_ratio_, expected.explained_variance_ratio_, rtol=1e-6)
+		np.testing.assert_allclose(np.abs(coordinates), np.abs(expected.transform(large)), atol=1e-8)
+
+		ipca, coordinates = fit_embedding(get_columns_matrix(pd.DataFrame(table), range(12)), "ipca", batch_size=100)
+		np.testing.assert_allclose(ipca.explained_variance_ratio_, expected.explained_variance_ratio_, rtol=1e-2)
+		np.testing.assert_allclose(coordinates, transform_embedding(ipca, table[:, :]), atol=1e-10)
+
+		tsne, coordinates = fit_embedding(table[:100], "tsne", perplexity=10, n_iter=250)
+		self.assertEqual(coordinates.shape, (100, 2))
+		self.assertRaises(ValueError, transform_embedding, tsne, table)
+		self.assertRaises(ValueError, fit_embedding, table, "umap")
+
+	def test_pack_individual_results(self):
+
+		expected = load_individual_states_distribution(self.path, "res", len(self.last_states))
+		trajectory = StoredResult(self.path, "res_model_3").get_states_probtraj()
+		trajectory.columns = ["A -- B" if column == "B -- A" else column for column in trajectory.columns]
+
+		with open(join(self.path, "res_model_0_fp.csv"), 'w') as fp:
+			fp.write("Fixed Points (0)\n")
+
+		pack_individual_results(self.path, "res", len(self.last_states), remove=True)
+		self.assertIn("res_model_3_probtraj.csv", listdir(self.path))
+
+		pack_individual_results(self.path, "res", len(self.last_states), trajectories=True, remove=True)
+		self.assertEqual(sorted(listdir(self.path)), ["res_individual.json", "res_individual.npz", "res_model_0_fp.csv"])
+
+		with open(join(self.path, "res_individual.json"), 'r') as index:
+			self.assertEqual(loads(index.read())["nb_models"], len(self.last_states))
+		store = IndividualResultsStore(self.path, "res")
+		pd.testing.assert_frame_equal(store.get_states_distribution(), expected)
+		self.assertEqual(store.get_last_states(0).to_dict(), {"<nil>": 0.75, "A -- B": 0.25})
+		self.assertEqual(len(store.get_last_states(2)), 0)
+		pd.testing.assert_frame_equal(
+			store.get_states_trajectory(3).sort_index(axis=1), trajectory.sort_index(axis=1), check_names=False
+		)
+
+
+class TestEnsembleShards(TestCase):
+
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def test_split_models(self):
+		self.assertEqual(split_models(list(range(5)), 2), [[0, 1, 2], [3, 4]])
+		self.assertEqual(split_models(list(range(2)), 4), [[0], [1]])
+
+	def test_local_runner(self):
+		jobs = [([sys.executable, "-c", "print(%d)" % i], self.path) for i in range(3)]
+		self.assertEqual(LocalJobRunner(2).run(jobs), [(0, "%d\n" % i, "") for i in range(3)])
+		with self.assertRaises(TypeError):
+			JobRunner()
+
+	def test_merge_probtraj(self):
+		header = "Time\tTH\tErrorTH\tH\tHD=0\tState\tProba\tErrorProba\tState\tProba\tErrorProba\n"
+		with open(join(self.path, "a.csv"), 'w') as f:
+			f.write(header)
+			f.write("0\t0\t0\t0\t1\t<nil>\t1\t0\n")
+			f.write("1\t0.5\t0.25\t1\t1\tA\t0.5\t0.25\t<nil>\t0.5\t0.25\n")
+		with open(join(self.path, "b.csv"), 'w') as f:
+			f.write(header)
+			f.write("0\t0\t0\t0\t1\t<nil>\t1\t0\n")
+			f.write("1\t1\t0.5\t0\t1\tB\t1\t0.5\n")
+
+		merge_probtraj([join(self.path, "a.csv"), join(self.path, "b.csv")], [1, 3], join(self.path, "res_probtraj.csv"))
+		with open(join(self.path, "res_probtraj.csv"), 'r') as f:
+			lines = [line.strip("\n").split("\t") for line in f]
+
+		self.assertEqual(lines[0], ["Time", "TH", "ErrorTH", "H", "HD=0"] + ["State", "Proba", "ErrorProba"]*3)
+		self.assertEqual(lines[1], ["0", "0", "0", "0", "1", "<nil>", "1", "0"])
+		self.assertEqual(lines[2][:5], ["1", "0.875", "0.3801726581", "1.061278124", "1"])
+		probas = {state: float(proba) for state, proba in zip(lines[2][5::3], lines[2][6::3])}
+		self.assertEqual(probas, {"A": 0.125, "<nil>": 0.125, "B": 0.75})
+
+		# the shards must have the same time points
+		with open(join(self.path, "c.csv"), 'w') as f:
+			f.write(header)
+			f.write("0\t0\t0\t0\t1\t<nil>\t1\t0\n")
+		with self.assertRaises(ValueError):
+			merge_probtraj([join(self.path, "a.csv"), join(self.path, "c.csv")], [1, 1], join(self.path, "res_probtraj.csv"))
+		with open(join(self.path, "c.csv"), 'a') as f:
+			f.write("2\t1\t0.5\t0\t1\tB\t1\t0.5\n")
+		with self.assertRaises(ValueError):
+			merge_probtraj([join(self.path, "a.csv"), join(self.path, "c.csv")], [1, 1], join(self.path, "res_probtraj.csv"))
+
+	def test_merge_fixpoints(self):
+		with open(join(self.path, "a.csv"), 'w') as f:
+			f.write("Fixed Points (2)\nFP\tProba\tState\tA\tB\n#1\t0.5\tA\t1\t0\n#2\t0.5\tA -- B\t1\t1\n")
+		with open(join(self.path, "b.csv"), 'w') as f:
+			f.write("Fixed Points (1)\nFP\tProba\tState\tA\tB\n#1\t1\tA -- B\t1\t1\n")
+
+		merge_fixpoints([join(self.path, "a.csv"), join(self.path, "b.csv")], [1, 1], join(self.path, "res_fp.csv"))
+		table = pd.read_csv(join(self.path, "res_fp.csv"), sep="\t", skiprows=[0])
+		self.assertEqual(list(table["FP"]), ["#1", "#2"])
+		self.assertEqual(list(table["State"]), ["A -- B", "A"])
+		self.assertEqual(list(table["Proba"]), [0.75, 0.25])
+
+	def test_remap_individual_results(self):
+		shard_path = join(self.path, "shard_1")
+		os.mkdir(shard_path)
+		for filename in ["res_model_0_probtraj.csv", "res_model_1_fp.csv", "res_probtraj.csv"]:
+			open(join(shard_path, filename), 'w').close()
+
+		remap_individual_results(shard_path, self.path, "res", 3)
+		self.assertEqual(sorted(listdir(shard_path)), ["res_probtraj.csv"])
+		self.assertEqual(sorted(listdir(self.path)), ["res_model_3_probtraj.csv", "res_model_4_fp.csv", "shard_1"])
+
+
+class TestEnsembleModelsCache(TestCase):
+
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.models_path = join(self.path, "models_src")
+		os.mkdir(self.models_path)
+		with open(join(self.models_path, "a.bnet"), 'w') as f:
+			f.write("A-1, B\nB, A-1 & !C\nC, B\n")
+		with open(join(self.models_path, "b.bnet"), 'w') as f:
+			f.write("A-1, A-1\nB, !A-1\n")
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def write_models(self, mutations):
+		ensemble_model = Ensemble(self.models_path, cache_dir=join(self.path, "cache"), mutations=mutations)
+		workdir = tempfile.mkdtemp(dir=self.path)
+		os.mkdir(join(workdir, "models"))
+		expected = [ensemble_model.mutate_bnet(model, self.path) for model in ensemble_model.models_files]
+		expected = [open(model).read() for model in expected]
+		ensemble_model.write_models(workdir)
+		self.assertEqual([open(model).read() for model in ensemble_model.models_files], expected)
+		return [os.stat(model).st_ino for model in ensemble_model.models_files]
+
+	def test_mutated_models_cache(self):
+		os.mkdir(join(self.path, "models"))
+
+		wild_type = self.write_models({})
+		self.assertEqual(self.write_models({}), wild_type)
+
+		mutant = self.write_models({"C": "ON"})
+		self.assertNotEqual(mutant[0], wild_type[0])
+		self.assertEqual(mutant[1], wild_type[1])
+
+		self.assertEqual(self.write_models({"A_1": "OFF", "C": "ON"})[1], self.write_models({"A_1": "OFF"})[1])
+		self.assertEqual(len([entry for entry in listdir(join(self.path, "cache", "models")) if entry.endswith(".bnet")]), 6)
+
+	def test_mutated_models_cache_checks(self):
+		os.mkdir(join(self.path, "models"))
+		cache_dir = join(self.path, "cache")
+		self.write_models({"C": "ON"})
+		names = sorted(mutated_model_name(model, {"C": "ON"}) for model in Ensemble(self.models_path).models_files)
+		entries = sorted(name + ".bnet" for name in names)
+		self.assertEqual(sorted(listdir(join(cache_dir, "models"))), sorted(entries + [name + ".sha1" for name in names]))
+
+		# the models found in the cache are not mutated again
+		with mock.patch("maboss.ensemble.cache.mutate_bnet_content", side_effect=mutate_bnet_content) as mutate:
+			self.write_models({"C": "ON"})
+			self.assertEqual(mutate.call_count, 0)
+
+			# an entry whose content does not match its digest is written again, and only this one
+			with open(join(cache_dir, "models", entries[0]), 'w') as f:
+				f.write("A_1, 1\n")
+			self.write_models({"C": "ON"})
+			self.assertEqual(mutate.call_count, 1)
+
+		# the least recently used entries are removed above the maximum size, with their digest
+		os.utime(join(cache_dir, "models", entries[0]), (0, 0))
+		evict_cache(cache_dir, max_size=sum(os.path.getsize(join(cache_dir, "models", names[1] + ext)) for ext in [".bnet", ".sha1"]))
+		self.assertEqual(sorted(listdir(join(cache_dir, "models"))), [entries[1], names[1] + ".sha1"])
+
+		clear_cache(cache_dir)
+		self.assertEqual(listdir(cache_dir), [])
+		self.write_models({"C": "ON"})
+		self.assertEqual(sorted(entry for entry in listdir(join(cache_dir, "models")) if entry.endswith(".bnet")), entries)
+
+	def test_default_cache_dir(self):
+		os.environ["XDG_CACHE_HOME"] = join(self.path, "home_cache")
+		try:
+			self.assertEqual(get_default_cache_dir(), join(self.path, "home_cache", "maboss"))
+			self.assertEqual(get_cache_dir(), join(self.path, "home_cache", "maboss"))
+			self.assertEqual(os.stat(get_cache_dir()).st_mode & 0o777, 0o700)
+
+			os.chmod(get_cache_dir(), 0o777)
+			with self.assertRaises(PermissionError):
+				get_cache_dir()
+		finally:
+			del os.environ["XDG_CACHE_HOME"]
+
+	def test_zip_cache(self):
+		zip_path = join(dirname(__file__), "ensemble.zip")
+		cache_dir = join(self.path, "cache")
+
+		subset = Ensemble(zip_path, cache_dir=cache_dir, models=["TC2_BN_0.bnet", "TC2_BN_3000.bnet"])
+		self.assertEqual(
+			sorted(name for name in listdir(subset.models_path) if not name.startswith(".")),
+			["TC2_BN_0.bnet", "TC2_BN_3000.bnet"]
+		)
+		self.assertTrue(os.path.exists(join(subset.models_path, lease_name())))
+
+		ensemble_model = Ensemble(zip_path, cache_dir=cache_dir)
+		self.assertEqual(ensemble_model.models_path, subset.models_path)
+		self.assertEqual(len(ensemble_model.models_files), 5)
+		self.assertEqual(
+			[os.path.basename(model) for model in ensemble_model.models_files],
+			["TC2_BN_0.bnet", "TC2_BN_1000.bnet", "TC2_BN_2000.bnet", "TC2_BN_3000.bnet", "TC2_BN_4000.bnet"]
+		)
+
+		mtime = os.stat(subset.models_files[0]).st_mtime_ns
+		copied = subset.copy()
+		self.assertEqual(copied.models_files, subset.models_files)
+		self.assertEqual(os.stat(copied.models_files[0]).st_mtime_ns, mtime)
+
+		# a member whose content does not match the CRC of the zip is extracted again
+		with open(subset.models_files[0], 'w') as f:
+			f.write("A, 1\n")
+		Ensemble(zip_path, cache_dir=cache_dir, models=["TC2_BN_0.bnet"])
+		with ZipFile(zip_path) as zin:
+			self.assertEqual(open(subset.models_files[0], 'rb').read(), zin.read("TC2_BN_0.bnet"))
+
+		# the folders of the zip files used by this process are not evicted
+		evict_cache(cache_dir, max_size=0)
+		self.assertTrue(all(os.path.exists(model) for model in ensemble_model.models_files))
+
+		# nor the folders leased by another live process, while the leases of ended processes are removed
+		leased = get_cache_dir(cache_dir, join("zips", "leased"))
+		with open(join(leased, "TC2_BN_0.bnet"), 'w') as f:
+			f.write("A, 1\n")
+		other = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+		try:
+			other_lease = join(leased, "%s%s-%d" % (lease_prefix, socket.gethostname(), other.pid))
+			open(other_lease, 'w').close()
+			evict_cache(cache_dir, max_size=0)
+			self.assertTrue(os.path.exists(join(leased, "TC2_BN_0.bnet")))
+		finally:
+			other.kill()
+			other.wait()
+		evict_cache(cache_dir, max_size=0)
+		self.assertFalse(os.path.exists(leased))
+		self.assertTrue(all(os.path.exists(model) for model in ensemble_model.models_files))
+
+		clear_cache(cache_dir)
+		self.assertFalse(os.path.exists(ensemble_model.models_path))
+
+
+class TestEnsembleRules(TestCase):
+
+	def test_rules_table(self):
+
+		ensemble_model = Ensemble(join(dirname(__file__), "ensemble"))
+		minibns = ensemble_model.get_mini_bns()
+
+		for cluster in [None, [0, 2], [3]]:
+			t_minibns = minibns if cluster is None else [minibns[i] for i in cluster]
+			expected = {node: set(t_minibn[node] for t_minibn in t_minibns) for node in minibns[0].keys()}
+			self.assertEqual(ensemble_model.get_mini_ensemble(cluster), expected)
+
+			rates = ensemble_model.get_nodes_selection_rate(cluster)
+			for node, rules in expected.items():
+				nb_nodes = len(t_minibns[0][node].symbols)
+				self.assertEqual(rates[node], len(rules)/(pow(2, pow(2, nb_nodes-1)-1)))
+
+		self.assertIs(ensemble_model.copy().get_rules_table(), ensemble_model.get_rules_table())
+
+		rules_table = ensemble_model.get_rules_table()
+		self.assertEqual(set(rules_table.get_rules_counts([]).values()), {(0, 0)})
+		self.assertEqual(
+			[node for node, _ in read_bnet_rules(ensemble_model.models_files[0])], list(minibns[0].keys())
+		)
+
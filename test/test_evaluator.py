@@ -1,11 +1,15 @@
 from unittest import TestCase
 import os
+import shutil
+import tempfile
 
 import numpy as np
 from IPython.core.display_functions import display
 
+import maboss
 from maboss.temporal_logic.evaluator import MaBoSSEvaluator
 from maboss.temporal_logic.temporal_parser import *
+from maboss.temporal_logic.simulation_cache import SimulationCache
 import pandas as pd
 from maboss.temporal_logic import visualiser
 
@@ -614,6 +618,63 @@ class TestEvaluator(TestCase):
         expected = "AKT1:ON"
         assert res == expected
 
+    def test_querying_parallel_simulations(self):
+        queries = [
+            "P(node:p53) > 0.1",
+            "Inc(node:Mdm2C) / [ ] [ p53:ON ]",
+            "Dec(node:Mdm2C) / [ ] [ Dam:OFF p53:ON ] [ compare:p53:ON ]",
+            "P(node:p53) >= 0.0 [ ] [ Dam:OFF ]",
+        ]
+        bnd, cfg = get_test_path("p53_Mdm2.bnd"), get_test_path("p53_Mdm2_runcfg.cfg")
+        res_serial = MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], workers=1, cache=False)
+        res_parallel = MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], workers=3, cache=False)
+
+        # the results keep the order of the queries, whatever the order in which the simulations are done
+        self.assertEqual(len(res_parallel), len(queries))
+        for df_serial, df_parallel in zip(res_serial, res_parallel):
+            pd.testing.assert_frame_equal(df_serial, df_parallel)
+        self.assertIn("Mdm2C from mutation", res_parallel[1].columns)
+        self.assertIn("Decrease Mdm2C", res_parallel[2].columns)
+
+    def test_querying_cache(self):
+        queries = ["P(node:p53) >= 0.0", "Inc(node:Mdm2C) / [ ] [ p53:ON ]"]
+        bnd, cfg = get_test_path("p53_Mdm2.bnd"), get_test_path("p53_Mdm2_runcfg.cfg")
+        cache_dir = tempfile.mkdtemp()
+        try:
+            MaBoSSEvaluator.set_cache(max_results=2, cache_dir=cache_dir)
+            res_run = MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], cache=True)
+            self.assertEqual(MaBoSSEvaluator.cache_report, {"master_simulation": "run", "p53:ON": "run"})
+
+            res_cached = MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], cache=True)
+            self.assertEqual(MaBoSSEvaluator.cache_report, {"master_simulation": "memory", "p53:ON": "memory"})
+            for df_run, df_cached in zip(res_run, res_cached):
+                pd.testing.assert_frame_equal(df_run, df_cached)
+
+            # another output setting is another simulation, its result takes the place of the least recently used one
+            MaBoSSEvaluator.querying(queries[:1], cfg, bnd, output_setting=["p53"], cache=True)
+            self.assertEqual(MaBoSSEvaluator.cache_report, {"master_simulation": "run"})
+            self.assertEqual(len(MaBoSSEvaluator.simulation_cache), 2)
+
+            # a new session reads the results from the disk, until they are invalidated
+            MaBoSSEvaluator.set_cache(cache_dir=cache_dir)
+            MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], cache=True)
+            self.assertEqual(MaBoSSEvaluator.cache_report, {"master_simulation": "disk", "p53:ON": "disk"})
+            self.assertEqual(MaBoSSEvaluator.invalidate_cache(sim_bnd=get_test_path("cellcycle.bnd")), 0)
+            self.assertEqual(MaBoSSEvaluator.invalidate_cache(sim_bnd=bnd), 3)
+            MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"], cache=True)
+            self.assertEqual(MaBoSSEvaluator.cache_report, {"master_simulation": "run", "p53:ON": "run"})
+
+            # the cache is only used on demand, and never keeps the simulations using the physical random generator
+            MaBoSSEvaluator.querying(queries, cfg, bnd, output_setting=["p53", "Mdm2C"])
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            model = maboss.load(bnd, cfg)
+            self.assertTrue(SimulationCache.is_reproducible(model))
+            model.param["use_physrandgen"] = 1
+            self.assertFalse(SimulationCache.is_reproducible(model))
+        finally:
+            MaBoSSEvaluator.set_cache()
+            shutil.rmtree(cache_dir)
+
 
 # ------------------------------------------ MUTATION RELATED TESTS -----------------------------------------------
     def test_increase_true(self):
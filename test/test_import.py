@@ -0,0 +1,60 @@
+"""Test suite for the import time of maboss."""
+
+from unittest import TestCase
+import subprocess
+import sys
+import json
+
+_import_script = """
+import json, sys, time
+start = time.time()
+import maboss
+elapsed = time.time() - start
+print(json.dumps({"time": elapsed, "modules": list(sys.modules.keys())}))
+"""
+
+class TestImport(TestCase):
+
+	# Generous budget : importing pandas and numpy alone takes ~0.5s
+	import_time_budget = 2.0
+	heavy_modules = ["sklearn", "matplotlib", "mpl_toolkits", "networkx", "IPython", "ipywidgets", "colomoto_jupyter"]
+
+	def _import_maboss(self):
+		out = subprocess.check_output([sys.executable, "-c", _import_script])
+		return json.loads(out.decode().strip().split("\n")[-1])
+
+	def test_import_time(self):
+
+		# Best of three, to be robust to a cold filesystem cache
+		best = min(self._import_maboss()["time"] for _ in range(3))
+		self.assertLess(best, self.import_time_budget)
+
+	def test_lazy_modules(self):
+
+		modules = self._import_maboss()["modules"]
+		for module in self.heavy_modules:
+			self.assertNotIn(module, modules)
+
+		for module in ["maboss.ensemble", "maboss.upp", "maboss.pop", "maboss.temporal_logic", "maboss.figures"]:
+			self.assertNotIn(module, modules)
+
+	def test_lazy_attributes(self):
+
+		import maboss
+		from maboss.upp.upp import UpdatePopulation
+		from maboss.ensemble.ensemble import Ensemble
+		self.assertIs(maboss.UpdatePopulation, UpdatePopulation)
+		self.assertIs(maboss.Ensemble, Ensemble)
+		self.assertTrue(hasattr(maboss.pipelines, "simulate_single_mutants"))
+		self.assertIn("MaBoSSEvaluator", dir(maboss))
+		with self.assertRaises(AttributeError):
+			maboss.NotAnAttribute
+
+	def test_import_all(self):
+
+		namespace = {}
+		exec("from maboss import *", namespace)
+		for name in ["load", "Simulation", "Network", "UpdatePopulation", "Ensemble", "EnsembleResult",
+					 "PopSimulation", "MaBoSSClient", "MaBoSSEvaluator", "pipelines", "temporal_logic"]:
+			self.assertIn(name, namespace)
+		self.assertNotIn("importlib", namespace)
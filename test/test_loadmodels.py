@@ -5,7 +5,7 @@ import matplotlib
 matplotlib.use('Agg')
 
 from unittest import TestCase
-from maboss import load, loadBNet, loadSBML
+from maboss import load, load_many, loadBNet, loadSBML
 from os.path import dirname, join, exists
 import shutil
 
@@ -116,4 +116,34 @@ class TestLoadModels(TestCase):
 		)
 
 	
-		
\ No newline at end of file
+		
+	def test_load_many(self):
+
+		models = [
+			(join(dirname(__file__), "p53_Mdm2.bnd"), join(dirname(__file__), "p53_Mdm2_runcfg.cfg")),
+			join(dirname(__file__), "not_a_model.bnd"),
+			(join(dirname(__file__), "cellcycle.bnd"), join(dirname(__file__), "cellcycle_runcfg.cfg")),
+			(join(dirname(__file__), "p53_Mdm2.bnd"), join(dirname(__file__), "p53_Mdm2_runcfg.cfg")),
+		]
+		sims, errors = load_many(models, workers=2, return_errors=True)
+
+		self.assertEqual(len(sims), 4)
+		self.assertIsNone(sims[1])
+		self.assertEqual(list(errors.keys()), [join(dirname(__file__), "not_a_model.bnd")])
+
+		for model, sim in zip(models, sims):
+			if sim is not None:
+				expected_sim = load(*model)
+				self.assertEqual(str(sim.network), str(expected_sim.network))
+				self.assertEqual(sim.str_cfg(), expected_sim.str_cfg())
+
+		# Duplicated entries are distinct objects
+		self.assertIsNot(sims[0], sims[3])
+		sims[0].update_parameters(sample_count=10)
+		self.assertNotEqual(sims[0].str_cfg(), sims[3].str_cfg())
+
+	def test_load_many_glob(self):
+
+		sims = load_many(join(dirname(__file__), "ensemble_bnd", "*.bnd"), workers=1)
+		self.assertTrue(len(sims) > 0)
+		self.assertTrue(all(sim is not None for sim in sims))
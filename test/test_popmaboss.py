@@ -6,8 +6,13 @@ matplotlib.use('Agg')
 
 from unittest import TestCase
 from maboss import PopSimulation
+from maboss.pop.popresult import PopStates, parse_pop_state
+from maboss.pop.storedpopresult import StoredPopResult
 from os.path import dirname, join
 import numpy as np
+import tempfile
+import shutil
+import os
 
 class TestPopPMaBoSS(TestCase):
 
@@ -101,4 +106,112 @@ class TestPopPMaBoSS(TestCase):
 		self.assertTrue(np.allclose(res.get_simple_states_popsize().values, expected, atol=1e-5))
 		
 		expected = np.array([0.008984, 0.039730, 0.096174, 0.151794, 0.197019, 0.179636, 0.110641, 0.104453, 0.053642, 0.036398, 0.011686, 0.004299, 0.002714, 0.002832])
-		self.assertTrue(np.allclose(res.get_last_state_dist("A").values, expected, atol=1e-5))
\ No newline at end of file
+		self.assertTrue(np.allclose(res.get_last_state_dist("A").values, expected, atol=1e-5))
+
+	def test_pop_states(self):
+
+		states = ["[{A -- B:3},{C:1}]", "[{<nil>:2},{A:2}]", "[]"]
+		pop_states = PopStates(states)
+
+		self.assertEqual(pop_states.substates, ["A -- B", "C", "<nil>", "A"])
+		self.assertEqual(pop_states.nodes, ["A", "B", "C"])
+		self.assertEqual(pop_states.totals.tolist(), [4, 4, 0])
+		self.assertEqual(pop_states.get_count_matrix().tolist(), [[3, 1, 0, 0], [0, 0, 2, 2], [0, 0, 0, 0]])
+
+		self.assertTrue(np.allclose(pop_states.get_nodes_ratios(["A", "C", "D"]), [[0.75, 0.25, 0], [0.5, 0, 0], [0, 0, 0]]))
+		self.assertTrue(np.allclose(pop_states.get_substates_ratios(["C", "<nil>", "D"]), [[0.25, 0, 0], [0, 0.5, 0], [0, 0, 0]]))
+
+		rows, ids, keys = pop_states.get_popnodes()
+		self.assertEqual(keys, [("A", 2), ("A", 3), ("B", 3), ("C", 1)])
+		self.assertEqual(sorted(zip(rows.tolist(), [keys[i] for i in ids])), [(0, ("A", 3)), (0, ("B", 3)), (0, ("C", 1)), (1, ("A", 2))])
+
+	def test_assymetric_analytics(self):
+
+		sim = PopSimulation(join(dirname(__file__), "pop", "Assymetric.pbnd"), join(dirname(__file__), "pop", "Assymetric.cfg"))
+		res = sim.run()
+		raw_probas, indexes, states, _ = res.get_raw_states_probtraj()
+
+		sizes = np.array([sum(parse_pop_state(state).values()) for state in states])
+		ratios = np.array([
+			sum(pop for state, pop in parse_pop_state(popstate).items() if "B" in state.split(" -- "))/float(max(1, size))
+			for popstate, size in zip(states, sizes)
+		])
+		expected = raw_probas.dot(ratios)
+		stdev = np.sqrt((raw_probas*(ratios[np.newaxis, :] - expected[:, np.newaxis])**2).sum(axis=1))
+
+		self.assertTrue(np.allclose(res.get_activity_ratio_expected("B").values, expected))
+		self.assertTrue(np.allclose(res.get_activity_ratio_stdev("B").values, stdev))
+
+		nb_dists = res.get_nb_dists()
+		for size in nb_dists.columns:
+			self.assertTrue(np.allclose(nb_dists[size].values, raw_probas[:, sizes == size].sum(axis=1)))
+
+		nodes_probtraj = res.get_nodes_probtraj(nodes=["B"])
+		self.assertTrue(all(popnode.startswith("{B:") for popnode in nodes_probtraj.columns))
+		self.assertTrue(np.allclose(
+			nodes_probtraj.values.dot([int(popnode[3:-1]) for popnode in nodes_probtraj.columns]),
+			raw_probas.dot([sum(pop for state, pop in parse_pop_state(popstate).items() if "B" in state.split(" -- ")) for popstate in states])
+		))
+
+	def test_stored_lines_index(self):
+
+		workdir = tempfile.mkdtemp()
+		try:
+			sim = PopSimulation(join(dirname(__file__), "pop", "Assymetric.pbnd"), join(dirname(__file__), "pop", "Assymetric.cfg"))
+			sim.run(workdir=workdir)
+			res = StoredPopResult(sim, workdir)
+			table = res.get_states_probtraj()
+
+			for index in [0, 4, len(table)-1, -1]:
+				expected = table.iloc[index][table.iloc[index] > 0].sort_index()
+				self.assertTrue(np.allclose(res.get_states_probtraj_by_index(index).values, expected.values))
+			self.assertTrue(os.path.exists(res.get_probtraj_index_file()))
+
+			res = StoredPopResult(sim, workdir)
+			self.assertEqual(res.get_time_index(table.index[3]), 3)
+			self.assertEqual(float(res.get_states_probtraj_by_time(table.index[3]).name), table.index[3])
+			self.assertRaises(ValueError, res.get_time_index, -1)
+
+			slices = list(res.iter_states_probtraj(start=2))
+			self.assertEqual([t_slice.name for t_slice in slices], list(table.index[2:]))
+			for t_slice in slices:
+				self.assertTrue(np.allclose(t_slice.values, table.loc[t_slice.name, t_slice.index].values))
+
+			# A new simulation in the same directory invalidates the saved index
+			sim.update_parameters(max_time=2)
+			sim.run(workdir=workdir, overwrite=True)
+			res = StoredPopResult(sim, workdir)
+			self.assertEqual(len(list(res.iter_states_probtraj())), len(res.get_states_probtraj()))
+
+		finally:
+			shutil.rmtree(workdir)
+
+	def test_batch(self):
+
+		sim = PopSimulation(join(dirname(__file__), "pop", "Assymetric.pbnd"), join(dirname(__file__), "pop", "Assymetric.cfg"))
+		res = sim.run()
+
+		for workers in [1, 2]:
+			progress = []
+			batch = sim.run_batch(
+				[{}, {"seed_pseudorandom": 101, "max_time": 2}, {"unknown_parameter": 1}], 
+				workers=workers, progress=lambda done, total, index, error: progress.append((done, total, index))
+			)
+			self.assertEqual([(done, total) for done, total, _ in progress], [(1, 3), (2, 3), (3, 3)])
+			self.assertEqual(sorted(index for _, _, index in progress), [0, 1, 2])
+			self.assertEqual(list(batch.errors.keys()), [2])
+			self.assertIsNone(batch[2])
+			self.assertEqual(sim.param["max_time"], 5)
+			self.assertEqual(sim.param["seed_pseudorandom"], 100)
+
+			self.assertTrue(np.allclose(batch[0].get_simple_states_popsize().values, res.get_simple_states_popsize().values))
+			self.assertEqual(len(batch[1].get_simple_popsize()), 4)
+
+			popsizes = batch.get_simple_popsizes()
+			self.assertEqual(popsizes.shape, (3, 10))
+			self.assertTrue(np.allclose(popsizes.loc[0].values, res.get_simple_popsize().values))
+			self.assertTrue(popsizes.loc[2].isnull().all())
+
+		batch = sim.run_batch({"max_time": [1, 2], "time_tick": [0.5, 1]}, grid=False, workers=1, states=True)
+		self.assertEqual(batch.get_variants().to_dict("records"), [{"max_time": 1, "time_tick": 0.5}, {"max_time": 2, "time_tick": 1}])
+		self.assertEqual(batch[1].get_nb_dists().shape[0], 2)
@@ -31,3 +31,98 @@ class TestTypes(TestCase):
         testSimul = Simulation(testNet)
         res = testSimul.run()
 
+
+    def test_istate_binding(self):
+
+        nodes = [Node(name, 'A', 1, 1) for name in ['A', 'B', 'C', 'D']]
+        testNet = Network(nodes)
+
+        testNet.set_istate('A', [1, 0])
+        testNet.set_istate('D', {0: '$p', 1: '1-$p'})
+        testNet.set_istate(['B', 'C'], {(0, 0): 0.4, (1, 1): 0.6})
+        self.assertEqual(
+            testNet.str_istate(),
+            "A.istate = FALSE;\n[D].istate = $p[0] , 1-$p[1];\n[B, C].istate = 0.4 [0, 0] , 0.6 [1, 1];"
+        )
+        self.assertEqual(list(testNet.get_istate().keys()), ['A', 'D', ('B', 'C')])
+
+        # Setting the istate of a bound node erases the binding
+        testNet.set_istate('B', [0.2, 0.8], warnings=False)
+        self.assertEqual(testNet.get_istate()['B'], {0: 0.2, 1: 0.8})
+        self.assertEqual(testNet.get_istate()['C'], {0: 0.5, 1: 0.5})
+        self.assertNotIn(('B', 'C'), testNet.get_istate())
+
+        # Copies do not share their initial states
+        copyNet = testNet.copy()
+        copyNet.set_istate('A', [0, 1])
+        self.assertEqual(testNet.get_istate()['A'], {0: 1, 1: 0})
+        self.assertEqual(copyNet.str_istate(), "A.istate = TRUE;\n[B].istate = 0.2[0] , 0.8[1];\n[D].istate = $p[0] , 1-$p[1];")
+
+        # Unknown nodes are rejected, without erasing the bindings of the others
+        testNet.set_istate(['B', 'C'], {(0, 0): 0.4, (1, 1): 0.6}, warnings=False)
+        with self.assertRaisesRegex(ValueError, "Node E"):
+            testNet.set_istate(['B', 'E'], {(0, 0): 1})
+        with self.assertRaisesRegex(ValueError, "Node E"):
+            testNet.set_istate('E', [0, 1])
+        self.assertIn(('B', 'C'), testNet.get_istate())
+
+        # Nodes added one by one keep their initial states
+        for i in range(20):
+            testNet.add_node('N%d' % i)
+            testNet.set_istate('N%d' % i, [(20 - i)/20., i/20.])
+        self.assertEqual(testNet.get_istate()['A'], {0: 1, 1: 0})
+        self.assertEqual(testNet.get_istate()['N0'], {0: 1, 1: 0})
+        self.assertEqual(testNet.get_istate()['N10'], {0: 0.5, 1: 0.5})
+        self.assertEqual(testNet.get_istate()['N19'], {0: 1/20., 1: 19/20.})
+        testNet.remove_node('N0')
+        self.assertEqual(len(testNet.copy().get_istate()), len(testNet.get_istate()))
+
+        with self.assertRaises(AttributeError):
+            nodes[0].not_an_attribute = True
+
+    def test_istate_distribution(self):
+
+        nodes = [Node(name, 'A', 1, 1) for name in ['A', 'B', 'C']]
+        dictNet = Network(nodes)
+        matrixNet = Network([node.copy() for node in nodes])
+
+        dictNet.set_istate(['A', 'B', 'C'], {(0, 0, 0): 0.2, (1, 0, 1): 0.5, (0, 1, 1): 0.3})
+        matrixNet.set_istate_distribution(
+            ['A', 'B', 'C'],
+            [[1, 0, 1], [0, 0, 0], [0, 1, 1], [1, 0, 1]],
+            [0.25, 0.2, 0.3, 0.25]
+        )
+        self.assertEqual(matrixNet.str_istate(), dictNet.str_istate())
+        self.assertEqual(dict(matrixNet.get_istate()[('A', 'B', 'C')]), {(0, 0, 0): 0.2, (1, 0, 1): 0.5, (0, 1, 1): 0.3})
+
+        # Invalid states are rejected
+        matrixNet.set_istate_distribution(['A', 'B'], [[0, 2]], [1])
+        matrixNet.set_istate_distribution(['A', 'B'], [[0, 1]], [0.5, 0.5])
+        self.assertEqual(matrixNet.str_istate(), dictNet.str_istate())
+
+    def test_influence_graph(self):
+
+        testNet = Network([
+            Node('A', 'B & !C', 1, 1),
+            Node('B', 'A', 1, 1),
+            Node('C', 'C', 1, 1),
+            Node('D', 'A', '@logic ? $rate_D : 0.0', '@logic ? 0.0 : 1E308'),
+            Node('E', 'NOT D', 1, 1),
+        ])
+
+        self.assertEqual(testNet['D'].get_symbols(), frozenset(['A']))
+        self.assertEqual(testNet.get_regulators('A'), ['B', 'C'])
+        self.assertEqual(testNet.get_targets('A'), ['B', 'D'])
+        self.assertEqual(testNet.get_upstream_nodes('D'), ['A', 'B', 'C', 'D'])
+        self.assertEqual(testNet.get_downstream_nodes(['B']), ['A', 'B', 'D', 'E'])
+        self.assertEqual(sorted(testNet.get_influence_graph().edges()), [
+            ('A', 'B'), ('A', 'D'), ('B', 'A'), ('C', 'A'), ('C', 'C'), ('D', 'E')
+        ])
+
+        # The index follows the modifications of the nodes
+        testNet['C'].set_logic('E')
+        self.assertEqual(testNet.get_upstream_nodes('C'), ['A', 'B', 'C', 'D', 'E'])
+        testNet['D'].rt_up = '@logic ? 1.0 : 0.0'
+        testNet.add_node('F')
+        testNet['F'].set_logic('E')
+        self.assertEqual(testNet.get_targets('E'), ['C', 'F'])
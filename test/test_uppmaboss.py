@@ -7,6 +7,7 @@ matplotlib.use('Agg')
 from unittest import TestCase
 from maboss import load, UpdatePopulation
 from os.path import dirname, join
+import random
 
 
 class TestUpPMaBoSS(TestCase):
@@ -137,3 +138,35 @@ class TestUpPMaBoSSWrite(TestCase):
 			self.assertAlmostEqual(pop_ratio, expected_pop_ratios[i])
 
 
+
+class TestUpPMaBoSSFormulas(TestCase):
+	def test_compiled_formulas(self):
+
+		from maboss.upp.formulas import UppFormula, make_state_matrix, varDef_Upp
+		import numpy as np
+
+		node_list = ["A", "B", "C"]
+		node_index = {name: i for i, name in enumerate(node_list)}
+		states = [["A"], ["A", "B"], ["<nil>"], ["B", "C"]]
+		probs = np.array([0.125, 0.25, 0.125, 0.5])
+		state_matrix = make_state_matrix(states, node_index)
+
+		formula = UppFormula("$k*p[(A,B) = (1,0)] + p[C = 0]*#pop_ratio", node_list)
+		self.assertEqual(formula.probabilities(state_matrix, probs), [0.125, 0.5])
+		self.assertEqual(formula.substitute(state_matrix, probs, 2.0), "$k*0.125 + 0.5*2.0;")
+		self.assertEqual(varDef_Upp(formula.formula, states, probs.tolist()), "$k*0.125 + 0.5*#pop_ratio;")
+
+		# Nodes which are not in the model never match
+		self.assertEqual(UppFormula("p[D=1]", node_list).probabilities(state_matrix, probs), [0.0])
+		self.assertAlmostEqual(UppFormula("p[D=0] - p[A=1]", node_list).evaluate(state_matrix, probs, 1.0), 0.625)
+
+		rand_value = UppFormula("p[A=1]*#rand", node_list).evaluate(state_matrix, probs, 1.0)
+		self.assertTrue(0 <= rand_value <= 0.375)
+
+		# A random generator of its own draws the same #rand for the same seed, without using the random module
+		random_state = random.getstate()
+		self.assertEqual(
+			UppFormula("p[A=1]*#rand", node_list).evaluate(state_matrix, probs, 1.0, random.Random(42)),
+			UppFormula("p[A=1]*#rand", node_list).evaluate(state_matrix, probs, 1.0, random.Random(42))
+		)
+		self.assertEqual(random.getstate(), random_state)
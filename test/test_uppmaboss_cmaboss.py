@@ -7,6 +7,7 @@ matplotlib.use('Agg')
 from unittest import TestCase
 from maboss import load, UpdatePopulation
 from os.path import dirname, join
+import random
 
 
 class TestUpPMaBoSScMaBoSS(TestCase):
@@ -56,3 +57,205 @@ class TestUpPMaBoSScMaBoSS(TestCase):
 		for i, pop_ratio in enumerate(pop_ratios):
 			self.assertAlmostEqual(pop_ratio, expected_pop_ratios[i])
 
+
+class TestUpPMaBoSScMaBoSSReplicates(TestCase):
+
+	def test_uppmaboss_cmaboss_replicates(self):
+
+		sim = load(join(dirname(__file__), "CellFateModel.bnd"), join(dirname(__file__), "CellFateModel_1h.cfg"))
+		sim.param["sample_count"] = 1000
+		uppmaboss_model = UpdatePopulation(sim, join(dirname(__file__), "CellFate_1h.upp"))
+		uppmaboss_model.setStepNumber(2)
+		replicates = uppmaboss_model.run_replicates(3, workers=2, cmaboss=True)
+
+		first_seed = int(sim.param["seed_pseudorandom"])
+		self.assertEqual(replicates.seeds, [first_seed, first_seed+1, first_seed+2])
+		self.assertEqual(replicates.probabilities.shape, (3, 3, len(replicates.states)))
+		self.assertEqual(replicates.pop_ratios.shape, (3, 3))
+
+		pop_ratios = replicates.get_all_population_ratios()
+		self.assertEqual(pop_ratios.iloc[0].tolist(), [1.0, 1.0, 1.0])
+		self.assertNotEqual(pop_ratios.iloc[1, 0], pop_ratios.iloc[1, 1])
+		self.assertAlmostEqual(replicates.get_population_ratios().iloc[2], pop_ratios.iloc[2].mean())
+		self.assertAlmostEqual(replicates.get_population_ratios(quantile=0.5).iloc[2], pop_ratios.iloc[2].median())
+
+		# Each replicate is the same as a single run with its seed
+		single = uppmaboss_model.copy()
+		single.model.param["seed_pseudorandom"] = first_seed+1
+		single.random_generator = random.Random(first_seed+1)
+		single_pop_ratios = single.run(cmaboss=True).get_population_ratios().values.tolist()
+		for i, pop_ratio in enumerate(single_pop_ratios):
+			self.assertAlmostEqual(pop_ratio, replicates.get_population_ratios(replicate=1).iloc[i])
+
+		table = replicates.get_stepwise_probability_distribution()
+		self.assertEqual(table.columns[0], "PopRatio")
+		for step in range(3):
+			self.assertAlmostEqual(table.iloc[step, 1:].sum(), 1.0)
+
+class TestUpPMaBoSScMaBoSSResume(TestCase):
+
+	def test_uppmaboss_cmaboss_resume(self):
+
+		from maboss.upp.cmaboss_results import CMaBoSSUpdatePopulationResults
+		from unittest import mock
+		import shutil, tempfile, os
+
+		sim = load(join(dirname(__file__), "CellFateModel.bnd"), join(dirname(__file__), "CellFateModel_1h.cfg"))
+		sim.param["sample_count"] = 1000
+		uppmaboss_model = UpdatePopulation(sim, join(dirname(__file__), "CellFate_1h.upp"))
+		uppmaboss_model.setStepNumber(4)
+		expected = uppmaboss_model.run(cmaboss=True)
+
+		workdir = tempfile.mkdtemp()
+		try:
+			# Interrupt the run at step 3
+			run_step = CMaBoSSUpdatePopulationResults._run_step
+			def interrupted_run_step(self, simulation, sim_workdir):
+				if sim_workdir.endswith("Step_3"):
+					os.makedirs(sim_workdir)
+					raise KeyboardInterrupt()
+				return run_step(self, simulation, sim_workdir)
+
+			with mock.patch.object(CMaBoSSUpdatePopulationResults, "_run_step", interrupted_run_step):
+				with self.assertRaises(KeyboardInterrupt):
+					uppmaboss_model.run(join(workdir, "run"), cmaboss=True)
+
+			self.assertFalse(os.path.exists(join(workdir, "run", "PopRatios.csv")))
+
+			resumed = uppmaboss_model.run(join(workdir, "run"), cmaboss=True, resume=True)
+			self.assertEqual(len(resumed.results), 5)
+			pop_ratios = resumed.get_population_ratios().values.tolist()
+			expected_pop_ratios = expected.get_population_ratios().values.tolist()
+			self.assertEqual(len(pop_ratios), len(expected_pop_ratios))
+			for pop_ratio, expected_pop_ratio in zip(pop_ratios, expected_pop_ratios):
+				self.assertAlmostEqual(pop_ratio, expected_pop_ratio)
+
+			self.assertAlmostEqual(
+				resumed.get_stepwise_probability_distribution().iloc[4, 1:].max(),
+				expected.get_stepwise_probability_distribution().iloc[4, 1:].max()
+			)
+
+			# The run is now complete, resuming restores it
+			restored = uppmaboss_model.run(join(workdir, "run"), cmaboss=True, resume=True)
+			self.assertEqual(restored.get_population_ratios().values.tolist(), resumed.get_population_ratios().values.tolist())
+		finally:
+			shutil.rmtree(workdir)
+
+	def test_uppmaboss_resume_unreadable_checkpoint(self):
+
+		import shutil, tempfile, os
+		from maboss.upp.checkpoint import checkpoint_filename
+
+		sim = load(join(dirname(__file__), "CellFateModel.bnd"), join(dirname(__file__), "CellFateModel_1h.cfg"))
+		uppmaboss_model = UpdatePopulation(sim, join(dirname(__file__), "CellFate_1h.upp"))
+		uppmaboss_model.setStepNumber(4)
+
+		workdir = tempfile.mkdtemp()
+		try:
+			# A checkpoint which can't be read stops the run, without removing the finished steps
+			os.makedirs(join(workdir, "Step_0"))
+			with open(join(workdir, checkpoint_filename), "wb") as checkpoint_file:
+				checkpoint_file.write(b"not a checkpoint")
+
+			for cmaboss in [True, False]:
+				with self.assertRaises(ValueError):
+					uppmaboss_model.run(workdir, cmaboss=cmaboss, resume=True)
+				self.assertTrue(os.path.exists(join(workdir, "Step_0")))
+				self.assertTrue(os.path.exists(join(workdir, checkpoint_filename)))
+		finally:
+			shutil.rmtree(workdir)
+
+class TestUpPMaBoSScMaBoSSRetention(TestCase):
+
+	def test_uppmaboss_cmaboss_retention(self):
+
+		import numpy as np
+		sim = load(join(dirname(__file__), "CellFateModel.bnd"), join(dirname(__file__), "CellFateModel_1h.cfg"))
+		sim.param["sample_count"] = 1000
+		uppmaboss_model = UpdatePopulation(sim, join(dirname(__file__), "CellFate_1h.upp"))
+		uppmaboss_model.setStepNumber(3)
+
+		full = uppmaboss_model.run(cmaboss=True)
+		expected_states = full.get_stepwise_probability_distribution()
+		expected_nodes = full.get_nodes_stepwise_probability_distribution(["Survival", "NonACD", "Apoptosis"])
+
+		for retention in ["last_states", "disk"]:
+			compact = uppmaboss_model.run(cmaboss=True, retention=retention)
+			self.assertEqual(compact.results, [])
+			self.assertEqual(len(compact.last_states), 4)
+
+			states = compact.get_stepwise_probability_distribution()
+			self.assertEqual(set(states.columns), set(expected_states.columns))
+			self.assertTrue(np.allclose(states.loc[:, expected_states.columns].values, expected_states.values))
+
+			nodes = compact.get_nodes_stepwise_probability_distribution(["Survival", "NonACD", "Apoptosis"])
+			self.assertTrue(np.allclose(nodes.loc[:, expected_nodes.columns].values, expected_nodes.values))
+
+		self.assertIsNone(uppmaboss_model.run(cmaboss=True, retention="none"))
+
+class TestUpPMaBoSScMaBoSSDistributions(TestCase):
+
+	def test_uppmaboss_cmaboss_distributions(self):
+
+		sim = load(join(dirname(__file__), "CellFateModel.bnd"), join(dirname(__file__), "CellFateModel_1h.cfg"))
+		sim.param["sample_count"] = 1000
+		uppmaboss_model = UpdatePopulation(sim, join(dirname(__file__), "CellFate_1h.upp"))
+		uppmaboss_model.setStepNumber(3)
+		uppmaboss_sim = uppmaboss_model.run(cmaboss=True)
+
+		states = uppmaboss_sim.get_stepwise_probability_distribution()
+		nodes = uppmaboss_sim.get_nodes_stepwise_probability_distribution(["NFkB", "Survival", "Unknown"])
+		self.assertEqual(nodes.columns.tolist(), ["PopRatio", "NFkB", "Survival", "Unknown"])
+		self.assertEqual(nodes["PopRatio"].tolist(), states["PopRatio"].tolist())
+		self.assertEqual(nodes["Unknown"].tolist(), [0.0]*4)
+
+		for step in range(4):
+			expected = sum(
+				states.loc[step, state] for state in states.columns[1:]
+				if "NFkB" in state.split(" -- ")
+			)
+			self.assertAlmostEqual(nodes.loc[step, "NFkB"], expected)
+
+		included = uppmaboss_sim.get_stepwise_probability_distribution(include=["NFkB"], exclude=["Survival"])
+		self.assertEqual(
+			included.columns.tolist(),
+			[state for state in states.columns[1:] if "NFkB" in state.split(" -- ") and "Survival" not in state.split(" -- ")]
+		)
+		excluded = uppmaboss_sim.get_stepwise_probability_distribution(exclude=["NFkB"])
+		self.assertEqual(excluded.columns[0], "PopRatio")
+		self.assertEqual(len(excluded.columns) + len(uppmaboss_sim.get_stepwise_probability_distribution(include=["NFkB"]).columns), len(states.columns))
+
+class TestUpPMaBoSScMaBoSSSweep(TestCase):
+
+	def test_uppmaboss_cmaboss_sweep(self):
+
+		sim = load(join(dirname(__file__), "CellFateModel.bnd"), join(dirname(__file__), "CellFateModel_1h.cfg"))
+		sim.param["sample_count"] = 500
+		uppmaboss_model = UpdatePopulation(sim, join(dirname(__file__), "CellFate_1h.upp"))
+		uppmaboss_model.setStepNumber(2)
+
+		table = uppmaboss_model.run_sweep(
+			parameters={"$DivRate": [1/24, 1/6]},
+			formulas={"$TNF_induc": ["$ProdTNF_NFkB*p[(NFkB,Death) = (1,0)]", "0*p[NFkB=1]"]},
+			workers=2, cmaboss=True, nodes=["Survival", "Division"]
+		)
+
+		self.assertEqual(len(table), 4)
+		self.assertEqual(table.index.name, "point")
+		self.assertEqual(table["parameter"]["$DivRate"].tolist(), [1/24, 1/24, 1/6, 1/6])
+		self.assertEqual(table["formula"]["$TNF_induc"].tolist()[1], "0*p[NFkB=1]")
+		self.assertEqual(table["pop_ratio"].shape, (4, 3))
+		self.assertEqual(table["final_nodes"].columns.tolist(), ["Survival", "Division"])
+
+		# Each point is the same as a single run with its overrides
+		single = uppmaboss_model.copy()
+		single.model.param["$DivRate"] = 1/6
+		single.setExternalVariable("$TNF_induc", "0*p[NFkB=1]", overwrite=True)
+		single_pop_ratios = single.run(cmaboss=True).get_population_ratios().values.tolist()
+		for i, pop_ratio in enumerate(single_pop_ratios):
+			self.assertAlmostEqual(pop_ratio, table["pop_ratio"].iloc[3, i])
+
+		samples = uppmaboss_model.run_sweep(parameters={"$DivRate": [1/24, 1/6]}, nodes_init={"Division": [0, 0.5]}, grid=False, workers=1, cmaboss=True)
+		self.assertEqual(len(samples), 2)
+		self.assertEqual(samples["nodes_init"]["Division"].tolist(), [0, 0.5])
+		self.assertIsNone(uppmaboss_model.run_sweep(parameters={"$DivRate": [1/24, 1/6]}, nodes_init={"Division": [0]}, grid=False))